@@ -0,0 +1,99 @@
+"""
+Config driven construction of the optional, heavy driver backends: the jacket database (torch/faiss), the OCR reader
+(easyocr) and the splash and results parsers built on them. Every backend is imported inside the branch that enables
+it, so a driver with them switched off never loads torch, faiss or easyocr (see `ddrcv.misc.import_report`).
+
+    "jacket_database": {
+        "enabled": True,
+        "prebuilt_database": '/path/to/db',
+        "cache_dir": '/path/to/cache',
+        "index": {"index_type": "flat"},                      # Optional, see DatabaseLookup
+        "lookup_cache": {"capacity": 64, "max_distance": 16}  # Optional, see LookupCache
+    },
+    "ocr": {
+        "enabled": True,
+        "backend": "singleton",  # "service" runs easyocr in a separate warm process (see OcrService)
+        "service": {"timeout": 30, "load_timeout": 300}  # Optional OcrService options
+    },
+    "splash": {
+        "enabled": True,  # Needs the jacket database and OCR
+        "jitter": 0,
+        "recognize_only": False
+    },
+    "results": {
+        "parse": True,  # Needs OCR, and uses the jacket database if it is enabled
+        "recognize_only": False,
+        ...
+    }
+"""
+
+OCR_BACKENDS = ('singleton', 'service')
+
+
+def create_jacket_database(db_config, logger):
+    """
+    :return: DatabaseLookup, wrapped in a LookupCache if configured, or None if the jacket database is disabled
+    """
+    if not db_config.get('enabled', False):
+        return None
+
+    from ddrcv.jacket_database.database.database import DatabaseLookup
+    logger.info(f'[create_jacket_database] Loading {db_config["prebuilt_database"]}')
+    db = DatabaseLookup.from_prebuilt(db_config['prebuilt_database'], encoder_cache=db_config['cache_dir'],
+                                      **db_config.get('index', {}))
+    if 'lookup_cache' in db_config:
+        from ddrcv.jacket_database.database.lookup_cache import LookupCache
+        logger.info('[create_jacket_database] Caching lookups')
+        db = LookupCache(db, **db_config['lookup_cache'])
+    return db
+
+
+def create_ocr_reader(ocr_config, logger):
+    """
+    :return: easyocr.Reader singleton or OcrService, or None if OCR is disabled
+    """
+    if not ocr_config.get('enabled', False):
+        return None
+
+    backend = ocr_config.get('backend', 'singleton')
+    if backend == 'singleton':
+        from ddrcv.ocr import get_ocr_singleton
+        logger.info('[create_ocr_reader] Loading easyocr')
+        return get_ocr_singleton()
+    elif backend == 'service':
+        from ddrcv.ocr import OcrService
+        logger.info('[create_ocr_reader] Starting OcrService')
+        return OcrService(**ocr_config.get('service', {}))
+
+    msg = f'[create_ocr_reader] Unknown OCR backend {backend}. Valid options are one of {list(OCR_BACKENDS)}.'
+    logger.error(msg)
+    raise ValueError(msg)
+
+
+def create_parsers(config, reader, db, logger):
+    """
+    :param reader: See `create_ocr_reader`
+    :param db: See `create_jacket_database`
+    :return: (splash_parser, results_parser), each None if disabled in config
+    """
+    splash_parser = None
+    splash_config = dict(config.get('splash', {}))
+    if splash_config.pop('enabled', False):
+        if reader is None or db is None:
+            msg = '[create_parsers] Splash parsing needs "ocr" and "jacket_database" to be enabled'
+            logger.error(msg)
+            raise ValueError(msg)
+        from ddrcv.state.splash_parser import SplashParser
+        splash_parser = SplashParser(reader, db, do_name=False, **splash_config)
+
+    results_parser = None
+    results_config = config.get('results', {})
+    if results_config.get('parse', False):
+        if reader is None:
+            msg = '[create_parsers] Results parsing needs "ocr" to be enabled'
+            logger.error(msg)
+            raise ValueError(msg)
+        from ddrcv.state.results_parser import ResultsParser
+        results_parser = ResultsParser(reader, db, recognize_only=results_config.get('recognize_only', False))
+
+    return splash_parser, results_parser
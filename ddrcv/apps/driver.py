@@ -7,11 +7,7 @@ os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
 from enum import Enum, auto
 from pprint import pprint
 
-from ddrcv.discord.song_results_embed import push_song_results
 from ddrcv.misc.screenshot import Screenshot
-from ddrcv.ocr import get_ocr_singleton
-from ddrcv.state.results_parser import ResultsParser
-from ddrcv.state.splash_parser import SplashParser
 
 
 import logging
@@ -21,9 +17,13 @@ import cv2
 
 # from ddrcv.diagnostics.diagnostics_logger import DiagnosticsLogger
 # from ddrcv.diagnostics.diagnostics_wrapper import DiagnosticsWrapper
+from ddrcv.ingest.replay_frame_fetcher import ReplayFrameFetcher
 from ddrcv.ingest.rtsp_frame_fetcher import RTSPFrameFetcher
-from ddrcv.jacket_database.database.database import DatabaseLookup
+from ddrcv.apps.backends import create_jacket_database, create_ocr_reader, create_parsers
+from ddrcv.misc.async_parser import AsyncParser
 from ddrcv.score.score_extractor import ScoreExtractor
+from ddrcv.state.state_classifier import StateClassifier
+from ddrcv.state.state_tracker import StateTracker
 from ddrcv.state.states import StateRotation
 from ddrcv.publish.websocket_publisher import WebSocketPublisher
 
@@ -33,7 +33,7 @@ def create_frame_fetcher(ingest_config, logger):
     keys = list(ingest_config.keys())
 
     if len(keys) > 1:
-        msg = f'[create_frame_fetcher] Too many ingest type specifiers {keys}. Valid options are one of ["rtsp"].'
+        msg = f'[create_frame_fetcher] Too many ingest type specifiers {keys}. Valid options are one of ["simple", "rtsp", "replay"].'
         logger.error(msg)
         raise ValueError(msg)
 
@@ -43,8 +43,11 @@ def create_frame_fetcher(ingest_config, logger):
     elif 'rtsp' in keys:
         logger.info('[create_frame_fetcher] Creating RTSPFrameFetcher')
         return RTSPFrameFetcher.from_config(ingest_config['rtsp'], logger=logger)
+    elif 'replay' in keys:
+        logger.info('[create_frame_fetcher] Creating ReplayFrameFetcher')
+        return ReplayFrameFetcher.from_config(ingest_config['replay'], logger=logger)
 
-    msg = f'[create_frame_fetcher] Failed to find implemented frame fetcher for ingest mode {keys[0]}. Valid options are one of ["rtsp"].'
+    msg = f'[create_frame_fetcher] Failed to find implemented frame fetcher for ingest mode {keys[0]}. Valid options are one of ["simple", "rtsp", "replay"].'
     logger.error(msg)
     raise ValueError(msg)
 
@@ -77,20 +80,40 @@ def main(config, logger):
     fetcher = create_frame_fetcher(config['ingest'], logger)
     fetcher.start()
 
-    state_determination = StateRotation(**config['state'])
-    score_extractor = ScoreExtractor(config['score_extractor']['glyph_dir'])
-    # db = DatabaseLookup.from_prebuilt('../jacket_database/output/db_effnetb0.pkl')
-    # db = DatabaseLookup.from_prebuilt(config['jacket_database']['prebuilt_database'],
-    #                                   encoder_cache=config['jacket_database']['cache_dir'])
+    state_config = dict(config['state'])
+    compiled_states = state_config.pop('compiled', False)
+    state_determination = StateRotation(**state_config)
+    if compiled_states:
+        # Evaluate every state template in a single vectorized pass
+        state_determination = StateClassifier(state_determination)
+    if 'state_tracker' in config:
+        # Require a number of consecutive agreeing frames before acting on a state change
+        state_determination = StateTracker(state_determination, **config['state_tracker'])
+    score_extractor = ScoreExtractor(**config['score_extractor'])
     publisher = create_publisher(config['publish'], logger=logger)
     publisher.start()
 
     screenshot = Screenshot(config['results']['screenshot_directory'],
                             timestamp_fmt=config['results']['timestamp_format'])
 
-    # reader = get_ocr_singleton()  # this needs to run only once to load the model into memory
-    # results_parser = ResultsParser(reader, db)
-    # splash_parser = SplashParser(reader, db, do_name=False)
+    # Heavy backends (torch, faiss, easyocr, discord) are only imported when the feature using them is enabled
+    if config['results'].get('discord', False):
+        from ddrcv.discord.song_results_embed import push_song_results
+
+    # The jacket database, OCR and the parsers using them are only loaded when enabled in config
+    db = create_jacket_database(config.get('jacket_database', {}), logger)
+    reader = create_ocr_reader(config.get('ocr', {}), logger)
+    splash_parser, results_parser = create_parsers(config, reader, db, logger)
+
+    # The parsers run on a shared background thread, so the state/score loop never waits on the encoder or OCR.
+    # A splash job is replaced by the next song's, results jobs are queued so no song's results are dropped.
+    splash_worker = None
+    if splash_parser is not None:
+        splash_worker = AsyncParser(splash_parser, name='splash', logger=logger)
+    results_worker = None
+    if results_parser is not None:
+        results_worker = AsyncParser(results_parser, name='results', discard_pending=False, logger=logger)
+    splash_submitted = False
 
     publish_info = dict()
     publish_info['state'] = 'unknown'
@@ -99,13 +122,15 @@ def main(config, logger):
     publish_info['score'] = None
 
     results_substep = ResultsSubstep.READY
+    results_process_time = None
 
     try:
         while True:
-            frame = fetcher.get_frame()
-            if frame is not None:
-                frame_rgb = frame[..., ::-1].copy()
-                state_tag, state_data = state_determination.match(frame[..., ::-1])
+            fetched = fetcher.get_frame()
+            if fetched is not None:
+                # Borrowed view into the fetcher's frame ring, valid until the next get_frame
+                frame = fetched.image
+                state_tag, state_data = state_determination.match(frame)
 
                 publish_info['state'] = state_tag
 
@@ -117,16 +142,25 @@ def main(config, logger):
                     publish_info['players'] = (True, True)
                     publish_info['song'] = None
                     publish_info['score'] = None
+                    # A new song is being picked, so a splash parse that's still running is for the previous one
+                    if splash_worker is not None:
+                        splash_worker.cancel()
+                    splash_submitted = False
 
                 # ----------------------------------------------
                 # SONG SPLASH
                 # Determine player presence, difficulty levels, and song
                 # ----------------------------------------------
-                if state_tag == 'song_splash':
+                if state_tag == 'song_splash' and state_data is not None:
                     score_extractor.set_presence(state_data['p1_present'], state_data['p2_present'])
                     publish_info['players'] = (state_data['p1_present'], state_data['p2_present'])
 
-                    ret = splash_parser.parse(frame_rgb, publish_info['players'])
+                    if splash_worker is not None and not splash_submitted:
+                        splash_worker.submit(frame, publish_info['players'])
+                        splash_submitted = True
+
+                ret = splash_worker.poll() if splash_worker is not None else None
+                if ret is not None:
                     publish_info['song'] = {
                         'song': str(ret['song']),
                         'confidence': ret['song_confidence'],
@@ -138,9 +172,10 @@ def main(config, logger):
                 # SONG PLAYING
                 # Realtime score extraction
                 # ----------------------------------------------
-                if state_tag == 'song_playing':
+                # Data is None while the tracker holds song_playing over frames that no longer show gameplay
+                if state_tag == 'song_playing' and state_data is not None:
                     if state_data['lanes_present']:
-                        score_ret = score_extractor.extract(frame_rgb, debug=False)
+                        score_ret = score_extractor.extract(frame, debug=False)
                         publish_info['score'] = score_ret['data']
                         # print(publish_info)
 
@@ -163,28 +198,38 @@ def main(config, logger):
                         # Additionally, we only fully process the results screen once, or we risk getting
                         # duplicate images if multiple processing attempts span different minutes/seconds (depending on
                         # provided time format).
+                        # The delay is checked against the clock instead of sleeping, so frames keep flowing.
                         if results_substep == ResultsSubstep.READY:
-                            time.sleep(config['results']['processing_delay'])
+                            results_process_time = time.time() + config['results']['processing_delay']
                             results_substep = ResultsSubstep.PROCESS
-                        elif results_substep == ResultsSubstep.PROCESS:
-                            screenshot_file = screenshot.save(frame_rgb)
-                            score_results = results_parser.parse(frame_rgb)
-                            pprint(score_results)
-                            if config['results'].get('discord', False):
-                                push_song_results(score_results, screenshot_path=screenshot_file)
+                        elif results_substep == ResultsSubstep.PROCESS and time.time() >= results_process_time:
+                            screenshot_file = screenshot.save(frame)
                             print('screenshot_file: ', screenshot_file)
+                            if results_worker is not None:
+                                results_worker.submit(frame, context=screenshot_file)
                             results_substep = ResultsSubstep.DONE
 
                 if state_tag != 'results':
                     results_substep = ResultsSubstep.READY
 
+                # Results jobs are never discarded (discard_pending=False, no cancel), the score is still worth posting
+                # after the screen moves on
+                score_results = results_worker.poll() if results_worker is not None else None
+                if score_results is not None:
+                    pprint(score_results)
+                    if config['results'].get('discord', False):
+                        push_song_results(score_results, screenshot_path=results_worker.last_context)
+
                 # print(publish_info)
-                publisher.send_message(publish_info)
+                publisher.send_message(publish_info, capture_time=fetched.timestamp)
 
                 # Display the frame (optional)
                 cv2.imshow('RTSP Stream', frame)
                 if cv2.waitKey(1) & 0xFF == ord('q'):
                     break
+            elif fetcher.finished:
+                logger.info('Frame source finished')
+                break
             else:
                 # Wait until a frame is available
                 time.sleep(0.01)
@@ -192,6 +237,13 @@ def main(config, logger):
         pass
     finally:
         # Clean up
+        if isinstance(state_determination, StateTracker):
+            logger.info(f'State debounce latency: {state_determination.stats()}')
+        logger.info(f'Ingest: {fetcher.stats()}')
+        logger.info(f'Capture to websocket latency: {publisher.stats()}')
+        for worker in (splash_worker, results_worker):
+            if worker is not None:
+                worker.stop()
         fetcher.stop()
         publisher.stop()
         cv2.destroyAllWindows()
@@ -206,7 +258,7 @@ if __name__ == "__main__":
         "ingest": {
             "simple": {
                 "uri": 0,
-                "queue_size": 1,
+                "ring_size": 3,
                 "reconnect_delay": 5,
                 "width": 1920,
                 "height": 1080,
@@ -222,10 +274,14 @@ if __name__ == "__main__":
             }
         },
         "score_extractor": {
-            "glyph_dir": None
+            "glyph_dir": None,
+            "batched": True,
+            "mode": "fixed_pitch",  # "search" to template search the whole score ROI
+            "concurrent": False  # Extract P1 and P2 in parallel on the worker pool (multi-core hosts)
         },
         "state": {
             "pkl_dir": None,
+            "compiled": False,  # StateClassifier hashes every template; slower than the early-exit rotation here
             "states": [
                 'results',
                 'song_playing',
@@ -233,15 +289,37 @@ if __name__ == "__main__":
                 'song_splash'
             ]
         },
+        "state_tracker": {
+            "min_frames": 3,
+            "state_frames": {
+                "song_playing": 1
+            }
+        },
         "jacket_database": {
+            "enabled": False,
             "prebuilt_database": r'/home/tim/persistent/database/db_effnetb0-20241126.pkl',
-            "cache_dir": r'/home/tim/persistent/database/cache'
+            "cache_dir": r'/home/tim/persistent/database/cache',
+            "lookup_cache": {
+                "capacity": 64,
+                "max_distance": 16
+            }
+        },
+        "ocr": {
+            "enabled": False,
+            "backend": "singleton"  # "service" to run easyocr in a separate warm process
+        },
+        "splash": {
+            "enabled": False,  # Needs jacket_database and ocr
+            "jitter": 0,
+            "recognize_only": False
         },
         "results": {
             "screenshot_directory": r'/home/tim/persistent/screenshots',
             "timestamp_format": "%Y%m%d_%H%M",
             "processing_delay": 5,
             "only_duo": False,
+            "parse": False,  # Needs ocr, uses jacket_database if enabled
+            "recognize_only": False,
             "discord": False
         },
         "driver_debug": {
@@ -2,11 +2,10 @@ import argparse
 import os
 from pathlib import Path
 
-from ddrcv.discord.song_results_embed import push_song_results, push_song_results_screenshot
-
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
 
 from enum import Enum, auto
+from pprint import pprint
 
 
 import logging
@@ -14,7 +13,9 @@ import time
 
 import cv2
 
+from ddrcv.apps.backends import create_jacket_database, create_ocr_reader, create_parsers
 from ddrcv.misc.screenshot import Screenshot
+from ddrcv.ingest.replay_frame_fetcher import ReplayFrameFetcher
 from ddrcv.ingest.rtsp_frame_fetcher import RTSPFrameFetcher
 from ddrcv.ingest.simple_frame_fetcher import SimpleFrameFetcher
 from ddrcv.score.score_extractor import ScoreExtractor
@@ -27,7 +28,7 @@ def create_frame_fetcher(ingest_config, logger):
     keys = list(ingest_config.keys())
 
     if len(keys) > 1:
-        msg = f'[create_frame_fetcher] Too many ingest type specifiers {keys}. Valid options are one of ["rtsp"].'
+        msg = f'[create_frame_fetcher] Too many ingest type specifiers {keys}. Valid options are one of ["simple", "rtsp", "replay"].'
         logger.error(msg)
         raise ValueError(msg)
 
@@ -37,8 +38,11 @@ def create_frame_fetcher(ingest_config, logger):
     elif 'rtsp' in keys:
         logger.info('[create_frame_fetcher] Creating RTSPFrameFetcher')
         return RTSPFrameFetcher.from_config(ingest_config['rtsp'], logger=logger)
+    elif 'replay' in keys:
+        logger.info('[create_frame_fetcher] Creating ReplayFrameFetcher')
+        return ReplayFrameFetcher.from_config(ingest_config['replay'], logger=logger)
 
-    msg = f'[create_frame_fetcher] Failed to find implemented frame fetcher for ingest mode {keys[0]}. Valid options are one of ["rtsp"].'
+    msg = f'[create_frame_fetcher] Failed to find implemented frame fetcher for ingest mode {keys[0]}. Valid options are one of ["simple", "rtsp", "replay"].'
     logger.error(msg)
     raise ValueError(msg)
 
@@ -72,10 +76,7 @@ def main(config, logger):
     fetcher.start()
 
     state_determination = StateRotation(**config['state'])
-    score_extractor = ScoreExtractor(config['score_extractor']['glyph_dir'])
-    # db = DatabaseLookup.from_prebuilt('../jacket_database/output/db_effnetb0.pkl')
-    # db = DatabaseLookup.from_prebuilt(config['jacket_database']['prebuilt_database'],
-    #                                   encoder_cache=config['jacket_database']['cache_dir'])
+    score_extractor = ScoreExtractor(**config['score_extractor'])
     publisher = create_publisher(config['publish'], logger=logger)
     publisher.start()
 
@@ -85,10 +86,14 @@ def main(config, logger):
                                 timestamp_fmt=config['results']['timestamp_format'])
         Path(config['results']['screenshot_directory']).mkdir(parents=True, exist_ok=True)
 
+    # Heavy backends (discord, and torch/faiss/easyocr for the parsers) are only imported when enabled in config
+    if screenshot is not None and config['results'].get('discord', False):
+        from ddrcv.discord.song_results_embed import push_song_results_screenshot
 
-    # reader = get_ocr_singleton()  # this needs to run only once to load the model into memory
-    # results_parser = ResultsParser(reader, db)
-    # splash_parser = SplashParser(reader, db, do_name=False)
+    # The jacket database, OCR and the parsers using them are only loaded when enabled in config
+    db = create_jacket_database(config.get('jacket_database', {}), logger)
+    reader = create_ocr_reader(config.get('ocr', {}), logger)
+    splash_parser, results_parser = create_parsers(config, reader, db, logger)
 
     publish_info = dict()
     publish_info['state'] = 'unknown'
@@ -97,13 +102,15 @@ def main(config, logger):
     publish_info['score'] = None
 
     results_substep = ResultsSubstep.READY
+    splash_parsed = False
 
     try:
         while True:
-            frame = fetcher.get_frame()
-            if frame is not None:
-                frame_rgb = frame[..., ::-1].copy()
-                state_tag, state_data = state_determination.match(frame_rgb)
+            fetched = fetcher.get_frame()
+            if fetched is not None:
+                # Borrowed view into the fetcher's frame ring, valid until the next get_frame
+                frame = fetched.image
+                state_tag, state_data = state_determination.match(frame)
 
                 publish_info['state'] = state_tag
 
@@ -115,30 +122,35 @@ def main(config, logger):
                     publish_info['players'] = (True, True)
                     publish_info['song'] = None
                     publish_info['score'] = None
+                    splash_parsed = False
 
                 # ----------------------------------------------
                 # SONG SPLASH
                 # Determine player presence, difficulty levels, and song
                 # ----------------------------------------------
-                if state_tag == 'song_splash':
+                if state_tag == 'song_splash' and state_data is not None:
                     score_extractor.set_presence(state_data['p1_present'], state_data['p2_present'])
                     publish_info['players'] = (state_data['p1_present'], state_data['p2_present'])
 
-                    # ret = splash_parser.parse(frame_rgb, publish_info['players'])
-                    # publish_info['song'] = {
-                    #     'song': str(ret['song']),
-                    #     'confidence': ret['song_confidence'],
-                    #     'p1_info': ret['p1'],
-                    #     'p2_info': ret['p2']
-                    # }
+                    # Parsed once per song, the jacket and difficulties don't change during the splash
+                    if splash_parser is not None and not splash_parsed:
+                        ret = splash_parser.parse(frame, publish_info['players'])
+                        publish_info['song'] = {
+                            'song': str(ret['song']),
+                            'confidence': ret['song_confidence'],
+                            'p1_info': ret['p1'],
+                            'p2_info': ret['p2']
+                        }
+                        splash_parsed = True
 
                 # ----------------------------------------------
                 # SONG PLAYING
                 # Realtime score extraction
                 # ----------------------------------------------
-                if state_tag == 'song_playing':
+                # Data is None while the tracker holds song_playing over frames that no longer show gameplay
+                if state_tag == 'song_playing' and state_data is not None:
                     if state_data['lanes_present']:
-                        score_ret = score_extractor.extract(frame_rgb, debug=False)
+                        score_ret = score_extractor.extract(frame, debug=False)
                         publish_info['score'] = score_ret['data']
                         # print(publish_info)
 
@@ -165,9 +177,10 @@ def main(config, logger):
                             time.sleep(config['results']['processing_delay'])
                             results_substep = ResultsSubstep.PROCESS
                         elif results_substep == ResultsSubstep.PROCESS:
-                            screenshot_file = screenshot.save(frame_rgb)
-                            # score_results = results_parser.parse(frame_rgb)
-                            # pprint(score_results)
+                            screenshot_file = screenshot.save(frame)
+                            if results_parser is not None:
+                                score_results = results_parser.parse(frame)
+                                pprint(score_results)
                             if config['results'].get('discord', False):
                                 # push_song_results(score_results, screenshot_path=screenshot_file)
                                 push_song_results_screenshot(title='Test', screenshot_path=screenshot_file, webhook_url=config['results'].get('webhook', None))
@@ -178,13 +191,16 @@ def main(config, logger):
                     results_substep = ResultsSubstep.READY
 
                 # print(publish_info)
-                publisher.send_message(publish_info)
+                publisher.send_message(publish_info, capture_time=fetched.timestamp)
 
                 # Display the frame (optional)
                 if config['driver_debug']['render_frame']:
                     cv2.imshow('RTSP Stream', frame)
                     if cv2.waitKey(1) & 0xFF == ord('q'):
                         break
+            elif fetcher.finished:
+                logger.info('Frame source finished')
+                break
             else:
                 # Wait until a frame is available
                 time.sleep(0.01)
@@ -192,6 +208,8 @@ def main(config, logger):
         pass
     finally:
         # Clean up
+        logger.info(f'Ingest: {fetcher.stats()}')
+        logger.info(f'Capture to websocket latency: {publisher.stats()}')
         fetcher.stop()
         publisher.stop()
         if config['driver_debug']['render_frame']:
@@ -232,7 +250,7 @@ if __name__ == "__main__":
         "ingest": {
             "simple": {
                 "uri": camera_uri,
-                "queue_size": 1,
+                "ring_size": 3,
                 "reconnect_delay": 5,
                 "width": 1280,
                 "height": 720,
@@ -248,7 +266,10 @@ if __name__ == "__main__":
             }
         },
         "score_extractor": {
-            "glyph_dir": None
+            "glyph_dir": None,
+            "batched": True,
+            "mode": "fixed_pitch",  # "search" to template search the whole score ROI
+            "concurrent": False  # Extract P1 and P2 in parallel on the worker pool (multi-core hosts)
         },
         "state": {
             "pkl_dir": None,
@@ -262,8 +283,22 @@ if __name__ == "__main__":
             ]
         },
         "jacket_database": {
+            "enabled": False,
             "prebuilt_database": r'/home/tim/persistent/database/db_effnetb0-20241126.pkl',
-            "cache_dir": r'/home/tim/persistent/database/cache'
+            "cache_dir": r'/home/tim/persistent/database/cache',
+            "lookup_cache": {
+                "capacity": 64,
+                "max_distance": 16
+            }
+        },
+        "ocr": {
+            "enabled": False,
+            "backend": "singleton"  # "service" to run easyocr in a separate warm process
+        },
+        "splash": {
+            "enabled": False,  # Needs jacket_database and ocr
+            "jitter": 0,
+            "recognize_only": False
         },
         "results": {
             "enabled": False,
@@ -271,6 +306,8 @@ if __name__ == "__main__":
             "timestamp_format": "%Y%m%d_%H%M",
             "processing_delay": 5,
             "only_duo": False,
+            "parse": False,  # Needs ocr, uses jacket_database if enabled
+            "recognize_only": False,
             "discord": True,
             'webhook': None
         },
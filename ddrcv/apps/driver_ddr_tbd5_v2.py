@@ -2,11 +2,10 @@ import argparse
 import os
 from pathlib import Path
 
-from ddrcv.discord.song_results_embed import push_song_results, push_song_results_screenshot
-
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
 
 from enum import Enum, auto
+from pprint import pprint
 
 
 import logging
@@ -14,10 +13,15 @@ import time
 
 import cv2
 
+from ddrcv.apps.backends import create_jacket_database, create_ocr_reader, create_parsers
 from ddrcv.misc.screenshot import Screenshot
+from ddrcv.ingest.replay_frame_fetcher import ReplayFrameFetcher
 from ddrcv.ingest.rtsp_frame_fetcher import RTSPFrameFetcher
 from ddrcv.ingest.simple_frame_fetcher import SimpleFrameFetcher
 from ddrcv.score.score_extractor import ScoreExtractor
+from ddrcv.state.frame_gate import FrameGate
+from ddrcv.state.state_classifier import StateClassifier
+from ddrcv.state.state_tracker import StateTracker
 from ddrcv.state.tbd5_states import StateRotation
 from ddrcv.publish.websocket_publisher import WebSocketPublisher
 
@@ -27,7 +31,7 @@ def create_frame_fetcher(ingest_config, logger):
     keys = list(ingest_config.keys())
 
     if len(keys) > 1:
-        msg = f'[create_frame_fetcher] Too many ingest type specifiers {keys}. Valid options are one of ["rtsp"].'
+        msg = f'[create_frame_fetcher] Too many ingest type specifiers {keys}. Valid options are one of ["simple", "rtsp", "replay"].'
         logger.error(msg)
         raise ValueError(msg)
 
@@ -37,8 +41,11 @@ def create_frame_fetcher(ingest_config, logger):
     elif 'rtsp' in keys:
         logger.info('[create_frame_fetcher] Creating RTSPFrameFetcher')
         return RTSPFrameFetcher.from_config(ingest_config['rtsp'], logger=logger)
+    elif 'replay' in keys:
+        logger.info('[create_frame_fetcher] Creating ReplayFrameFetcher')
+        return ReplayFrameFetcher.from_config(ingest_config['replay'], logger=logger)
 
-    msg = f'[create_frame_fetcher] Failed to find implemented frame fetcher for ingest mode {keys[0]}. Valid options are one of ["rtsp"].'
+    msg = f'[create_frame_fetcher] Failed to find implemented frame fetcher for ingest mode {keys[0]}. Valid options are one of ["simple", "rtsp", "replay"].'
     logger.error(msg)
     raise ValueError(msg)
 
@@ -71,11 +78,21 @@ def main(config, logger):
     fetcher = create_frame_fetcher(config['ingest'], logger)
     fetcher.start()
 
-    state_determination = StateRotation(**config['state'])
-    score_extractor = ScoreExtractor(config['score_extractor']['glyph_dir'])
-    # db = DatabaseLookup.from_prebuilt('../jacket_database/output/db_effnetb0.pkl')
-    # db = DatabaseLookup.from_prebuilt(config['jacket_database']['prebuilt_database'],
-    #                                   encoder_cache=config['jacket_database']['cache_dir'])
+    state_config = dict(config['state'])
+    compiled_states = state_config.pop('compiled', False)
+    state_determination = StateRotation(**state_config)
+    if compiled_states:
+        # Evaluate every state template in a single vectorized pass
+        state_determination = StateClassifier(state_determination)
+    if 'state_tracker' in config:
+        # Require a number of consecutive agreeing frames before acting on a state change
+        state_determination = StateTracker(state_determination, **config['state_tracker'])
+    score_extractor = ScoreExtractor(**config['score_extractor'])
+
+    # Skip state matching and score extraction on frames that haven't changed since the last processed frame
+    frame_gate = None
+    if 'frame_gate' in config:
+        frame_gate = FrameGate(**config['frame_gate'])
     publisher = create_publisher(config['publish'], logger=logger)
     publisher.start()
 
@@ -85,10 +102,14 @@ def main(config, logger):
                                 timestamp_fmt=config['results']['timestamp_format'])
         Path(config['results']['screenshot_directory']).mkdir(parents=True, exist_ok=True)
 
+    # Heavy backends (discord, and torch/faiss/easyocr for the parsers) are only imported when enabled in config
+    if screenshot is not None and config['results'].get('discord', False):
+        from ddrcv.discord.song_results_embed import push_song_results_screenshot
 
-    # reader = get_ocr_singleton()  # this needs to run only once to load the model into memory
-    # results_parser = ResultsParser(reader, db)
-    # splash_parser = SplashParser(reader, db, do_name=False)
+    # The jacket database, OCR and the parsers using them are only loaded when enabled in config
+    db = create_jacket_database(config.get('jacket_database', {}), logger)
+    reader = create_ocr_reader(config.get('ocr', {}), logger)
+    splash_parser, results_parser = create_parsers(config, reader, db, logger)
 
     publish_info = dict()
     publish_info['state'] = 'unknown'
@@ -96,19 +117,26 @@ def main(config, logger):
     publish_info['song'] = None
     publish_info['score'] = None
 
-    old_p1_score = None
-    old_p2_score = None
-
     results_substep = ResultsSubstep.READY
+    splash_parsed = False
+
+    state_tag, state_data = 'unknown', None
+
+    # Periodically log ingest and publish latency, so it can be watched during an event
+    metrics_interval = config['driver_debug'].get('metrics_interval', 0)
+    last_metrics_time = time.monotonic()
 
     try:
         while True:
-            frame = fetcher.get_frame()
-            if frame is not None:
-                frame_rgb = frame[..., ::-1].copy()
-                state_tag, state_data = state_determination.match(frame_rgb)
-
-                publish_info['state'] = state_tag
+            fetched = fetcher.get_frame()
+            if fetched is not None:
+                # Borrowed view into the fetcher's frame ring, valid until the next get_frame
+                frame = fetched.image
+                # On static frames, reuse the previous (state_tag, state_data) and score
+                frame_changed = frame_gate is None or frame_gate.changed(frame)
+                if frame_changed:
+                    state_tag, state_data = state_determination.match(frame)
+                    publish_info['state'] = state_tag
 
                 # ----------------------------------------------
                 # SONG SELECT
@@ -118,22 +146,26 @@ def main(config, logger):
                     publish_info['players'] = (True, True)
                     publish_info['song'] = None
                     publish_info['score'] = None
+                    splash_parsed = False
 
                 # ----------------------------------------------
                 # SONG SPLASH
                 # Determine player presence, difficulty levels, and song
                 # ----------------------------------------------
-                if state_tag == 'song_splash':
+                if state_tag == 'song_splash' and state_data is not None:
                     score_extractor.set_presence(state_data['p1_present'], state_data['p2_present'])
                     publish_info['players'] = (state_data['p1_present'], state_data['p2_present'])
 
-                    # ret = splash_parser.parse(frame_rgb, publish_info['players'])
-                    # publish_info['song'] = {
-                    #     'song': str(ret['song']),
-                    #     'confidence': ret['song_confidence'],
-                    #     'p1_info': ret['p1'],
-                    #     'p2_info': ret['p2']
-                    # }
+                    # Parsed once per song, the jacket and difficulties don't change during the splash
+                    if splash_parser is not None and not splash_parsed:
+                        ret = splash_parser.parse(frame, publish_info['players'])
+                        publish_info['song'] = {
+                            'song': str(ret['song']),
+                            'confidence': ret['song_confidence'],
+                            'p1_info': ret['p1'],
+                            'p2_info': ret['p2']
+                        }
+                        splash_parsed = True
 
                 # ----------------------------------------------
                 # RESULTS
@@ -158,9 +190,10 @@ def main(config, logger):
                             time.sleep(config['results']['processing_delay'])
                             results_substep = ResultsSubstep.PROCESS
                         elif results_substep == ResultsSubstep.PROCESS:
-                            screenshot_file = screenshot.save(frame_rgb)
-                            # score_results = results_parser.parse(frame_rgb)
-                            # pprint(score_results)
+                            screenshot_file = screenshot.save(frame)
+                            if results_parser is not None:
+                                score_results = results_parser.parse(frame)
+                                pprint(score_results)
                             if config['results'].get('discord', False):
                                 # push_song_results(score_results, screenshot_path=screenshot_file)
                                 push_song_results_screenshot(title='Test', screenshot_path=screenshot_file, webhook_url=config['results'].get('webhook', None))
@@ -171,13 +204,14 @@ def main(config, logger):
                 # SONG PLAYING
                 # Realtime score extraction
                 # ----------------------------------------------
-                if state_tag == 'song_playing':
+                # Data is None while the tracker holds song_playing over frames that no longer show gameplay
+                if state_tag == 'song_playing' and state_data is not None and frame_changed:
                     # if state_data['lanes_present']:
-                    score_ret = score_extractor.extract(frame_rgb, debug=False)
+                    score_ret = score_extractor.extract(frame, debug=False)
                     publish_info['score'] = score_ret['data']
 
-                if state_tag == 'unknown':
-                    score_ret = score_extractor.extract(frame_rgb, debug=False)
+                if state_tag == 'unknown' and frame_changed:
+                    score_ret = score_extractor.extract(frame, debug=False)
                     print('score_ret: ', score_ret)
                     if score_ret['data']['p1_score'] >= 0 or score_ret['data']['p2_score'] >= 0:
                         publish_info['score'] = score_ret['data']
@@ -185,45 +219,30 @@ def main(config, logger):
                     print(score_ret['data'])
                     # print(publish_info)
 
-                # Handle exploding scores due to the dumb rocket
-                if 'score' in publish_info and publish_info['state'] == 'song_playing':
-                    if old_p1_score is None:
-                        old_p1_score = publish_info['score']['p1_score']
-                    if old_p2_score is None:
-                        old_p2_score = publish_info['score']['p2_score']
-
-                    curr_p1 = publish_info['score']['p1_score']
-                    curr_p2 = publish_info['score']['p2_score']
-
-                    if curr_p1 < old_p1_score or curr_p1 > (old_p1_score + 12):
-                        curr_p1 = old_p1_score
-                        print('Overriding P1 score')
-
-                    if curr_p2 < old_p2_score or curr_p2 > (old_p2_score + 12):
-                        curr_p2 = old_p2_score
-                        print('Overriding P2 score')
-
-                    publish_info['score']['p1_score'] = curr_p1
-                    publish_info['score']['p2_score'] = curr_p2
-                    old_p1_score = curr_p1
-                    old_p2_score = curr_p2
-
                 if state_tag != 'song_result':
                     results_substep = ResultsSubstep.READY
 
+                # The score extractor holds back exploding scores (due to the dumb rocket) during a song
                 if state_tag != 'song_playing':
-                    old_p1_score = None
-                    old_p2_score = None
+                    score_extractor.reset()
 
                 # print(publish_info)
                 print(publish_info)
-                publisher.send_message(publish_info)
+                publisher.send_message(publish_info, capture_time=fetched.timestamp)
+
+                if metrics_interval > 0 and time.monotonic() - last_metrics_time > metrics_interval:
+                    logger.info(f'Ingest: {fetcher.stats()}')
+                    logger.info(f'Capture to websocket latency: {publisher.stats()}')
+                    last_metrics_time = time.monotonic()
 
                 # Display the frame (optional)
                 if config['driver_debug']['render_frame']:
                     cv2.imshow('RTSP Stream', frame)
                     if cv2.waitKey(1) & 0xFF == ord('q'):
                         break
+            elif fetcher.finished:
+                logger.info('Frame source finished')
+                break
             else:
                 # Wait until a frame is available
                 time.sleep(0.01)
@@ -231,6 +250,12 @@ def main(config, logger):
         pass
     finally:
         # Clean up
+        if isinstance(state_determination, StateTracker):
+            logger.info(f'State debounce latency: {state_determination.stats()}')
+        if frame_gate is not None:
+            logger.info(f'Frame gate: {frame_gate.stats()}')
+        logger.info(f'Ingest: {fetcher.stats()}')
+        logger.info(f'Capture to websocket latency: {publisher.stats()}')
         fetcher.stop()
         publisher.stop()
         if config['driver_debug']['render_frame']:
@@ -243,6 +268,10 @@ if __name__ == "__main__":
                         help='Choose the camera to use from a list of available cameras')
     parser.add_argument('--debug', action='store_true',
                         help='Turn on debug options')
+    parser.add_argument('--replay', type=str, default=None,
+                        help='Run against a recorded video instead of a camera')
+    parser.add_argument('--realtime', action='store_true',
+                        help='Pace --replay at the video frame rate instead of running as fast as possible')
     args = parser.parse_args()
 
     camera_uri = 0
@@ -271,7 +300,7 @@ if __name__ == "__main__":
         "ingest": {
             "simple": {
                 "uri": camera_uri,
-                "queue_size": 1,
+                "ring_size": 3,
                 "reconnect_delay": 5,
                 "width": 1280,
                 "height": 720,
@@ -287,10 +316,15 @@ if __name__ == "__main__":
             }
         },
         "score_extractor": {
-            "glyph_dir": None
+            "glyph_dir": None,
+            "batched": True,
+            "mode": "fixed_pitch",  # "search" to template search the whole score ROI
+            "concurrent": False,  # Extract P1 and P2 in parallel on the worker pool (multi-core hosts)
+            "max_increment": 12
         },
         "state": {
             "pkl_dir": None,
+            "compiled": False,  # StateClassifier hashes every template; slower than the early-exit rotation here
             "states": [
                 'song_result',
                 'song_playing',
@@ -300,9 +334,34 @@ if __name__ == "__main__":
                 'login'
             ]
         },
+        "state_tracker": {
+            "min_frames": 3,
+            "state_frames": {
+                "song_playing": 1
+            }
+        },
+        "frame_gate": {
+            "step": 8,
+            "threshold": 2.0,
+            "max_skips": 30
+        },
         "jacket_database": {
+            "enabled": False,
             "prebuilt_database": r'/home/tim/persistent/database/db_effnetb0-20241126.pkl',
-            "cache_dir": r'/home/tim/persistent/database/cache'
+            "cache_dir": r'/home/tim/persistent/database/cache',
+            "lookup_cache": {
+                "capacity": 64,
+                "max_distance": 16
+            }
+        },
+        "ocr": {
+            "enabled": False,
+            "backend": "singleton"  # "service" to run easyocr in a separate warm process
+        },
+        "splash": {
+            "enabled": False,  # Needs jacket_database and ocr
+            "jitter": 0,
+            "recognize_only": False
         },
         "results": {
             "enabled": False,
@@ -310,14 +369,25 @@ if __name__ == "__main__":
             "timestamp_format": "%Y%m%d_%H%M",
             "processing_delay": 5,
             "only_duo": False,
+            "parse": False,  # Needs ocr, uses jacket_database if enabled
+            "recognize_only": False,
             "discord": True,
             'webhook': None
         },
         "driver_debug": {
-            "render_frame": args.debug
+            "render_frame": args.debug,
+            "metrics_interval": 60
         }
     }
 
+    if args.replay is not None:
+        config['ingest'] = {
+            "replay": {
+                "video_path": args.replay,
+                "realtime": args.realtime
+            }
+        }
+
     # Configure logging
     logging.basicConfig(
         level=logging.INFO,
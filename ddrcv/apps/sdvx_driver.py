@@ -14,7 +14,10 @@ import time
 
 import cv2
 
+from ddrcv.ingest.replay_frame_fetcher import ReplayFrameFetcher
 from ddrcv.ingest.rtsp_frame_fetcher import RTSPFrameFetcher
+from ddrcv.state.state_classifier import StateClassifier
+from ddrcv.state.state_tracker import StateTracker
 from ddrcv.state.sdvx_states import StateRotation
 from ddrcv.publish.websocket_publisher import WebSocketPublisher
 
@@ -23,7 +26,7 @@ def create_frame_fetcher(ingest_config, logger):
     keys = list(ingest_config.keys())
 
     if len(keys) > 1:
-        msg = f'[create_frame_fetcher] Too many ingest type specifiers {keys}. Valid options are one of ["rtsp"].'
+        msg = f'[create_frame_fetcher] Too many ingest type specifiers {keys}. Valid options are one of ["simple", "rtsp", "replay"].'
         logger.error(msg)
         raise ValueError(msg)
 
@@ -33,8 +36,11 @@ def create_frame_fetcher(ingest_config, logger):
     elif 'rtsp' in keys:
         logger.info('[create_frame_fetcher] Creating RTSPFrameFetcher')
         return RTSPFrameFetcher.from_config(ingest_config['rtsp'], logger=logger)
+    elif 'replay' in keys:
+        logger.info('[create_frame_fetcher] Creating ReplayFrameFetcher')
+        return ReplayFrameFetcher.from_config(ingest_config['replay'], logger=logger)
 
-    msg = f'[create_frame_fetcher] Failed to find implemented frame fetcher for ingest mode {keys[0]}. Valid options are one of ["rtsp"].'
+    msg = f'[create_frame_fetcher] Failed to find implemented frame fetcher for ingest mode {keys[0]}. Valid options are one of ["simple", "rtsp", "replay"].'
     logger.error(msg)
     raise ValueError(msg)
 
@@ -67,7 +73,15 @@ def main(config, logger):
     fetcher = create_frame_fetcher(config['ingest'], logger)
     fetcher.start()
 
-    state_determination = StateRotation(**config['state'])
+    state_config = dict(config['state'])
+    compiled_states = state_config.pop('compiled', False)
+    state_determination = StateRotation(**state_config)
+    if compiled_states:
+        # Evaluate every state template in a single vectorized pass
+        state_determination = StateClassifier(state_determination)
+    if 'state_tracker' in config:
+        # Require a number of consecutive agreeing frames before acting on a state change
+        state_determination = StateTracker(state_determination, **config['state_tracker'])
 
     publisher = create_publisher(config['publish'], logger=logger)
     publisher.start()
@@ -77,12 +91,16 @@ def main(config, logger):
 
     try:
         while True:
-            frame = fetcher.get_frame()
-            if frame is not None:
-                frame_rgb = frame[..., ::-1].copy()
-                state_tag, state_data = state_determination.match(frame_rgb)
+            fetched = fetcher.get_frame()
+            if fetched is not None:
+                # Borrowed view into the fetcher's frame ring, valid until the next get_frame
+                frame = fetched.image
+                state_tag, state_data = state_determination.match(frame)
                 publish_info['state'] = state_tag
-                publisher.send_message(publish_info)
+                publisher.send_message(publish_info, capture_time=fetched.timestamp)
+            elif fetcher.finished:
+                logger.info('Frame source finished')
+                break
             else:
                 # Wait until a frame is available
                 time.sleep(0.01)
@@ -90,6 +108,10 @@ def main(config, logger):
         pass
     finally:
         # Clean up
+        if isinstance(state_determination, StateTracker):
+            logger.info(f'State debounce latency: {state_determination.stats()}')
+        logger.info(f'Ingest: {fetcher.stats()}')
+        logger.info(f'Capture to websocket latency: {publisher.stats()}')
         fetcher.stop()
         publisher.stop()
 
@@ -128,7 +150,7 @@ if __name__ == "__main__":
         "ingest": {
             "simple": {
                 "uri": camera_uri,
-                "queue_size": 1,
+                "ring_size": 3,
                 "reconnect_delay": 5,
                 "width": 1920,
                 "height": 1080,
@@ -148,6 +170,7 @@ if __name__ == "__main__":
         },
         "state": {
             "pkl_dir": None,
+            "compiled": False,  # StateClassifier hashes every template; slower than the early-exit rotation here
             "states": [
                 'login',
                 'song_select',
@@ -156,6 +179,12 @@ if __name__ == "__main__":
                 'total_result'
             ]
         },
+        "state_tracker": {
+            "min_frames": 3,
+            "state_frames": {
+                "song_playing": 1
+            }
+        },
         "results": {
             "screenshot_directory": r'/home/tim/persistent/screenshots',
             "timestamp_format": "%Y%m%d_%H%M",
@@ -0,0 +1,162 @@
+"""
+Per-stage benchmark of the per-frame hot path (and the slower parsers) over the frames in state_images/.
+
+    python -m ddrcv.bench --output bench/baseline.json
+    python -m ddrcv.bench --baseline bench/baseline.json
+
+Stages whose dependencies are missing (easyocr, a prebuilt jacket database) are reported as skipped. The exit code is
+1 if any stage regressed against the baseline, or if the hot path no longer fits in the frame budget.
+"""
+import argparse
+import sys
+
+from ddrcv.bench.benchmark import DEFAULT_IMAGE_DIR, HOT_PATH, compare, format_table, hot_path_ms, load_images, \
+    load_results, metadata, save_results, select, time_stage
+
+
+def _state_module(game):
+    if game == 'ddr':
+        from ddrcv.state import states
+        return states
+    elif game == 'tbd5':
+        from ddrcv.state import tbd5_states
+        return tbd5_states
+    elif game == 'sdvx':
+        from ddrcv.state import sdvx_states
+        return sdvx_states
+    raise ValueError(f'[bench] Unknown game {game}. Valid options are one of ["ddr", "tbd5", "sdvx"].')
+
+
+def build_stages(args, images):
+    """
+    :return: (stages, skipped) where stages is a list of (name, fn, inputs) and skipped maps stage name -> reason
+    """
+    from ddrcv.state.state_classifier import StateClassifier
+
+    frames = list(images.values())
+    module = _state_module(args.game)
+    stages = [
+        ('state_rotation', module.StateRotation().match, frames),
+        ('state_classifier', StateClassifier(module.StateRotation()).match, frames)
+    ]
+    skipped = dict()
+
+    if args.game == 'sdvx':
+        for stage in ('score_extractor', 'score_batched', 'score_fixed_pitch'):
+            skipped[stage] = 'no score extractor for sdvx'
+    else:
+        from ddrcv.score.score_extractor import ScoreExtractor
+        gameplay_frames = select(images, 'gameplay')
+        stages.append(('score_extractor', ScoreExtractor().extract, gameplay_frames))
+        stages.append(('score_batched', ScoreExtractor(batched=True).extract, gameplay_frames))
+        stages.append(('score_fixed_pitch', ScoreExtractor(mode='fixed_pitch').extract, gameplay_frames))
+
+    if args.skip_parsers or args.game == 'sdvx':
+        for stage in ('splash_parser', 'results_parser', 'results_fast', 'database_lookup', 'database_cached'):
+            skipped[stage] = 'disabled'
+        return stages, skipped
+
+    try:
+        from ddrcv.ocr import get_ocr_singleton
+        reader = get_ocr_singleton()
+    except ImportError as e:
+        reader = None
+        skipped['splash_parser'] = skipped['results_parser'] = skipped['results_fast'] = \
+            f'OCR unavailable: {e}'
+
+    database = None
+    if args.database is None:
+        skipped['database_lookup'] = skipped['database_cached'] = 'no --database given'
+    else:
+        try:
+            from ddrcv.jacket_database.database.database import DatabaseLookup
+            database = DatabaseLookup.from_prebuilt(args.database, encoder_cache=args.encoder_cache,
+                                                    encoder_backend=args.encoder_backend, index_type=args.index_type)
+        except ImportError as e:
+            skipped['database_lookup'] = skipped['database_cached'] = f'database unavailable: {e}'
+
+    if database is not None:
+        from ddrcv.state.splash_parser import SplashParser, extract_chip
+        splash_frames = select(images, 'splash')
+        jacket_bb = SplashParser.jacket_bb
+        jackets = [extract_chip(frame, jacket_bb)[..., ::-1].copy() for frame in splash_frames]
+        stages.append(('database_lookup', database.lookup, jackets))
+        # Same jackets through the perceptual hash cache, so after warmup every call is a hit
+        from ddrcv.jacket_database.database.lookup_cache import LookupCache
+        stages.append(('database_cached', LookupCache(database).lookup, jackets))
+
+    if reader is not None:
+        from ddrcv.state.results_parser import ResultsParser
+        stages.append(('results_parser', ResultsParser(reader, database).parse, select(images, 'results')))
+        stages.append(('results_fast', ResultsParser(reader, database, recognize_only=True).parse,
+                       select(images, 'results')))
+        if database is None:
+            skipped['splash_parser'] = 'no --database given'
+        else:
+            from ddrcv.state.splash_parser import SplashParser
+            stages.append(('splash_parser', SplashParser(reader, database).parse, select(images, 'splash')))
+
+    return stages, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the ddrcv per-frame pipeline stages')
+    parser.add_argument('--images', type=str, default=str(DEFAULT_IMAGE_DIR),
+                        help='Directory of PNG frames (searched recursively)')
+    parser.add_argument('--game', type=str, default='tbd5', choices=['ddr', 'tbd5', 'sdvx'],
+                        help='State definitions to benchmark')
+    parser.add_argument('--iterations', type=int, default=200, help='Timed calls per stage')
+    parser.add_argument('--warmup', type=int, default=20, help='Untimed calls per stage before timing')
+    parser.add_argument('--database', type=str, default=None, help='Prebuilt jacket database for the parsers')
+    parser.add_argument('--encoder-cache', type=str, default=None, help='Encoder cache directory for the database')
+    parser.add_argument('--encoder-backend', type=str, default=None,
+                        help='Expected encoder backend of the database (torch, onnx, onnx_int8)')
+    parser.add_argument('--index-type', type=str, default='flat',
+                        help='Jacket database index type (flat, ivf_flat, hnsw, pq)')
+    parser.add_argument('--skip-parsers', action='store_true', help='Only benchmark the per-frame stages')
+    parser.add_argument('--output', type=str, default=None, help='Write the results as a JSON baseline')
+    parser.add_argument('--baseline', type=str, default=None, help='Previous JSON baseline to diff against')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='Relative p50/p95 increase that counts as a regression')
+    parser.add_argument('--fps', type=float, default=60.0, help='Capture frame rate the hot path must keep up with')
+    args = parser.parse_args()
+
+    if args.game == 'sdvx' and args.images == str(DEFAULT_IMAGE_DIR):
+        args.images = str(DEFAULT_IMAGE_DIR / 'sdvx')
+    images = load_images(args.images, exclude=() if args.game == 'sdvx' else ('sdvx',))
+    print(f'Loaded {len(images)} frames from {args.images}')
+
+    stages, skipped = build_stages(args, images)
+
+    results = {'meta': metadata(), 'config': vars(args), 'stages': dict(), 'skipped': skipped}
+    for name, fn, inputs in stages:
+        print(f'Timing {name} over {args.iterations} iterations ({len(inputs)} inputs)')
+        results['stages'][name] = time_stage(fn, inputs, iterations=args.iterations, warmup=args.warmup)
+
+    budget_ms = 1000 / args.fps
+    frame_ms = hot_path_ms(results)
+    results['hot_path'] = {'stages': [s for s in HOT_PATH if s in results['stages']],
+                           'p95_ms': frame_ms, 'budget_ms': budget_ms}
+
+    comparison = None
+    if args.baseline is not None:
+        comparison = compare(results, load_results(args.baseline), tolerance=args.tolerance)
+        results['comparison'] = comparison
+
+    print()
+    print(format_table(results, comparison))
+    print()
+    print(f'Hot path p95: {frame_ms:.3f} ms of a {budget_ms:.3f} ms budget at {args.fps:g} fps')
+
+    if args.output is not None:
+        save_results(results, args.output)
+        print(f'Wrote {args.output}')
+
+    failed = frame_ms > budget_ms
+    if comparison is not None:
+        failed = failed or any(diff['regression'] for diff in comparison.values())
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
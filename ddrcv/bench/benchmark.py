@@ -0,0 +1,156 @@
+import json
+import platform
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+REPO_ROOT = Path(__file__).parent.parent.parent
+DEFAULT_IMAGE_DIR = REPO_ROOT / 'state_images'
+
+# Stages that run on every frame in the drivers. Their combined p95 has to fit in the frame budget.
+HOT_PATH = ('state_rotation', 'state_classifier', 'score_extractor', 'score_batched', 'score_fixed_pitch')
+
+
+def load_images(image_dir, exclude=('sdvx',)):
+    """
+    Load every PNG under image_dir (recursively), keeping only frames of the most common resolution.
+
+    :return: Dict of relative path -> BGR image
+    """
+    image_dir = Path(image_dir)
+    images = dict()
+    for png in sorted(image_dir.rglob('*.png')):
+        relative = png.relative_to(image_dir)
+        if any(part in exclude for part in relative.parts):
+            continue
+        image = cv2.imread(str(png), cv2.IMREAD_COLOR)
+        if image is not None:
+            images[str(relative)] = image
+
+    if not images:
+        raise ValueError(f'[load_images] No images found in {image_dir}')
+
+    shapes = [image.shape for image in images.values()]
+    shape = max(set(shapes), key=shapes.count)
+    return {name: image for name, image in images.items() if image.shape == shape}
+
+
+def select(images, keyword):
+    """
+    :return: Images whose name contains the keyword, or all images if none do
+    """
+    selected = [image for name, image in images.items() if keyword in Path(name).name]
+    return selected if selected else list(images.values())
+
+
+def summarize(samples_ms):
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    mean = float(samples.mean())
+    return {
+        'iterations': int(samples.size),
+        'mean_ms': mean,
+        'min_ms': float(samples.min()),
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'p99_ms': float(np.percentile(samples, 99)),
+        'max_ms': float(samples.max()),
+        'fps': 1000 / mean if mean > 0 else float('inf')
+    }
+
+
+def time_stage(fn, inputs, iterations=200, warmup=20):
+    """
+    Call fn on the inputs round robin, discarding the first `warmup` calls.
+
+    :return: Latency summary (see `summarize`)
+    """
+    for ii in range(warmup):
+        fn(inputs[ii % len(inputs)])
+
+    samples = np.empty(iterations, dtype=np.float64)
+    for ii in range(iterations):
+        target = inputs[ii % len(inputs)]
+        tic = time.perf_counter()
+        fn(target)
+        samples[ii] = 1000 * (time.perf_counter() - tic)
+    return summarize(samples)
+
+
+def metadata():
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'opencv': cv2.__version__
+    }
+
+
+def save_results(results, json_file):
+    json_file = Path(json_file)
+    json_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(json_file, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(json_file):
+    with open(json_file, 'r') as f:
+        return json.load(f)
+
+
+def compare(current, baseline, tolerance=0.10):
+    """
+    Diff the per-stage latencies of two benchmark results.
+
+    :param tolerance: Relative increase of p50 or p95 that counts as a regression
+    :return: Dict of stage -> {'p50_ratio', 'p95_ratio', 'regression'} for stages present in both results
+    """
+    output = dict()
+    for stage, stats in current['stages'].items():
+        if stage not in baseline['stages']:
+            continue
+        reference = baseline['stages'][stage]
+        p50_ratio = stats['p50_ms'] / reference['p50_ms'] if reference['p50_ms'] > 0 else 1.0
+        p95_ratio = stats['p95_ms'] / reference['p95_ms'] if reference['p95_ms'] > 0 else 1.0
+        output[stage] = {
+            'p50_ratio': p50_ratio,
+            'p95_ratio': p95_ratio,
+            'regression': p50_ratio > 1 + tolerance or p95_ratio > 1 + tolerance
+        }
+    return output
+
+
+def hot_path_ms(results):
+    """
+    Per-frame cost of the stages that run on every frame: p95 of the slower state matcher plus the p95 of the fastest
+    score extractor (the drivers run the fastest one).
+    """
+    stages = results['stages']
+    state_ms = max([stages[s]['p95_ms'] for s in ('state_rotation', 'state_classifier') if s in stages], default=0.0)
+    score_ms = min([stages[s]['p95_ms'] for s in ('score_extractor', 'score_batched', 'score_fixed_pitch')
+                    if s in stages], default=0.0)
+    return state_ms + score_ms
+
+
+def format_table(results, comparison=None):
+    header = f'{"stage":<20}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"fps":>10}'
+    if comparison is not None:
+        header += f'{"p50 x":>9}{"p95 x":>9}'
+    lines = [header, '-' * len(header)]
+    for stage, stats in results['stages'].items():
+        line = f'{stage:<20}{stats["p50_ms"]:>10.3f}{stats["p95_ms"]:>10.3f}{stats["p99_ms"]:>10.3f}{stats["fps"]:>10.1f}'
+        if comparison is not None and stage in comparison:
+            diff = comparison[stage]
+            line += f'{diff["p50_ratio"]:>9.2f}{diff["p95_ratio"]:>9.2f}'
+            if diff['regression']:
+                line += '  REGRESSION'
+        lines.append(line)
+    for stage, reason in results.get('skipped', {}).items():
+        lines.append(f'{stage:<20}skipped ({reason})')
+    return '\n'.join(lines)
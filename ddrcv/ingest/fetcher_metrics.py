@@ -0,0 +1,60 @@
+import time
+from collections import deque
+
+from ddrcv.misc.latency_histogram import LatencyHistogram
+
+
+def _rate(timestamps):
+    if len(timestamps) < 2:
+        return 0.0
+    elapsed = timestamps[-1] - timestamps[0]
+    return (len(timestamps) - 1) / elapsed if elapsed > 0 else 0.0
+
+
+class FetcherMetrics:
+    """
+    Throughput and latency counters for a FrameFetcher.
+
+    The decode side is recorded from the capture thread and the consume side from the driver thread. Rates are computed
+    over a rolling window of the most recent frames, so they reflect current conditions rather than the session average.
+    """
+    def __init__(self, window=300, clock=time.time):
+        """
+        :param window: Number of recent frames used for the fps estimates and latency percentiles
+        :param clock: Wall clock, must match the clock used for the frame timestamps
+        """
+        self.clock = clock
+        self.decoded = 0
+        self.consumed = 0
+        self._decode_times = deque(maxlen=window)
+        self._consume_times = deque(maxlen=window)
+
+        # Time spent inside capture.read, and time between capture and the consumer picking the frame up
+        self.decode_ms = LatencyHistogram(window)
+        self.frame_age_ms = LatencyHistogram(window)
+
+    def record_decode(self, timestamp, decode_ms):
+        self.decoded += 1
+        self._decode_times.append(timestamp)
+        self.decode_ms.add(decode_ms)
+
+    def record_consume(self, frame):
+        now = self.clock()
+        self.consumed += 1
+        self._consume_times.append(now)
+        self.frame_age_ms.add(1000 * (now - frame.timestamp))
+
+    def summary(self, dropped=0):
+        """
+        :param dropped: Number of dropped frames, as counted by the FrameRing
+        :return: Dict of counters, rates and latency percentiles
+        """
+        return {
+            'decoded': self.decoded,
+            'consumed': self.consumed,
+            'dropped': dropped,
+            'decode_fps': _rate(list(self._decode_times)),
+            'consumer_fps': _rate(list(self._consume_times)),
+            'decode_ms': self.decode_ms.summary(),
+            'frame_age_ms': self.frame_age_ms.summary()
+        }
@@ -0,0 +1,144 @@
+import threading
+import time
+import logging
+
+from ddrcv.ingest.fetcher_metrics import FetcherMetrics
+from ddrcv.ingest.frame_ring import FrameRing
+
+
+class FrameFetcher:
+    """
+    Base class for the threaded frame fetchers.
+
+    A background thread keeps the capture connected and decodes frames into a FrameRing of preallocated buffers, so
+    there is no per-frame allocation and the consumer never has to drain stale frames. Subclasses implement `connect`,
+    which must set `self.capture` to an opened cv2.VideoCapture (or None on failure).
+    """
+    def __init__(self, ring_size=3, reconnect_delay=5, logger=None):
+        """
+        :param ring_size: Number of preallocated frame buffers (at least 3).
+        :param reconnect_delay: Delay before attempting reconnection (in seconds).
+        """
+        if logger is None:
+            self.logger = logging.getLogger(type(self).__name__)
+        else:
+            self.logger = logger
+
+        self.ring = FrameRing(ring_size)
+        self.metrics = FetcherMetrics()
+        self.capture = None
+        self.thread = None
+        self.running = False
+        self.reconnect_delay = reconnect_delay
+
+    def start(self):
+        """
+        Start the frame fetching thread.
+        """
+        self.running = True
+        self.thread = threading.Thread(target=self.update_frame, daemon=True)
+        self.thread.start()
+        self.logger.info("Frame fetching thread started.")
+
+    def connect(self):
+        raise NotImplementedError
+
+    def after_read(self):
+        """
+        Called after every successfully decoded frame.
+        """
+        pass
+
+    def update_frame(self):
+        """
+        Continuously fetch frames from the source.
+        """
+        while self.running:
+            if self.capture is None or not self.capture.isOpened():
+                self.logger.info("Attempting to connect to the source.")
+                self.connect()
+                if not self.capture or not self.capture.isOpened():
+                    self.logger.warning(
+                        f"Connection failed. Retrying in {self.reconnect_delay} seconds."
+                    )
+                    time.sleep(self.reconnect_delay)
+                    continue
+                else:
+                    self.logger.info("Successfully connected to the source.")
+
+            buffer = self.ring.acquire()
+            read_start = time.perf_counter()
+            if buffer is None:
+                ret, frame = self.capture.read()
+            else:
+                ret, frame = self.capture.read(image=buffer)
+            if not ret or frame is None:
+                self.ring.abort()
+                self.logger.error("Failed to read frame from the source.")
+                # Stream might have dropped, attempt reconnection
+                self.capture.release()
+                self.capture = None
+                self.logger.info(
+                    f"Reconnecting to the source in {self.reconnect_delay} seconds."
+                )
+                time.sleep(self.reconnect_delay)
+                continue
+
+            decode_ms = 1000 * (time.perf_counter() - read_start)
+            timestamp = time.time()
+            self.ring.publish(frame, timestamp)
+            self.metrics.record_decode(timestamp, decode_ms)
+            self.logger.debug("New frame fetched and published.")
+            self.after_read()
+
+    def get_frame(self):
+        """
+        Retrieve the most recent frame.
+
+        :return: Frame(image, frame_id, timestamp) if a new frame is available, else None. The image is a borrowed view
+                 that stays valid until the next call to get_frame.
+        """
+        frame = self.ring.borrow()
+        if frame is None:
+            self.logger.debug("No new frame available.")
+        else:
+            self.metrics.record_consume(frame)
+        return frame
+
+    @property
+    def finished(self):
+        """
+        True once a finite source has been exhausted. Live sources never finish.
+        """
+        return False
+
+    @property
+    def dropped_frames(self):
+        """
+        Number of decoded frames that were replaced by a newer frame before the consumer got to them.
+        """
+        return self.ring.dropped
+
+    def stats(self):
+        """
+        :return: Dict with decoded/consumed/dropped counts, decode and consumer fps, and p50/p95/p99 of the decode time
+                 and of the frame age (capture to get_frame) in milliseconds
+        """
+        return self.metrics.summary(dropped=self.ring.dropped)
+
+    def stop(self):
+        """
+        Stop the frame fetching thread and release resources.
+        """
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+            self.logger.info("Frame fetching thread stopped.")
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+            self.logger.info("Video capture released.")
+
+    def __del__(self):
+        self.stop()
@@ -0,0 +1,108 @@
+import threading
+from collections import namedtuple
+
+
+# A frame handed out by a fetcher. `image` is a borrowed view into one of the ring's buffers, and is only valid until
+# the next call to get_frame (copy it if it needs to live longer). `frame_id` increases by one for every decoded frame,
+# so gaps between consecutive ids are frames that were dropped. `timestamp` is the wall clock capture time (time.time()).
+Frame = namedtuple('Frame', ['image', 'frame_id', 'timestamp'])
+
+
+class FrameRing:
+    """
+    Fixed pool of frame buffers shared between a decoding thread and a single consumer.
+
+    The writer decodes straight into a free buffer (`capture.read(image=buffer)`), then publishes it as the latest frame
+    along with a sequence number. The consumer borrows the latest frame without copying. A buffer is never written while
+    it is the latest published frame or while it is borrowed by the consumer, so three buffers are enough for the writer
+    to never block, and the same buffers are reused for the lifetime of the fetcher.
+    """
+    def __init__(self, size=3):
+        """
+        :param size: Number of preallocated buffers. Must be at least 3 (latest, borrowed, and one being written).
+        """
+        if size < 3:
+            raise ValueError(f'[FrameRing] Ring size must be at least 3, got {size}')
+
+        # Buffers are allocated by the decoder on the first read into each slot, and reused after that
+        self.buffers = [None] * size
+        self._lock = threading.Condition()
+
+        self._next_slot = 0
+        self._writing = None
+        self._latest = None
+        self._latest_id = 0
+        self._latest_timestamp = None
+        self._borrowed = None
+        self._last_read_id = 0
+
+        self.published = 0
+        self.dropped = 0
+
+    def acquire(self):
+        """
+        Writer side: reserve a buffer to decode into.
+
+        :return: The buffer (None if the slot hasn't been allocated yet)
+        """
+        with self._lock:
+            size = len(self.buffers)
+            for offset in range(size):
+                slot = (self._next_slot + offset) % size
+                if slot != self._latest and slot != self._borrowed:
+                    break
+            self._writing = slot
+            self._next_slot = (slot + 1) % size
+            return self.buffers[slot]
+
+    def publish(self, image, timestamp):
+        """
+        Writer side: publish the reserved buffer as the latest frame.
+
+        :param image: Decoded image. Normally the buffer returned by acquire, but the decoder may have allocated a new
+                      array (first frame, or a change of resolution), in which case it replaces the slot's buffer.
+        :param timestamp: Capture time
+        :return: frame_id of the published frame
+        """
+        with self._lock:
+            slot = self._writing
+            self._writing = None
+            self.buffers[slot] = image
+            self._latest = slot
+            self._latest_id += 1
+            self._latest_timestamp = timestamp
+            self.published += 1
+            return self._latest_id
+
+    def abort(self):
+        """
+        Writer side: release the reserved buffer without publishing it (e.g. after a failed read).
+        """
+        with self._lock:
+            self._writing = None
+
+    def borrow(self):
+        """
+        Consumer side: borrow the latest frame, releasing the previously borrowed one.
+
+        :return: Frame, or None if no new frame has been published since the last call
+        """
+        with self._lock:
+            if self._latest is None or self._latest_id == self._last_read_id:
+                return None
+
+            if self._last_read_id > 0:
+                self.dropped += self._latest_id - self._last_read_id - 1
+            self._last_read_id = self._latest_id
+            self._borrowed = self._latest
+            self._lock.notify_all()
+            return Frame(self.buffers[self._latest], self._latest_id, self._latest_timestamp)
+
+    def wait_consumed(self, timeout=None):
+        """
+        Writer side: block until the consumer has borrowed the latest frame. Used by sources that must not drop frames.
+
+        :return: False if the timeout expired first
+        """
+        with self._lock:
+            return self._lock.wait_for(lambda: self._latest_id == self._last_read_id, timeout)
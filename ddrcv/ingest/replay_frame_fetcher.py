@@ -0,0 +1,140 @@
+import cv2
+import os
+import time
+import logging
+
+from ddrcv.ingest.frame_fetcher import FrameFetcher
+
+
+class ReplayFrameFetcher(FrameFetcher):
+    """
+    Frame fetcher that replays a recorded video file through the same start/get_frame/stop interface as the live
+    fetchers, so any driver can be run against tournament footage.
+
+    The file is decoded sequentially (a single seek to `start_frame` at most). In the default "as fast as possible"
+    mode the decoder waits for the driver to pick up each frame before decoding the next one, so no frames are dropped
+    and the whole video is processed as quickly as the pipeline allows. In realtime mode frames are released at the
+    video's frame rate (scaled by `speed`) and frames are dropped when the driver falls behind, like a live source.
+    """
+    def __init__(self, video_path, realtime=False, speed=1.0, start_frame=0, end_frame=None, ring_size=3, logger=None):
+        """
+        :param video_path: Path to the recorded video
+        :param realtime: Pace frames at the video frame rate instead of running as fast as possible
+        :param speed: Playback speed multiplier in realtime mode
+        :param start_frame: First frame to replay
+        :param end_frame: Last frame (exclusive) to replay. Defaults to the end of the video.
+        :param ring_size: Number of preallocated frame buffers (at least 3).
+        """
+        super().__init__(ring_size=ring_size, reconnect_delay=0, logger=logger)
+
+        if not os.path.exists(video_path):
+            self.logger.error(f'[ReplayFrameFetcher] Video file not found: {video_path}')
+            raise FileNotFoundError(f'[ReplayFrameFetcher] Video file not found: {video_path}')
+
+        self.video_path = str(video_path)
+        self.realtime = realtime
+        self.speed = speed
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.fps = None
+        self.position = start_frame  # Index of the next frame to be decoded
+        self._finished = False
+
+    @classmethod
+    def from_config(cls, config, logger=None):
+        video_path = config.pop('video_path', None)
+        if logger is None:
+            logger = logging.getLogger('ReplayFrameFetcher')
+        return ReplayFrameFetcher(video_path, logger=logger, **config)
+
+    def connect(self):
+        self.capture = cv2.VideoCapture(self.video_path)
+        if not self.capture.isOpened():
+            self.logger.error(f"Cannot open video file: {self.video_path}")
+            self.capture = None
+            return
+
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 60.0
+        if self.start_frame > 0:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, self.start_frame)
+        self.logger.info(f"Replaying {self.video_path} from frame {self.start_frame} at {self.fps:.2f} fps "
+                         f"({'realtime x' + str(self.speed) if self.realtime else 'as fast as possible'}).")
+
+    def update_frame(self):
+        """
+        Decode the video sequentially until the end (or end_frame) is reached.
+        """
+        self.connect()
+        if self.capture is None:
+            self._finished = True
+            return
+
+        frame_period = 1.0 / (self.fps * self.speed)
+        replay_start = time.perf_counter()
+        replayed = 0
+
+        while self.running:
+            if self.end_frame is not None and self.position >= self.end_frame:
+                break
+
+            if self.realtime:
+                delay = replay_start + replayed * frame_period - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                # Don't overwrite a frame the driver hasn't seen yet
+                while self.running and not self.ring.wait_consumed(timeout=0.1):
+                    pass
+
+            buffer = self.ring.acquire()
+            read_start = time.perf_counter()
+            if buffer is None:
+                ret, frame = self.capture.read()
+            else:
+                ret, frame = self.capture.read(image=buffer)
+            if not ret or frame is None:
+                self.ring.abort()
+                break
+
+            decode_ms = 1000 * (time.perf_counter() - read_start)
+            timestamp = time.time()
+            self.ring.publish(frame, timestamp)
+            self.metrics.record_decode(timestamp, decode_ms)
+            self.position += 1
+            replayed += 1
+
+        # Let the driver drain the last frame before reporting the end of the video
+        while self.running and not self.ring.wait_consumed(timeout=0.1):
+            pass
+        self._finished = True
+        self.logger.info(f"Replay finished after {replayed} frames.")
+
+    @property
+    def finished(self):
+        return self._finished
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='[%(asctime)s] %(levelname)s - %(message)s',
+        datefmt='%H:%M:%S'
+    )
+
+    fetcher = ReplayFrameFetcher(sys.argv[1], realtime=False)
+    fetcher.start()
+
+    tic = time.time()
+    try:
+        while not fetcher.finished:
+            frame = fetcher.get_frame()
+            if frame is None:
+                time.sleep(0.001)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fetcher.stop()
+        print(f'Replayed {fetcher.stats()["consumed"]} frames in {time.time() - tic:.2f} seconds')
+        print(fetcher.stats())
@@ -1,35 +1,27 @@
 import cv2
-import threading
 import time
 import logging
-from queue import Queue, Empty
 
+from ddrcv.ingest.frame_fetcher import FrameFetcher
 
-class VideoFrameFetcher:
-    def __init__(self, source, queue_size=1, reconnect_delay=5, hw_accel=False, logger=None):
+
+class VideoFrameFetcher(FrameFetcher):
+    def __init__(self, source, ring_size=3, reconnect_delay=5, hw_accel=False, logger=None):
         """
         Initialize the video frame fetcher.
 
         :param source: The video source. Can be an RTSP URL or a device path (e.g., `/dev/video0` or an integer for webcams).
-        :param queue_size: Maximum number of frames to store in the queue.
+        :param ring_size: Number of preallocated frame buffers (at least 3).
         :param reconnect_delay: Delay before attempting reconnection (for RTSP streams only).
         :param hw_accel: Use hardware acceleration if available (for RTSP streams).
         """
-        if logger is None:
-            self.logger = logging.getLogger('VideoFrameFetcher')
-        else:
-            self.logger = logger
+        super().__init__(ring_size=ring_size, reconnect_delay=reconnect_delay, logger=logger)
 
         if source is None or source == '':
             self.logger.error('[VideoFrameFetcher] Source must not be None or empty')
             raise ValueError('[VideoFrameFetcher] Source must not be None or empty')
 
         self.source = source
-        self.frame_queue = Queue(maxsize=queue_size)
-        self.capture = None
-        self.thread = None
-        self.running = False
-        self.reconnect_delay = reconnect_delay
         self.hw_accel = hw_accel
 
     @classmethod
@@ -39,55 +31,6 @@ class VideoFrameFetcher:
             logger = logging.getLogger('RTSPFrameFetcher')
         return VideoFrameFetcher(url, logger=logger, **config)
 
-    def start(self):
-        """
-        Start the frame fetching thread.
-        """
-        self.running = True
-        self.thread = threading.Thread(target=self.update_frame, daemon=True)
-        self.thread.start()
-        self.logger.info("Frame fetching thread started.")
-
-    def update_frame(self):
-        """
-        Continuously fetch frames from the video source.
-        """
-        while self.running:
-            if self.capture is None or not self.capture.isOpened():
-                self.logger.info("Attempting to connect to the video source.")
-                self.connect()
-                if not self.capture or not self.capture.isOpened():
-                    self.logger.warning(
-                        f"Connection failed. Retrying in {self.reconnect_delay} seconds."
-                    )
-                    time.sleep(self.reconnect_delay)
-                    continue
-                else:
-                    self.logger.info("Successfully connected to the video source.")
-
-            ret, frame = self.capture.read()
-            if not ret or frame is None:
-                self.logger.error("Failed to read frame from the source.")
-                # Stream/device might have dropped, attempt reconnection
-                self.capture.release()
-                self.capture = None
-                self.logger.info(
-                    f"Reconnecting to the source in {self.reconnect_delay} seconds."
-                )
-                time.sleep(self.reconnect_delay)
-                continue
-
-            # Clear the queue to keep only the latest frame
-            while not self.frame_queue.empty():
-                try:
-                    discarded_frame = self.frame_queue.get_nowait()
-                    del discarded_frame  # Free memory
-                except Empty:
-                    break
-
-            self.frame_queue.put(frame)
-            self.logger.debug("New frame fetched and added to the queue.")
-
     def connect(self):
         """
         Establish connection to the video source.
@@ -118,37 +61,6 @@ class VideoFrameFetcher:
             self.logger.exception(f"Exception occurred while connecting: {e}")
             self.capture = None
 
-    def get_frame(self):
-        """
-        Retrieve the most recent frame.
-
-        :return: The latest frame if available, else None.
-        """
-        try:
-            frame = self.frame_queue.get_nowait()
-            self.logger.debug("Frame retrieved from the queue.")
-            return frame
-        except Empty:
-            self.logger.debug("No frame available in the queue.")
-            return None
-
-    def stop(self):
-        """
-        Stop the frame fetching thread and release resources.
-        """
-        self.running = False
-        if self.thread is not None:
-            self.thread.join()
-            self.thread = None
-            self.logger.info("Frame fetching thread stopped.")
-        if self.capture is not None:
-            self.capture.release()
-            self.capture = None
-            self.logger.info("Video capture released.")
-
-    def __del__(self):
-        self.stop()
-
 
 if __name__ == "__main__":
     # Configure logging
@@ -170,7 +82,7 @@ if __name__ == "__main__":
             frame = fetcher.get_frame()
             if frame is not None:
                 # Display the frame (optional)
-                cv2.imshow('Video Stream', frame)
+                cv2.imshow('Video Stream', frame.image)
                 if cv2.waitKey(1) & 0xFF == ord('q'):
                     break
             else:
@@ -1,15 +1,123 @@
+import hashlib
 import json
-import dill as pickle
+import os
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from copy import copy
 from pathlib import Path
 
 import numpy as np
 from PIL import Image
+from ddrcv.jacket_database.database.checksum import compute_checksum
 from ddrcv.jacket_database.database.encoder import Encoder
 from tqdm import tqdm
 import faiss
 
+# Index types for DatabaseLookup. 'flat' is an exact search. The others trade some recall for speed or memory once the
+# table grows: 'ivf_flat' only searches the `nprobe` nearest of `nlist` clusters, 'hnsw' walks a proximity graph, and
+# 'pq' stores product quantized codes in an IVF index. `python -m ddrcv.jacket_database.database.index_report` measures
+# recall@1 and latency against 'flat'.
+INDEX_TYPES = ('flat', 'ivf_flat', 'hnsw', 'pq')
+INDEX_PRECISIONS = ('float32', 'float16')
+
+# How DatabaseLookup.lookup_batch combines the results of several crops of the same jacket. 'score' ranks songs by
+# their mean similarity over all crops (0 for crops where the song isn't a candidate), 'vote' by the number of crops
+# whose best match they are, with ties broken by mean similarity.
+FUSION_METHODS = ('score', 'vote')
+
+# Layout of the indices `build_index` persists. Indices saved with an older layout are rebuilt.
+INDEX_VERSION = 2
+
+
+def index_factory_string(index_type, dim, count, precision='float32', pca_dim=None, nlist=None, hnsw_m=32, pq_m=None,
+                         pq_bits=8):
+    """
+    :param index_type: One of INDEX_TYPES
+    :param dim: Feature vector length
+    :param count: Number of songs, used to size the IVF clustering
+    :param precision: Precision of the stored vectors for the flat, ivf_flat and hnsw indices, one of INDEX_PRECISIONS
+    :param pca_dim: Reduce the features to this many dimensions with PCA (re-normalized afterwards) before indexing
+    :param nlist: Number of IVF clusters. Defaults to 4 * sqrt(count), with at least 39 training songs per cluster
+    :param hnsw_m: Number of graph neighbors per node of the HNSW index
+    :param pq_m: Number of PQ sub-quantizers, must divide the (reduced) dimension. Defaults to the largest divisor <= 64
+    :param pq_bits: Bits per PQ code. Training needs at least 2**pq_bits songs
+    :return: faiss.index_factory description
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f'Unknown index type {index_type}. Valid options are one of {list(INDEX_TYPES)}.')
+    if precision not in INDEX_PRECISIONS:
+        raise ValueError(f'Unknown index precision {precision}. Valid options are one of {list(INDEX_PRECISIONS)}.')
+
+    prefix = ''
+    if pca_dim is not None:
+        if pca_dim >= dim:
+            raise ValueError(f'PCA dimension {pca_dim} must be smaller than the feature length {dim}')
+        prefix = f'PCA{pca_dim},L2norm,'
+        dim = pca_dim
+
+    if nlist is None:
+        nlist = max(1, min(int(4 * np.sqrt(count)), count // 39))
+    storage = 'Flat' if precision == 'float32' else 'SQfp16'
+
+    if index_type == 'flat':
+        return prefix + storage
+    elif index_type == 'ivf_flat':
+        return prefix + f'IVF{nlist},{storage}'
+    elif index_type == 'hnsw':
+        return prefix + f'HNSW{hnsw_m},{storage}'
+
+    if pq_m is None:
+        pq_m = max(m for m in range(1, min(64, dim) + 1) if dim % m == 0)
+    if dim % pq_m != 0:
+        raise ValueError(f'PQ sub-quantizer count {pq_m} does not divide the feature length {dim}')
+    if count < 2 ** pq_bits:
+        raise ValueError(f'A {pq_bits} bit PQ index needs at least {2 ** pq_bits} songs to train, got {count}. '
+                         f'Lower pq_bits or use another index type.')
+    return prefix + f'IVF{nlist},PQ{pq_m}x{pq_bits}'
+
+
+def index_path(prebuilt, factory):
+    """
+    :return: Where the trained index for a database is persisted: inside database directories, and next to legacy
+             pickles
+    """
+    prebuilt = Path(prebuilt)
+    name = f'index-{factory.replace(",", "_")}.faiss'
+    if prebuilt.is_dir():
+        return prebuilt / name
+    return prebuilt.with_name(f'{prebuilt.stem}.{name}')
+
+
+def build_index(feature_matrix, ids, factory):
+    """
+    Train (if needed) and fill an inner product index keyed by song id.
+
+    :param feature_matrix: NxD float32 normalized features
+    :param ids: N int64 song ids
+    """
+    # Keyed by song id, so songs can be added and removed without rebuilding the index. IVF indices (also behind a PCA
+    # transform) store the ids in their inverted lists. An IndexIDMap2 around them would break removals: remove_ids
+    # compacts the id map, but not the list positions it translates, so later results map to the wrong songs.
+    index = faiss.index_factory(feature_matrix.shape[1], factory, faiss.METRIC_INNER_PRODUCT)
+    if 'IVF' not in factory:
+        index = faiss.IndexIDMap2(index)
+    if not index.is_trained:
+        index.train(feature_matrix)
+    index.add_with_ids(feature_matrix, ids)
+    return index
+
+
+def set_search_params(index, index_type, nprobe=8, ef_search=64):
+    """
+    Set the search time accuracy/speed trade off of an approximate index. No-op for 'flat'.
+    """
+    params = faiss.ParameterSpace()
+    if index_type in ('ivf_flat', 'pq'):
+        params.set_index_parameter(index, 'nprobe', nprobe)
+    elif index_type == 'hnsw':
+        params.set_index_parameter(index, 'efSearch', ef_search)
+
 
 class Song:
     def __init__(self):
@@ -17,12 +125,19 @@ class Song:
         self.song_data = None
         self.feature_vector = None
         self.jacket_bytes = None
+        self.jacket_hash = None
+        self.song_id = None
 
-    def initialize(self, jacket_file, metadata_file):
+    def initialize(self, jacket_file, metadata_file, jacket_hash=None):
         self.jacket_file = jacket_file
         self.song_data = Song.parse_metadata_file(metadata_file)
+        self.jacket_hash = jacket_hash if jacket_hash is not None else Song.hash_jacket(jacket_file)
         return self
 
+    @staticmethod
+    def hash_jacket(jacket_file):
+        return compute_checksum(jacket_file, algorithm='sha256', chunk_size=1 << 16)
+
     def load_jacket_image(self, resize=None):
         img = Image.open(self.jacket_file)
         img = img.convert('RGB')
@@ -73,57 +188,179 @@ class Song:
 class Database:
     DEFAULT_ENCODER_MODEL='efficientnet_b0'
     DEFAULT_ENCODER_CACHE='cache'
+    DEFAULT_ENCODER_BACKEND='torch'
+    FORMAT_VERSION = 1
 
-    def __init__(self, encoder_model=DEFAULT_ENCODER_MODEL, encoder_cache=DEFAULT_ENCODER_CACHE):
-        self.encoder = Encoder(model_name=encoder_model, cache_dir=encoder_cache)
+    def __init__(self, encoder_model=DEFAULT_ENCODER_MODEL, encoder_cache=DEFAULT_ENCODER_CACHE,
+                 encoder_backend=DEFAULT_ENCODER_BACKEND):
+        self.encoder = Encoder(model_name=encoder_model, cache_dir=encoder_cache, backend=encoder_backend)
         self.songs = list()
         self.features = None
+        self.next_id = 0
+        self._songs_by_id = None
 
 
     @classmethod
-    def build(cls, scrape_dir, encoder_model=DEFAULT_ENCODER_MODEL, encoder_cache=DEFAULT_ENCODER_CACHE):
-        self = cls(encoder_model=encoder_model, encoder_cache=encoder_cache)
+    def build(cls, scrape_dir, encoder_model=DEFAULT_ENCODER_MODEL, encoder_cache=DEFAULT_ENCODER_CACHE,
+              encoder_backend=DEFAULT_ENCODER_BACKEND, batch_size=32, workers=4):
+        """
+        :param batch_size: Number of jackets encoded per model call
+        :param workers: Number of threads decoding and preprocessing jackets ahead of the encoder
+        """
+        self = cls(encoder_model=encoder_model, encoder_cache=encoder_cache, encoder_backend=encoder_backend)
         self._build_index(scrape_dir)
-        self._populate_feature_vectors()
-        self._collate_feature_vectors()
+        self._populate_feature_vectors(batch_size=batch_size, workers=workers)
         return self
 
 
     @classmethod
-    def load(cls, prebuilt_pkl, encoder_cache=None):
-        with open(prebuilt_pkl, 'rb') as fid:
-            prebuilt = pickle.load(fid)
+    def load(cls, prebuilt, encoder_cache=None, encoder_backend=None):
+        """
+        :param prebuilt: Database directory written by `save`, or a legacy dill pickle (.pkl). Only load pickles from a
+                         trusted source, loading one can execute arbitrary code. Convert them with
+                         `Database.load(old_pkl).save(new_dir)`.
+        """
+        if Path(prebuilt).is_dir():
+            metadata, songs, features = Database._read_compact(prebuilt)
+        else:
+            metadata, songs, features = Database._read_legacy(prebuilt)
 
-        metadata = prebuilt['metadata']
         if encoder_cache is not None:
             metadata['encoder_cache'] = encoder_cache
-        self = cls(encoder_model=metadata['encoder_model'], encoder_cache=metadata['encoder_cache'])
-
-        # Verify that the checksum of the loaded encoder weights matches that of the ones that built the database
+        # Features from different backends (e.g. int8 quantized) are not interchangeable. Databases saved before
+        # encoder backends existed were built with torch.
+        backend = metadata.get('encoder_backend', 'torch')
+        if encoder_backend is not None and encoder_backend != backend:
+            raise ValueError(f"Encoder backend {encoder_backend} doesn't match the database ({backend})")
+        self = cls(encoder_model=metadata['encoder_model'], encoder_cache=metadata['encoder_cache'],
+                   encoder_backend=backend)
+
+        # Verify that the checksum of the loaded encoder weights (or exported model) matches that of the ones that
+        # built the database
         # TODO: Store encoded jpeg with the song data, enabling the ability to rebuild the database with a new
         #       encoder at runtime
         if self.encoder.checksum != metadata['encoder_checksum']:
             raise ValueError("Checksum doesn't match")
 
-        self.songs = prebuilt['songs']
-        self._collate_feature_vectors()
+        self.songs = songs
+        self.next_id = metadata.get('next_id', 0)
+        self._assign_ids()
+        if features is None:
+            self._collate_feature_vectors()
+        else:
+            self.features = features
         return self
 
-    def save(self, output_file):
-        print(f'Saving database to {output_file}')
+    @staticmethod
+    def _read_legacy(prebuilt_pkl):
+        import dill as pickle
+        with open(prebuilt_pkl, 'rb') as fid:
+            prebuilt = pickle.load(fid)
+        # Unpickled songs never ran the current Song.__init__, so attributes added since are missing. Jackets without a
+        # hash are re-encoded once by the next `update`.
+        defaults = vars(Song())
+        for song in prebuilt['songs']:
+            for key, value in defaults.items():
+                if not hasattr(song, key):
+                    setattr(song, key, value)
+        return prebuilt['metadata'], prebuilt['songs'], None
+
+    @staticmethod
+    def _read_compact(database_dir):
+        """
+        Read the directory format written by `save`: header.json, a columnar songs.json, and features.npy, which is
+        memory mapped read-only. Nothing is unpickled.
+        """
+        database_dir = Path(database_dir)
+        with open(database_dir / 'header.json', 'r') as fid:
+            header = json.load(fid)
+        if header.get('format_version', 0) > Database.FORMAT_VERSION:
+            raise ValueError(f'Database format {header["format_version"]} is newer than this version of ddrcv')
+
+        with open(database_dir / 'songs.json', 'r') as fid:
+            columns = json.load(fid)
+        features = np.load(database_dir / 'features.npy', mmap_mode='r', allow_pickle=False)
+        if features.shape[0] != header['count'] or len(columns['song_id']) != header['count']:
+            raise ValueError(f'Database {database_dir} is inconsistent, expected {header["count"]} songs')
+
+        songs = list()
+        for ii in range(header['count']):
+            song = Song()
+            song.song_id = columns['song_id'][ii]
+            song.jacket_file = columns['jacket_file'][ii]
+            song.jacket_hash = columns['jacket_hash'][ii]
+            song.song_data = columns['song_data'][ii]
+            song.feature_vector = features[ii]
+            songs.append(song)
+        return header, songs, features
+
+    def save(self, output, dtype='float32'):
+        """
+        Save the database as a directory holding
+            header.json   - encoder model/backend/checksum, song count and feature shape
+            songs.json    - columnar song table (id, jacket file, jacket hash, metadata)
+            features.npy  - contiguous (songs x features) matrix, memory mapped on load
+        Paths ending in .pkl are written in the legacy dill pickle format instead.
+
+        :param dtype: Feature matrix dtype on disk, 'float32' or 'float16'
+        """
+        print(f'Saving database to {output}')
         metadata = {
             'encoder_model': self.encoder.model_name,
             'encoder_cache': self.encoder.cache_dir,
+            'encoder_backend': self.encoder.backend,
             'encoder_checksum': self.encoder.checksum
         }
 
-        output = {
-            'metadata': metadata,
-            'songs': self.songs
+        if str(output).endswith('.pkl'):
+            import dill as pickle
+            prebuilt = {
+                'metadata': metadata,
+                'songs': self.songs
+            }
+
+            with open(output, 'wb') as fid:
+                pickle.dump(prebuilt, fid)
+            return
+
+        output = Path(output)
+        # A database loaded from this directory maps its features.npy. Move them into memory first, so the songs keep
+        # reading their own rows (and Windows, which can't replace a mapped file, can save over it)
+        if isinstance(self.features, np.memmap) and self.features.filename is not None and \
+                Path(self.features.filename).resolve() == (output / 'features.npy').resolve():
+            self._collate_feature_vectors()
+
+        features = np.ascontiguousarray(self.features, dtype=dtype)
+        header = dict(metadata)
+        header.update({
+            'format_version': Database.FORMAT_VERSION,
+            'encoder_cache': str(self.encoder.cache_dir),
+            'count': len(self.songs),
+            'dim': int(features.shape[1]) if features.ndim == 2 else 0,
+            'dtype': str(features.dtype),
+            'next_id': self.next_id
+        })
+        columns = {
+            'song_id': [song.song_id for song in self.songs],
+            'jacket_file': [str(song.jacket_file) for song in self.songs],
+            'jacket_hash': [song.jacket_hash for song in self.songs],
+            'song_data': [song.song_data for song in self.songs]
         }
 
-        with open(output_file, 'wb') as fid:
-            pickle.dump(output, fid)
+        # Everything is written to temporary files first, so a failed save leaves the previous database intact. The
+        # files are then swapped in with the header last, so a partially replaced database is never mistaken for a
+        # complete one.
+        output.mkdir(parents=True, exist_ok=True)
+        with open(output / 'features.npy.tmp', 'wb') as fid:
+            np.save(fid, features, allow_pickle=False)
+        with open(output / 'songs.json.tmp', 'w') as fid:
+            json.dump(columns, fid)
+        with open(output / 'header.json.tmp', 'w') as fid:
+            json.dump(header, fid, indent=2)
+
+        (output / 'header.json').unlink(missing_ok=True)
+        for name in ('features.npy', 'songs.json', 'header.json'):
+            os.replace(output / f'{name}.tmp', output / name)
 
     def _build_index(self, scrape_dir):
         scrape_dir = Path(scrape_dir)
@@ -133,14 +370,134 @@ class Database:
         for jf in tqdm(jacket_files):
             jf = jf.absolute()
             self.songs.append(Song().initialize(jf, jf.parent / 'metadata.json'))
+        self._assign_ids()
+
+    def _assign_ids(self):
+        """
+        Give every song a stable id, used as its FAISS id. Databases saved before ids existed are numbered in order.
+        """
+        self._songs_by_id = None
+        for song in self.songs:
+            if getattr(song, 'song_id', None) is not None:
+                self.next_id = max(self.next_id, song.song_id + 1)
+        for song in self.songs:
+            if getattr(song, 'song_id', None) is None:
+                song.song_id = self.next_id
+                self.next_id += 1
+
+    def update(self, scrape_dir, batch_size=32, workers=4):
+        """
+        Bring the database in line with the jackets currently in scrape_dir, only encoding jackets whose content is
+        new. Jackets are matched by path and keyed by the sha256 of their contents: unchanged files keep their
+        features, renamed or moved files reuse the features of the same content, and files that are gone are dropped.
+        Song metadata is re-read for every jacket. Songs from databases saved without content hashes are re-encoded
+        once.
+
+        :return: (added, removed_ids) where added are the songs whose features are new (new or changed jackets) and
+                 removed_ids are the ids of the songs whose features are no longer valid (removed or changed jackets).
+                 See `DatabaseLookup.update`.
+        """
+        scrape_dir = Path(scrape_dir)
+        jacket_files = [jf.absolute() for jf in scrape_dir.glob('**/*.png')]
+        by_path = {str(song.jacket_file): song for song in self.songs}
+        by_hash = {song.jacket_hash: song.feature_vector for song in self.songs
+                   if getattr(song, 'jacket_hash', None) is not None}
+        print(f'Updating index from {len(jacket_files)} jackets')
+
+        songs = list()
+        added = list()
+        removed_ids = list()
+        to_encode = list()
+        for jf in tqdm(jacket_files):
+            jacket_hash = Song.hash_jacket(jf)
+            song = by_path.pop(str(jf), None)
+            if song is not None and getattr(song, 'jacket_hash', None) == jacket_hash:
+                song.song_data = Song.parse_metadata_file(jf.parent / 'metadata.json')
+                songs.append(song)
+                continue
+
+            if song is None:
+                song = Song()
+                song.song_id = self.next_id
+                self.next_id += 1
+            else:
+                removed_ids.append(song.song_id)
+            song.initialize(jf, jf.parent / 'metadata.json', jacket_hash=jacket_hash)
+            song.feature_vector = by_hash.get(jacket_hash)
+            if song.feature_vector is None:
+                to_encode.append(song)
+            songs.append(song)
+            added.append(song)
+
+        # Whatever is left wasn't found in the scrape directory anymore
+        removed_ids.extend(song.song_id for song in by_path.values())
+
+        if to_encode:
+            features = self._encode_files([song.jacket_file for song in to_encode], batch_size, workers)
+            for song, feature_vector in zip(to_encode, features):
+                song.feature_vector = feature_vector
+
+        self.songs = songs
+        self._songs_by_id = None
+        self._collate_feature_vectors()
+        print(f'Added or changed {len(added)} jackets ({len(to_encode)} encoded), removed {len(by_path)} jackets')
+        return added, removed_ids
+
+    def _prepare_batch(self, jacket_files):
+        return np.stack([self.encoder.prepare(self.encoder.load_file(jf)) for jf in jacket_files])
+
+    def _prefetch_batches(self, jacket_files, batch_size, workers):
+        """
+        Decode and preprocess batches of jackets on a thread pool, keeping a bounded number of batches in flight.
 
-    def _populate_feature_vectors(self):
-        print(f'Constructing feature vectors. This may take a minute.')
-        for song in tqdm(self.songs):
-            song.feature_vector = self.encoder.encode_file(song.jacket_file).tolist()
+        :return: Generator of (start index, Nx3xHxW batch)
+        """
+        starts = iter(range(0, len(jacket_files), batch_size))
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            pending = deque()
+            for start in starts:
+                pending.append((start, pool.submit(self._prepare_batch, jacket_files[start:start + batch_size])))
+                if len(pending) > workers:
+                    break
+            while pending:
+                start, future = pending.popleft()
+                next_start = next(starts, None)
+                if next_start is not None:
+                    pending.append((next_start, pool.submit(self._prepare_batch,
+                                                            jacket_files[next_start:next_start + batch_size])))
+                yield start, future.result()
+
+    def _encode_files(self, jacket_files, batch_size=32, workers=4):
+        """
+        :return: len(jacket_files) x D float32 matrix of normalized features
+        """
+        print(f'Constructing feature vectors for {len(jacket_files)} jackets in batches of {batch_size}')
+        features = None
+        with tqdm(total=len(jacket_files)) as progress:
+            for start, batch in self._prefetch_batches(jacket_files, batch_size, workers):
+                encoded = self.encoder.encode_prepared(batch, normalize=True)
+                if features is None:
+                    features = np.empty((len(jacket_files), encoded.shape[1]), dtype=np.float32)
+                features[start:start + len(encoded)] = encoded
+                progress.update(len(encoded))
+        return features if features is not None else np.zeros((0, 0), dtype=np.float32)
+
+    def _populate_feature_vectors(self, batch_size=32, workers=4):
+        self.features = self._encode_files([song.jacket_file for song in self.songs], batch_size, workers)
+        # Songs hold views into the feature matrix
+        for song, feature_vector in zip(self.songs, self.features):
+            song.feature_vector = feature_vector
 
     def _collate_feature_vectors(self):
         self.features = np.array([x.feature_vector for x in self.songs], dtype=np.float32)
+        # Songs hold views into the new matrix, rather than into whatever they were read from (e.g. a memory map)
+        for song, feature_vector in zip(self.songs, self.features):
+            song.feature_vector = feature_vector
+
+    def song_by_id(self, song_id):
+        if self._songs_by_id is None:
+            self._songs_by_id = {song.song_id: song for song in self.songs}
+        return self._songs_by_id[song_id]
 
     def __getitem__(self, item):
         return self.songs[item]
@@ -153,31 +510,119 @@ class Database:
 
 
 class DatabaseLookup:
-    def __init__(self, database: Database):
+    def __init__(self, database: Database, prebuilt=None, index_type='flat', precision='float32', pca_dim=None,
+                 nlist=None, nprobe=8, hnsw_m=32, ef_search=64, pq_m=None, pq_bits=8):
+        """
+        :param database: Database to search
+        :param prebuilt: Location the database was loaded from. If given, the trained index is persisted next to it
+                         (see `index_path`) and reloaded on the next start instead of being rebuilt
+        :param index_type: One of INDEX_TYPES. See `index_factory_string` for the remaining index options
+        :param nprobe: Number of IVF clusters searched per query (ivf_flat and pq)
+        :param ef_search: Size of the HNSW search queue (hnsw)
+        """
         self.db = database
         self.encoder = database.encoder
-        self.index = self._create_faiss_index()
+        self.index_type = index_type
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.factory = index_factory_string(index_type, database.features.shape[1], len(database),
+                                            precision=precision, pca_dim=pca_dim, nlist=nlist, hnsw_m=hnsw_m,
+                                            pq_m=pq_m, pq_bits=pq_bits)
+        self.index_file = None if prebuilt is None else index_path(prebuilt, self.factory)
+
+        self.index = self._load_index()
+        if self.index is None:
+            self.index = self._create_faiss_index()
+            self._save_index()
+        set_search_params(self.index, self.index_type, nprobe=self.nprobe, ef_search=self.ef_search)
 
     @classmethod
-    def from_prebuilt(cls, prebuilt_pkl, encoder_cache=None):
-        return cls(Database.load(prebuilt_pkl, encoder_cache=encoder_cache))
+    def from_prebuilt(cls, prebuilt, encoder_cache=None, encoder_backend=None, persist_index=True, **index_options):
+        """
+        :param persist_index: Save the trained index next to the database and reuse it on later loads
+        :param index_options: See `DatabaseLookup.__init__`
+        """
+        database = Database.load(prebuilt, encoder_cache=encoder_cache, encoder_backend=encoder_backend)
+        return cls(database, prebuilt=prebuilt if persist_index else None, **index_options)
 
     @staticmethod
     def normalize(array):
         return array / np.linalg.norm(array, axis=-1, keepdims=True)
 
+    def _feature_matrix(self):
+        return DatabaseLookup.normalize(np.asarray(self.db.features, dtype=np.float32))
+
+    def _song_ids(self):
+        return np.array([song.song_id for song in self.db], dtype=np.int64)
+
+    def _signature(self):
+        """
+        :return: Hash of the song ids and features, so a persisted index is only reused for the database it indexes
+        """
+        digest = hashlib.sha256()
+        digest.update(self._song_ids().tobytes())
+        digest.update(np.ascontiguousarray(self.db.features, dtype=np.float32).tobytes())
+        return digest.hexdigest()
+
     def _create_faiss_index(self):
-        print('Creating FAISS index')
+        print(f'Creating FAISS index {self.factory}')
         tic = time.time()
-        feature_matrix = np.array(np.row_stack([x.feature_vector for x in self.db])).astype(np.float32)
-        feature_matrix = DatabaseLookup.normalize(feature_matrix)
-        feature_len = feature_matrix.shape[1]
-
-        index = faiss.IndexFlatIP(feature_len)
-        index.add(feature_matrix)
+        index = build_index(self._feature_matrix(), self._song_ids(), self.factory)
         print(f'FAISS indexing took {time.time() - tic} seconds')
         return index
 
+    def _load_index(self):
+        if self.index_file is None or not self.index_file.exists():
+            return None
+        sidecar = self.index_file.with_suffix('.json')
+        if not sidecar.exists():
+            return None
+        with open(sidecar, 'r') as fid:
+            record = json.load(fid)
+        if record.get('factory') != self.factory or record.get('signature') != self._signature() or \
+                record.get('version', 1) != INDEX_VERSION:
+            print(f'Persisted FAISS index {self.index_file} is out of date, rebuilding')
+            return None
+
+        tic = time.time()
+        index = faiss.read_index(str(self.index_file))
+        print(f'Loaded FAISS index {self.factory} from {self.index_file} in {time.time() - tic} seconds')
+        return index
+
+    def _save_index(self):
+        if self.index_file is None:
+            return
+        # Write the index before its sidecar (atomically), so an interrupted save is never mistaken for a valid index
+        sidecar = self.index_file.with_suffix('.json')
+        sidecar.unlink(missing_ok=True)
+        tmp_file = self.index_file.with_name(self.index_file.name + '.tmp')
+        faiss.write_index(self.index, str(tmp_file))
+        os.replace(tmp_file, self.index_file)
+        with open(sidecar, 'w') as fid:
+            json.dump({'factory': self.factory, 'signature': self._signature(), 'count': len(self.db),
+                       'version': INDEX_VERSION}, fid, indent=2)
+        print(f'Saved FAISS index to {self.index_file}')
+
+    def update(self, scrape_dir, batch_size=32, workers=4):
+        """
+        Incrementally update the database (see `Database.update`) and apply the changes to the FAISS index.
+        """
+        added, removed_ids = self.db.update(scrape_dir, batch_size=batch_size, workers=workers)
+        if removed_ids and self.index_type == 'hnsw':
+            # Vectors can't be removed from an HNSW graph
+            self.index = self._create_faiss_index()
+            set_search_params(self.index, self.index_type, nprobe=self.nprobe, ef_search=self.ef_search)
+        else:
+            if removed_ids:
+                self.index.remove_ids(np.array(removed_ids, dtype=np.int64))
+            if added:
+                feature_matrix = DatabaseLookup.normalize(np.array([song.feature_vector for song in added],
+                                                                   dtype=np.float32))
+                self.index.add_with_ids(feature_matrix, np.array([song.song_id for song in added], dtype=np.int64))
+        if added or removed_ids:
+            self._save_index()
+        return added, removed_ids
+
     def lookup(self, rgb_image, count=1):
         """
         HxWx3 input image
@@ -189,14 +634,58 @@ class DatabaseLookup:
         tic = time.time()
         distances, indices = self.index.search(q, count)
         print(f'Lookup took {1000*(time.time() - tic)} ms')
-        nearest_songs = [self.db[ii] for ii in indices[0]]
-        return distances[0], nearest_songs
+        # Approximate indices pad with -1 when they find fewer than `count` candidates
+        found = indices[0] >= 0
+        nearest_songs = [self.db.song_by_id(ii) for ii in indices[0][found]]
+        return distances[0][found], nearest_songs
+
+    def lookup_batch(self, rgb_images, count=1, fusion='score', candidates=5):
+        """
+        Identify one jacket from several crops of it (e.g. consecutive splash frames, or jittered crops of one frame).
+        All crops are encoded in a single forward pass and searched together, and the per-crop results are fused.
+
+        :param rgb_images: List of HxWx3 RGB crops of the same jacket
+        :param count: Number of fused results to return
+        :param fusion: One of FUSION_METHODS
+        :param candidates: Number of nearest songs considered per crop
+        :return: (fused scores, songs) like `lookup`. Scores are mean similarities for 'score' and vote fractions for
+                 'vote'
+        """
+        if fusion not in FUSION_METHODS:
+            raise ValueError(f'Unknown fusion method {fusion}. Valid options are one of {list(FUSION_METHODS)}.')
+
+        tic = time.time()
+        q = self.encoder.encode_batch(list(rgb_images), normalize=True)
+        print(f'Encoding {len(q)} crops took {1000*(time.time() - tic)} ms')
+        tic = time.time()
+        distances, indices = self.index.search(q, max(count, candidates))
+        print(f'Lookup took {1000*(time.time() - tic)} ms')
+
+        # (songs, crops) similarity table over every song that was a candidate for any crop
+        found = indices >= 0
+        song_ids, columns = np.unique(indices[found], return_inverse=True)
+        similarity = np.zeros((len(song_ids), len(q)), dtype=np.float32)
+        similarity[columns, np.nonzero(found)[0]] = distances[found]
+        mean_similarity = similarity.mean(axis=1)
+
+        if fusion == 'score':
+            fused = mean_similarity
+            order = np.argsort(-fused, kind='stable')
+        else:
+            votes = np.zeros(len(song_ids), dtype=np.float32)
+            best = indices[:, 0]
+            np.add.at(votes, np.searchsorted(song_ids, best[best >= 0]), 1)
+            fused = votes / len(q)
+            order = np.lexsort((-mean_similarity, -votes))
+
+        order = order[:count]
+        return fused[order], [self.db.song_by_id(ii) for ii in song_ids[order]]
 
 
 if __name__ == "__main__":
     from datetime import datetime
     db = Database.build('/home/tim/persistent/database/songs', encoder_model='efficientnet_b0', encoder_cache='/home/tim/persistent/database/cache')
-    db.save(f'/home/tim/persistent/database/db_effnetb0-{datetime.now().strftime("%Y%m%d")}.pkl')
+    db.save(f'/home/tim/persistent/database/db_effnetb0-{datetime.now().strftime("%Y%m%d")}')
     # db = Database.load('../output/db_effnetb0.pkl')
     # db = DatabaseLookup.from_prebuilt('../output/db_effnetb1.pkl')
     a = 1
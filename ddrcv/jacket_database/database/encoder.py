@@ -1,33 +1,66 @@
+import json
+import tempfile
 from copy import copy
 
-import timm
+import cv2
 import numpy as np
 from pathlib import Path
-import torch
-from PIL import Image
-from torchvision import transforms
 
 from ddrcv.jacket_database.database.checksum import compute_checksum, save_checksum_to_file
 
+# 'torch' runs the timm model directly. 'onnx' and 'onnx_int8' run an exported copy of the same model (fp32, or with
+# int8 quantized weights) through ONNX Runtime, which doesn't need torch at runtime. See `Encoder.export`.
+ENCODER_BACKENDS = ('torch', 'onnx', 'onnx_int8')
+
+
+def artifact_path(cache_dir, model_name, backend):
+    """
+    :return: Location of the encoder weights (torch) or exported model (onnx) inside the encoder cache
+    """
+    if backend == 'torch':
+        return Path(cache_dir) / f'{model_name}.pth'
+    return Path(cache_dir) / f'{model_name}.{backend}.onnx'
+
 
 class Encoder:
     """ A class for holding the encoder model for image similarity search."""
-    def __init__(self, model_name='efficientnet_b0', cache_dir='cache'):
+    def __init__(self, model_name='efficientnet_b0', cache_dir='cache', backend='torch'):
         """
         Parameters:
         -----------
         model_name : str, optional (default='efficientnet_b0')
         The name of the pre-trained model to use for feature extraction.
+        cache_dir : str, optional (default='cache')
+        Directory holding the weights and exported models.
+        backend : str, optional (default='torch')
+        One of ENCODER_BACKENDS. The onnx backends need an export made with `python -m
+        ddrcv.jacket_database.database.export_encoder`.
         """
+        if backend not in ENCODER_BACKENDS:
+            raise ValueError(f'[Encoder] Unknown backend {backend}. Valid options are one of {list(ENCODER_BACKENDS)}.')
+
         self.model_name = model_name
+        self.backend = backend
         self.cache_dir = cache_dir
 
         self.cache_dir = Path(self.cache_dir)
         self.cache_dir.mkdir(exist_ok=True, parents=True)
 
+        if backend == 'torch':
+            self._load_torch()
+        else:
+            self._load_onnx()
+        print(f'Checksum: {self.checksum}')
+        print(f"Model Loaded Successfully: {model_name} ({backend})")
+
+    def _load_torch(self):
+        import timm
+        import torch
+        from torchvision import transforms
+
         # Set the output weights path to be a known location, rather than the
         # default timm location that buries it deep inside the user directory
-        weights_file = self.cache_dir / f'{self.model_name}.pth'
+        weights_file = artifact_path(self.cache_dir, self.model_name, 'torch')
 
         weights_exist = weights_file.exists()
 
@@ -48,37 +81,160 @@ class Encoder:
         # (and, consequently, that the database is invalid)
         self.checksum = compute_checksum(weights_file, algorithm='sha256', chunk_size=4096)
         save_checksum_to_file(self.checksum, weights_file.with_suffix('.sha256_4096'))
-        print(f'Checksum: {self.checksum}')
 
         # Remove the classification layer, leaving us with the final FC layer (our encoding)
         self.model = torch.nn.Sequential(*list(base_model.children())[:-1])
 
         # Save normalization values
-        self.input_shape = base_model.pretrained_cfg['input_size'][1:]
+        self.input_shape = tuple(base_model.pretrained_cfg['input_size'][1:])
+        self.mean = tuple(base_model.pretrained_cfg['mean'])
+        self.std = tuple(base_model.pretrained_cfg['std'])
         self.preprocess = transforms.Compose([
             transforms.ToTensor(),
             transforms.Resize(self.input_shape, transforms.InterpolationMode.BILINEAR),
-            transforms.Normalize(mean=base_model.pretrained_cfg['mean'], std=base_model.pretrained_cfg['std'])
+            transforms.Normalize(mean=self.mean, std=self.std)
         ])
 
         # Set the model to inference
         self.model.eval()
-        print(f"Model Loaded Successfully: {model_name}")
 
-    def encode_file(self, img_path, normalize=True):
+    def _load_onnx(self):
+        import onnxruntime as ort
+
+        model_file = artifact_path(self.cache_dir, self.model_name, self.backend)
+        if not model_file.exists() or not model_file.with_suffix('.json').exists():
+            raise FileNotFoundError(f'[Encoder] No {self.backend} export of {self.model_name} in {self.cache_dir}. '
+                                    f'Run `python -m ddrcv.jacket_database.database.export_encoder --model '
+                                    f'{self.model_name} --cache-dir {self.cache_dir} --backend {self.backend}` first.')
+
+        # The sidecar written by the export holds the preprocessing, so timm isn't needed to run the model
+        with open(model_file.with_suffix('.json'), 'r') as fid:
+            sidecar = json.load(fid)
+
+        self.checksum = compute_checksum(model_file, algorithm='sha256', chunk_size=4096)
+        if self.checksum != sidecar['checksum']:
+            raise ValueError(f'[Encoder] Checksum of {model_file} does not match its export record. Re-export it.')
+
+        self.input_shape = tuple(sidecar['input_size'])
+        self.mean = np.array(sidecar['mean'], dtype=np.float32)
+        self.std = np.array(sidecar['std'], dtype=np.float32)
+        self.session = ort.InferenceSession(str(model_file), providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def _preprocess_numpy(self, img):
+        """
+        HxWx3 RGB uint8 image -> 1x3xHxW normalized float32 batch, without torch.
+        """
+        height, width = self.input_shape
+        interpolation = cv2.INTER_AREA if img.shape[0] > height or img.shape[1] > width else cv2.INTER_LINEAR
+        img = cv2.resize(img, (width, height), interpolation=interpolation).astype(np.float32) / 255
+        img = (img - self.mean) / self.std
+        return np.ascontiguousarray(img.transpose(2, 0, 1)[None, ...])
+
+    @staticmethod
+    def load_file(img_path):
+        """
+        :return: HxWx3 RGB uint8 image
+        """
+        from PIL import Image
         img = Image.open(img_path)
         img = img.convert('RGB')
-        return self.encode_numpy(np.array(img), normalize=normalize)
+        return np.array(img)
+
+    def encode_file(self, img_path, normalize=True):
+        return self.encode_numpy(self.load_file(img_path), normalize=normalize)
+
+    def prepare(self, img):
+        """
+        Resize and normalize a single HxWx3 RGB uint8 image into the 3xHxW float32 model input. Safe to call from
+        worker threads, so preprocessing can overlap with encoding (see `encode_prepared`).
+        """
+        if self.backend == 'torch':
+            return self.preprocess(img).numpy()
+        return self._preprocess_numpy(img)[0]
+
+    def encode_prepared(self, batch, normalize=True):
+        """
+        :param batch: Nx3xHxW float32 array of `prepare`d images
+        :return: NxD float32 features
+        """
+        if self.backend == 'torch':
+            import torch
+            with torch.inference_mode():
+                features = self.model(torch.from_numpy(batch))
+            features = features.cpu().numpy().reshape(len(batch), -1)
+        else:
+            features = self.session.run(None, {self.input_name: np.ascontiguousarray(batch)})[0]
+            features = features.reshape(len(batch), -1)
+        if normalize:
+            features = features / np.linalg.norm(features, axis=-1, keepdims=True)
+        return features.astype(np.float32, copy=False)
+
+    def encode_batch(self, images, normalize=True):
+        """
+        :param images: List of HxWx3 RGB uint8 images
+        :return: NxD float32 features
+        """
+        return self.encode_prepared(np.stack([self.prepare(img) for img in images]), normalize=normalize)
 
     def encode_numpy(self, img, normalize=True):
-        with torch.no_grad():
-            img = self.preprocess(img).unsqueeze(0)
-            features = self.model(img)
-        features = features.cpu().numpy()[0]
+        if self.backend == 'torch':
+            import torch
+            with torch.no_grad():
+                img = self.preprocess(img).unsqueeze(0)
+                features = self.model(img)
+            features = features.cpu().numpy()[0]
+        else:
+            features = self.session.run(None, {self.input_name: self._preprocess_numpy(img)})[0][0]
         if normalize:
             features = features / np.linalg.norm(features)
         return features
 
+    def export(self, backend):
+        """
+        Export the torch model for one of the onnx backends into the encoder cache, next to the torch weights. Writes
+        the model, its checksum (.sha256_4096) and a .json sidecar with the preprocessing and checksums.
+
+        :return: Path of the exported model
+        """
+        if self.backend != 'torch':
+            raise ValueError('[Encoder] Exports are made from the torch backend')
+        if backend not in ENCODER_BACKENDS or backend == 'torch':
+            raise ValueError(f'[Encoder] Can not export to backend {backend}. Valid options are one of '
+                             f'{list(ENCODER_BACKENDS[1:])}.')
+
+        import torch
+
+        output_file = artifact_path(self.cache_dir, self.model_name, backend)
+        height, width = self.input_shape
+        dummy = torch.zeros(1, 3, height, width, dtype=torch.float32)
+        with tempfile.TemporaryDirectory(dir=self.cache_dir) as tmp_dir:
+            # The int8 model is quantized from an fp32 export, which is only an intermediate. It isn't left in the
+            # cache, where it would look like an 'onnx' export without its sidecar and checksum.
+            fp32_file = output_file if backend == 'onnx' else Path(tmp_dir) / f'{self.model_name}.fp32.onnx'
+            torch.onnx.export(self.model, dummy, str(fp32_file), input_names=['image'], output_names=['features'],
+                              dynamic_axes={'image': {0: 'batch'}, 'features': {0: 'batch'}}, opset_version=17)
+
+            if backend == 'onnx_int8':
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+                quantize_dynamic(str(fp32_file), str(output_file), weight_type=QuantType.QUInt8)
+
+        checksum = compute_checksum(output_file, algorithm='sha256', chunk_size=4096)
+        save_checksum_to_file(checksum, output_file.with_suffix('.sha256_4096'))
+        sidecar = {
+            'model_name': self.model_name,
+            'backend': backend,
+            'input_size': list(self.input_shape),
+            'mean': list(self.mean),
+            'std': list(self.std),
+            'checksum': checksum,
+            'source_checksum': self.checksum
+        }
+        with open(output_file.with_suffix('.json'), 'w') as fid:
+            json.dump(sidecar, fid, indent=2)
+        print(f'Exported {self.model_name} ({backend}) to {output_file}, checksum {checksum}')
+        return output_file
+
 
 
 if __name__ == "__main__":
@@ -0,0 +1,27 @@
+"""
+Export the jacket encoder for the ONNX Runtime backends, so lookups can run without torch.
+
+    python -m ddrcv.jacket_database.database.export_encoder --cache-dir /path/to/cache --backend onnx_int8
+
+The exported model, its checksum and a .json sidecar are written into the encoder cache. A database built with one
+backend can only be loaded with the same backend (see Database.load), so rebuild the database after exporting.
+"""
+import argparse
+
+from ddrcv.jacket_database.database.encoder import ENCODER_BACKENDS, Encoder
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the jacket encoder for ONNX Runtime')
+    parser.add_argument('--model', type=str, default='efficientnet_b0', help='timm model name')
+    parser.add_argument('--cache-dir', type=str, default='cache', help='Encoder cache directory')
+    parser.add_argument('--backend', type=str, default='onnx_int8', choices=list(ENCODER_BACKENDS[1:]),
+                        help='Backend to export for')
+    args = parser.parse_args()
+
+    encoder = Encoder(model_name=args.model, cache_dir=args.cache_dir, backend='torch')
+    encoder.export(args.backend)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Recall@1 and latency of the DatabaseLookup index types against the exact 'flat' index.
+
+    python -m ddrcv.jacket_database.database.index_report /path/to/db --encoder-cache /path/to/cache
+    python -m ddrcv.jacket_database.database.index_report /path/to/db --scale 4 --output index_report.json
+
+Queries are the database's own features with noise added, standing in for jackets cropped from captured frames.
+`--scale` grows the table with noisy copies of the real jackets, to see how each index holds up once older mixes are
+folded in. Recall@1 is the fraction of queries whose top match agrees with the flat index. Update recall@1 is measured
+after every 10th song is removed and added back, the way `DatabaseLookup.update` changes the index (indices that can't
+remove songs, like hnsw, are rebuilt by the update instead and report none).
+"""
+import argparse
+import json
+import time
+
+import faiss
+import numpy as np
+
+from ddrcv.bench.benchmark import summarize
+from ddrcv.jacket_database.database.database import Database, DatabaseLookup, build_index, index_factory_string, \
+    set_search_params
+
+# (name, index options) pairs compared by default
+DEFAULT_CONFIGS = (
+    ('flat', {'index_type': 'flat'}),
+    ('flat_fp16', {'index_type': 'flat', 'precision': 'float16'}),
+    ('flat_pca256', {'index_type': 'flat', 'pca_dim': 256}),
+    ('ivf_flat', {'index_type': 'ivf_flat'}),
+    ('ivf_flat_fp16', {'index_type': 'ivf_flat', 'precision': 'float16'}),
+    ('hnsw', {'index_type': 'hnsw'}),
+    ('hnsw_pca256', {'index_type': 'hnsw', 'pca_dim': 256}),
+    ('pq', {'index_type': 'pq'}),
+)
+
+# Options consumed by the search rather than the factory string
+SEARCH_OPTIONS = ('nprobe', 'ef_search')
+
+
+def synthesize_table(features, scale, noise, rng):
+    """
+    :return: (scale * N)xD normalized feature table holding the real features followed by noisy copies of them
+    """
+    tables = [features]
+    for _ in range(scale - 1):
+        tables.append(DatabaseLookup.normalize(features + rng.normal(scale=noise, size=features.shape)))
+    return np.ascontiguousarray(np.concatenate(tables).astype(np.float32))
+
+
+def update_recall(index, table, queries, truth):
+    """
+    :return: Recall@1 after every 10th entry was removed from the index and added back, or None if the index can't
+             remove entries
+    """
+    removed = np.arange(0, len(table), 10, dtype=np.int64)
+    try:
+        index.remove_ids(removed)
+    except RuntimeError:
+        return None
+    index.add_with_ids(table[removed], removed)
+    _, found = index.search(queries, 1)
+    return float(np.mean(found[:, 0] == truth))
+
+
+def evaluate(table, queries, truth, options, iterations):
+    """
+    :return: Report for one index configuration, see `main`
+    """
+    search = {key: options[key] for key in SEARCH_OPTIONS if key in options}
+    factory_options = {key: value for key, value in options.items() if key not in SEARCH_OPTIONS}
+    index_type = factory_options.pop('index_type')
+    factory = index_factory_string(index_type, table.shape[1], table.shape[0], **factory_options)
+
+    tic = time.perf_counter()
+    index = build_index(table, np.arange(len(table), dtype=np.int64), factory)
+    build_s = time.perf_counter() - tic
+
+    serialized = faiss.serialize_index(index)
+    tic = time.perf_counter()
+    index = faiss.deserialize_index(serialized)
+    load_ms = 1000 * (time.perf_counter() - tic)
+    set_search_params(index, index_type, **search)
+
+    _, found = index.search(queries, 1)
+    recall = float(np.mean(found[:, 0] == truth))
+
+    # Single queries, like DatabaseLookup.lookup
+    samples = np.empty(iterations, dtype=np.float64)
+    for ii in range(iterations):
+        query = queries[ii % len(queries)][None, :]
+        tic = time.perf_counter()
+        index.search(query, 1)
+        samples[ii] = 1000 * (time.perf_counter() - tic)
+
+    return {
+        'factory': factory,
+        'recall_at_1': recall,
+        'update_recall_at_1': update_recall(index, table, queries, truth),
+        'build_s': build_s,
+        'load_ms': load_ms,
+        'size_mb': serialized.nbytes / 2 ** 20,
+        'latency': summarize(samples)
+    }
+
+
+def format_report(reports):
+    header = f'{"index":<16}{"factory":<28}{"recall@1":>10}{"update":>10}{"p50 ms":>10}{"p95 ms":>10}{"build s":>10}' \
+             f'{"load ms":>10}{"MB":>8}'
+    lines = [header, '-' * len(header)]
+    for name, report in reports.items():
+        if 'error' in report:
+            lines.append(f'{name:<16}failed ({report["error"]})')
+            continue
+        latency = report['latency']
+        update = '-' if report['update_recall_at_1'] is None else f'{report["update_recall_at_1"]:.3f}'
+        lines.append(f'{name:<16}{report["factory"]:<28}{report["recall_at_1"]:>10.3f}{update:>10}'
+                     f'{latency["p50_ms"]:>10.3f}{latency["p95_ms"]:>10.3f}{report["build_s"]:>10.2f}'
+                     f'{report["load_ms"]:>10.2f}{report["size_mb"]:>8.2f}')
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare jacket database index types against the flat index')
+    parser.add_argument('database', type=str, help='Prebuilt database (directory or legacy .pkl)')
+    parser.add_argument('--encoder-cache', type=str, default=None, help='Encoder cache directory for the database')
+    parser.add_argument('--scale', type=int, default=1, help='Grow the table to this many times the database size')
+    parser.add_argument('--noise', type=float, default=0.02, help='Std of the noise added to queries and copies')
+    parser.add_argument('--queries', type=int, default=1000, help='Number of queries')
+    parser.add_argument('--iterations', type=int, default=500, help='Timed single queries per index')
+    parser.add_argument('--nprobe', type=int, default=8, help='IVF clusters searched per query')
+    parser.add_argument('--ef-search', type=int, default=64, help='HNSW search queue size')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default=None, help='Write the report as JSON')
+    args = parser.parse_args()
+
+    database = Database.load(args.database, encoder_cache=args.encoder_cache)
+    features = DatabaseLookup.normalize(np.asarray(database.features, dtype=np.float32))
+    rng = np.random.default_rng(args.seed)
+    table = synthesize_table(features, args.scale, args.noise, rng)
+    targets = rng.integers(0, len(features), size=args.queries)
+    queries = DatabaseLookup.normalize(features[targets] + rng.normal(scale=args.noise, size=(args.queries,
+                                                                                             features.shape[1])))
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    print(f'{len(table)} x {table.shape[1]} table ({len(features)} songs), {len(queries)} queries')
+
+    # Ground truth is the exact search over the same table
+    _, truth = build_index(table, np.arange(len(table), dtype=np.int64), 'Flat').search(queries, 1)
+    truth = truth[:, 0]
+
+    reports = dict()
+    for name, options in DEFAULT_CONFIGS:
+        options = dict(options, nprobe=args.nprobe, ef_search=args.ef_search)
+        print(f'Evaluating {name}')
+        try:
+            reports[name] = evaluate(table, queries, truth, options, args.iterations)
+        except (ValueError, RuntimeError) as e:
+            reports[name] = {'error': str(e)}
+
+    print()
+    print(format_report(reports))
+
+    if args.output is not None:
+        with open(args.output, 'w') as fid:
+            json.dump({'config': vars(args), 'count': len(table), 'dim': int(table.shape[1]), 'indices': reports},
+                      fid, indent=2)
+        print(f'Wrote {args.output}')
+
+
+if __name__ == "__main__":
+    main()
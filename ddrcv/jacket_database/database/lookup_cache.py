@@ -0,0 +1,104 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from ddrcv.state.dhash import dhash, hamming_distance
+
+
+class LookupCache:
+    """
+    LRU cache in front of `DatabaseLookup.lookup`, keyed by a perceptual hash of the jacket crop.
+
+    The same jacket shows up on the splash screen, again on the results screen and across repeated frames, each time
+    with slightly different compression and scaling. A 16x16 difference hash (256 bits) is insensitive to that, so a
+    cached result is reused when the query hash is within `max_distance` bits of a cached one, and the CNN encoder only
+    runs for jackets that haven't been seen recently.
+
+    Has the same lookup signature as DatabaseLookup, so it can be handed to the parsers in its place.
+    """
+    def __init__(self, database, capacity=64, max_distance=16, hash_size=16):
+        """
+        :param database: DatabaseLookup to forward misses to
+        :param capacity: Maximum number of cached jackets
+        :param max_distance: Maximum Hamming distance (in bits) between hashes of the same jacket
+        :param hash_size: dhash size, the hash has hash_size**2 bits
+        """
+        self.database = database
+        self.capacity = capacity
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()  # key -> (hash, count, result), least recently used first
+        self._next_key = 0
+        self._keys = []
+        self._hashes = None
+        self._lock = threading.Lock()
+
+    def _find(self, query_hash, count):
+        """
+        :return: Key of the closest cached entry within max_distance holding at least `count` results, or None
+        """
+        if not self._entries:
+            return None
+        if self._hashes is None:
+            self._keys = list(self._entries.keys())
+            self._hashes = np.stack([self._entries[key][0] for key in self._keys])
+
+        distances = hamming_distance(self._hashes, query_hash[None, :])
+        for idx in np.argsort(distances, kind='stable'):
+            if distances[idx] > self.max_distance:
+                break
+            key = self._keys[idx]
+            if self._entries[key][1] >= count:
+                return key
+        return None
+
+    def lookup(self, rgb_image, count=1):
+        """
+        HxWx3 input image. See `DatabaseLookup.lookup`.
+        """
+        query_hash = dhash(rgb_image, hash_size=self.hash_size, channel_order='rgb')
+        with self._lock:
+            key = self._find(query_hash, count)
+            if key is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                distances, songs = self._entries[key][2]
+                return distances[:count], songs[:count]
+            self.misses += 1
+
+        result = self.database.lookup(rgb_image, count=count)
+
+        with self._lock:
+            self._entries[self._next_key] = (query_hash, count, result)
+            self._next_key += 1
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+            self._hashes = None
+        return result
+
+    def lookup_batch(self, rgb_images, count=1, fusion='score', candidates=5):
+        """
+        Not cached, see `DatabaseLookup.lookup_batch`.
+        """
+        return self.database.lookup_batch(rgb_images, count=count, fusion=fusion, candidates=candidates)
+
+    def clear(self):
+        """
+        Drop every cached result, e.g. after the database was updated.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._hashes = None
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'hit_rate': self.hits / total if total > 0 else 0.0
+        }
@@ -0,0 +1,112 @@
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def get_parser_executor():
+    """
+    Process wide single thread executor shared by every AsyncParser. The parsers share the OCR reader and jacket
+    database, neither of which is thread safe, so their jobs run one at a time on the same thread.
+    """
+    if not hasattr(get_parser_executor, 'executor'):
+        get_parser_executor.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ddrcv-parser')
+    return get_parser_executor.executor
+
+
+class AsyncParser:
+    """
+    Runs a slow parser (SplashParser, ResultsParser) in the background, so the frame loop can hand it a frame and keep
+    classifying states and extracting scores while the encoder and OCR run.
+
+        worker.submit(frame, players)   # non-blocking, parses a copy of the frame
+        ret = worker.poll()             # None until the result is ready, then the result (once)
+        worker.cancel()                 # discard pending jobs, e.g. when the state moves on
+
+    By default only the most recent job matters, and submitting discards the previous one. With
+    discard_pending=False jobs are kept and their results are returned in submission order. A job that already started
+    can't be interrupted, but its result is dropped when it is discarded.
+
+    Jobs run on a thread rather than a process, so the OCR reader and jacket database singletons are shared with the
+    rest of the driver (torch, easyocr and faiss release the GIL while they work). All parsers share one worker thread
+    (see `get_parser_executor`), so jobs never run concurrently against the same reader.
+    """
+    def __init__(self, parser, name='parser', discard_pending=True, executor=None, logger=None):
+        """
+        :param parser: Object with a parse(image, *args, **kwargs) method
+        :param name: Used in log messages
+        :param discard_pending: Submitting a job discards any job that hasn't been polled yet
+        :param executor: Executor to run jobs on. Defaults to the shared single thread `get_parser_executor()`
+        """
+        self.parser = parser
+        self.name = name
+        self.discard_pending = discard_pending
+        if logger is None:
+            self.logger = logging.getLogger(type(self).__name__)
+        else:
+            self.logger = logger
+
+        self._executor = get_parser_executor() if executor is None else executor
+        self._lock = threading.Lock()
+        self._jobs = deque()  # (future, context), oldest first
+
+        # Context of the job the last poll() finished with
+        self.last_context = None
+
+    def submit(self, frame, *args, context=None, **kwargs):
+        """
+        Parse a snapshot of the frame in the background. Frames from the fetcher are borrowed views into its ring
+        buffer, so the frame is copied before returning.
+
+        :param context: Any value to associate with the job, available as `last_context` after it is polled
+        """
+        snapshot = frame.copy()
+        with self._lock:
+            if self.discard_pending:
+                self._discard()
+            self._jobs.append((self._executor.submit(self.parser.parse, snapshot, *args, **kwargs), context))
+
+    def poll(self):
+        """
+        :return: The result of the oldest pending job if it finished since the last poll, otherwise None. A failed job
+                 is logged, returns None and is removed.
+        """
+        with self._lock:
+            if not self._jobs or not self._jobs[0][0].done():
+                return None
+            future, self.last_context = self._jobs.popleft()
+
+        if future.cancelled():
+            return None
+        error = future.exception()
+        if error is not None:
+            self.logger.error(f'[{self.name}] Parsing failed: {error!r}')
+            return None
+        return future.result()
+
+    @property
+    def pending(self):
+        """
+        True while a submitted job hasn't been polled yet
+        """
+        with self._lock:
+            return bool(self._jobs)
+
+    def cancel(self):
+        """
+        Discard all pending jobs
+        """
+        with self._lock:
+            self._discard()
+
+    def _discard(self):
+        while self._jobs:
+            future, _ = self._jobs.popleft()
+            if not future.cancel() and not future.done():
+                self.logger.info(f'[{self.name}] Discarding result of a job that already started')
+
+    def stop(self):
+        """
+        Discard pending jobs. The shared worker thread is left running for the other parsers.
+        """
+        self.cancel()
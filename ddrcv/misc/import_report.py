@@ -0,0 +1,100 @@
+"""
+Report what each driver entry point loads at import time, and how long it takes.
+
+    python -m ddrcv.misc.import_report
+    python -m ddrcv.misc.import_report ddrcv.apps.driver_ddr_tbd5_v2 ddrcv.bench.benchmark
+
+Every module is imported in a fresh interpreter with `-X importtime`, so the numbers are cold start costs. Heavy
+backends that should only load when the feature using them is enabled in config are flagged, and the exit code is 1
+if any entry point fails to import or pulls one in.
+"""
+import argparse
+import subprocess
+import sys
+
+DRIVERS = (
+    'ddrcv.apps.driver',
+    'ddrcv.apps.driver_ddr_tbd5',
+    'ddrcv.apps.driver_ddr_tbd5_v2',
+    'ddrcv.apps.sdvx_driver'
+)
+
+# Top level packages that are slow to import and only needed by optional features
+HEAVY = ('easyocr', 'torch', 'torchvision', 'timm', 'faiss', 'matplotlib', 'skimage', 'scipy', 'discord_webhook',
+         'dill', 'PIL', 'imagehash', 'tqdm', 'flask', 'flask_socketio', 'aiortc')
+
+
+def parse_importtime(stderr):
+    """
+    :param stderr: Output of `python -X importtime`
+    :return: (total_ms, packages) where total_ms is the cost of the import statement itself, and packages maps every
+             top level package to its cumulative import time in ms
+    """
+    total_ms = 0.0
+    packages = dict()
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        cumulative_ms = int(cumulative) / 1000
+        # Nested imports are indented by two spaces per level
+        if not name[1:].startswith(' '):
+            total_ms += cumulative_ms
+        name = name.strip()
+        if '.' not in name:
+            packages[name] = cumulative_ms
+    return total_ms, packages
+
+
+def measure(module):
+    """
+    Import a module in a fresh interpreter.
+
+    :return: {'module', 'ok', 'error', 'total_ms', 'packages', 'heavy'}
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          capture_output=True, text=True)
+    total_ms, packages = parse_importtime(proc.stderr)
+    error = None
+    if proc.returncode != 0:
+        error = [line for line in proc.stderr.splitlines() if not line.startswith('import time:')][-1]
+    return {
+        'module': module,
+        'ok': proc.returncode == 0,
+        'error': error,
+        'total_ms': total_ms,
+        'packages': packages,
+        'heavy': {name: ms for name, ms in packages.items() if name in HEAVY}
+    }
+
+
+def format_report(report, top=8):
+    lines = [f'{report["module"]}: {report["total_ms"]:.0f} ms']
+    if not report['ok']:
+        lines.append(f'  import failed: {report["error"]}')
+    if report['heavy']:
+        heavy = ', '.join(f'{name} ({ms:.0f} ms)' for name, ms in sorted(report['heavy'].items(), key=lambda x: -x[1]))
+        lines.append(f'  HEAVY: {heavy}')
+    slowest = sorted(report['packages'].items(), key=lambda x: -x[1])[:top]
+    for name, ms in slowest:
+        lines.append(f'  {name:<24}{ms:>10.1f} ms')
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report the cold import cost of the ddrcv entry points')
+    parser.add_argument('modules', nargs='*', default=list(DRIVERS), help='Modules to import')
+    parser.add_argument('--top', type=int, default=8, help='Number of slowest top level packages to list')
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        report = measure(module)
+        print(format_report(report, top=args.top))
+        print()
+        failed = failed or not report['ok'] or bool(report['heavy'])
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
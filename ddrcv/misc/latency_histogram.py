@@ -0,0 +1,37 @@
+from collections import deque
+
+import numpy as np
+
+
+class LatencyHistogram:
+    """
+    Rolling window of latency samples (in milliseconds) summarized as percentiles.
+    """
+    def __init__(self, window=1000, percentiles=(50, 95, 99)):
+        """
+        :param window: Number of most recent samples to keep
+        :param percentiles: Percentiles to report
+        """
+        self.samples = deque(maxlen=window)
+        self.percentiles = percentiles
+        self.count = 0
+
+    def add(self, value_ms):
+        self.samples.append(value_ms)
+        self.count += 1
+
+    def reset(self):
+        self.samples.clear()
+        self.count = 0
+
+    def summary(self):
+        """
+        :return: Dict with the total sample count and the requested percentiles of the current window, e.g.
+                 {'count': 1200, 'p50': 12.1, 'p95': 20.4, 'p99': 31.0}. Percentiles are None until a sample arrives.
+        """
+        # Copy first, samples may be appended from another thread
+        values = np.array(list(self.samples), dtype=np.float64)
+        output = {'count': self.count}
+        for p in self.percentiles:
+            output[f'p{p}'] = float(np.percentile(values, p)) if values.size > 0 else None
+        return output
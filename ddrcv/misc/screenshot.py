@@ -1,6 +1,6 @@
 from pathlib import Path
 from datetime import datetime
-from PIL import Image
+import cv2
 
 
 class Screenshot:
@@ -11,7 +11,7 @@ class Screenshot:
     def _get_timestamp(self):
         return datetime.now().strftime(self.timestamp_fmt)
 
-    def save(self, rgb_image, suffix=None):
+    def save(self, bgr_image, suffix=None):
         if not self.screenshot_dir.exists():
             self.screenshot_dir.mkdir(exist_ok=True, parents=True)
 
@@ -22,6 +22,5 @@ class Screenshot:
 
         timestamp = self._get_timestamp()
         png_file = Path(self.screenshot_dir) / f'{timestamp}{suffix}.png'
-        im = Image.fromarray(rgb_image)
-        im.save(png_file)
+        cv2.imwrite(str(png_file), bgr_image)
         return png_file
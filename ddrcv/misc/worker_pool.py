@@ -0,0 +1,15 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+def get_worker_pool():
+    """
+    Process wide thread pool for overlapping per-frame work that releases the GIL (OpenCV and NumPy calls).
+
+    The pool is created on first use and kept alive for the lifetime of the process, so dispatching work doesn't pay
+    for thread startup on every frame.
+    """
+    if not hasattr(get_worker_pool, 'pool'):
+        max_workers = min(4, os.cpu_count() or 1)
+        get_worker_pool.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ddrcv-worker')
+    return get_worker_pool.pool
@@ -1,4 +1,6 @@
 from .ocr_singleton import get_ocr_singleton
+from .ocr_service import DIGITS, MIN_CONFIDENCE, OcrService, ocr_options, readtext_group
 from .utils import get_best_match_from_results
 
-__all__ = ["get_ocr_singleton", "get_best_match_from_results"]
\ No newline at end of file
+__all__ = ["get_ocr_singleton", "get_best_match_from_results", "OcrService", "readtext_group", "ocr_options",
+           "DIGITS", "MIN_CONFIDENCE"]
\ No newline at end of file
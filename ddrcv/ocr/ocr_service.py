@@ -0,0 +1,252 @@
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+DIGITS = '0123456789'
+
+# Lowest recognizer confidence kept for a chip read without detection. Without the detector an empty or absent field
+# is still read as some text, just with a low confidence.
+MIN_CONFIDENCE = 0.4
+
+
+def ocr_options(recognize_only, canvas_size, allowlist=None, min_confidence=MIN_CONFIDENCE, **kwargs):
+    """
+    readtext options for a chip request, see `run_group`.
+
+    :param recognize_only: Skip text detection and recognize the whole chip as one line of text. For chips whose text
+                           location is already known from the screen layout.
+    :param canvas_size: Detector canvas size, only used with detection
+    :param allowlist: Characters the recognizer may output, only used without detection (e.g. DIGITS)
+    :param min_confidence: Results with a lower recognizer confidence are dropped, only used without detection
+    :param kwargs: Further options passed in both modes (e.g. adjust_contrast)
+    """
+    if recognize_only:
+        options = dict(kwargs, detect=False, min_confidence=min_confidence)
+        if allowlist is not None:
+            options['allowlist'] = allowlist
+        return options
+    return dict(kwargs, canvas_size=canvas_size)
+
+
+def _group_key(chip, kwargs):
+    # The confidence gate is applied per chip after recognition
+    kwargs = {key: value for key, value in kwargs.items() if key != 'min_confidence'}
+    if not kwargs.get('detect', True):
+        # Recognizer inputs are resized to the model height, so chips of any size go together
+        return 'recognize', tuple(sorted(kwargs.items()))
+    return chip.shape, tuple(sorted(kwargs.items()))
+
+
+def recognize_stacked(reader, chips, min_confidence=0.0, **kwargs):
+    """
+    Recognize pre-cropped single line chips without running the CRAFT text detector. The chips are stacked into one
+    greyscale image and each one is handed to `Reader.recognize` as a known text box.
+
+    :param reader: easyocr.Reader
+    :param chips: List of HxWx3 BGR (or HxW greyscale) uint8 chips
+    :param min_confidence: Per chip, either one value or a list. Results with a lower recognizer confidence are dropped.
+    :param kwargs: Reader.recognize options (e.g. allowlist)
+    :return: readtext style results, one list per chip (empty if no text was read, or only with a low confidence)
+    """
+    greys = [chip if chip.ndim == 2 else cv2.cvtColor(chip, cv2.COLOR_BGR2GRAY) for chip in chips]
+    tops = np.cumsum([0] + [grey.shape[0] for grey in greys])
+    stacked = np.zeros((tops[-1], max(grey.shape[1] for grey in greys)), dtype=np.uint8)
+    boxes = []
+    for grey, top in zip(greys, tops):
+        stacked[top:top + grey.shape[0], :grey.shape[1]] = grey
+        # [x_min, x_max, y_min, y_max]
+        boxes.append([0, grey.shape[1], int(top), int(top) + grey.shape[0]])
+
+    output = reader.recognize(stacked, horizontal_list=boxes, free_list=[], batch_size=len(boxes), **kwargs)
+
+    # Results carry their box, whose top edge identifies the chip
+    chip_at = {int(top): ii for ii, top in enumerate(tops[:-1])}
+    if np.isscalar(min_confidence):
+        min_confidence = [min_confidence] * len(chips)
+    results = [[] for _ in chips]
+    for box, text, confidence in output:
+        ii = chip_at[int(box[0][1])]
+        if not text.strip() or confidence < min_confidence[ii]:
+            continue
+        box = [[x, y - int(tops[ii])] for x, y in box]
+        results[ii] = [(box, text, confidence)]
+    return results
+
+
+def run_group(reader, requests):
+    """
+    Run a set of OCR requests on an easyocr Reader, with one readtext_batched call per distinct (chip shape, options)
+    rather than one call per chip. Requests with detect=False skip detection, and are recognized with one
+    `recognize_stacked` call per distinct set of options.
+
+    :param reader: easyocr.Reader
+    :param requests: List of (chip, kwargs) where kwargs are readtext options (e.g. canvas_size, see `ocr_options`)
+    :return: List of readtext results, one per request, in order
+    """
+    groups = dict()
+    for ii, (chip, kwargs) in enumerate(requests):
+        groups.setdefault(_group_key(chip, kwargs), []).append(ii)
+
+    results = [None] * len(requests)
+    for indices in groups.values():
+        kwargs = requests[indices[0]][1]
+        if not kwargs.get('detect', True):
+            options = {key: value for key, value in kwargs.items() if key not in ('detect', 'min_confidence')}
+            min_confidence = [requests[ii][1].get('min_confidence', 0.0) for ii in indices]
+            chip_results = recognize_stacked(reader, [requests[ii][0] for ii in indices],
+                                             min_confidence=min_confidence, **options)
+            for ii, result in zip(indices, chip_results):
+                results[ii] = result
+            continue
+        if len(indices) == 1:
+            results[indices[0]] = reader.readtext(requests[indices[0]][0], **kwargs)
+            continue
+        chips = np.stack([requests[ii][0] for ii in indices], axis=0)
+        for ii, result in zip(indices, reader.readtext_batched(chips, **kwargs)):
+            results[ii] = result
+    return results
+
+
+def readtext_group(parser, requests):
+    """
+    Read every chip of a screen in as few recognition calls as possible. Works with an easyocr Reader (grouped
+    locally) or an OcrService (grouped in the service process, one round trip).
+
+    :param parser: easyocr.Reader or OcrService
+    :param requests: List of (chip, kwargs)
+    :return: List of readtext results, one per request, in order
+    """
+    if isinstance(parser, OcrService):
+        return parser.readtext_group(requests)
+    return run_group(parser, requests)
+
+
+def _serve(languages, requests, responses, ready):
+    """
+    Service process: load the reader once, then answer (request id, method, payload) messages until a None arrives.
+    """
+    from easyocr import easyocr
+    reader = easyocr.Reader(list(languages))
+    # Warm up, so the first real request doesn't pay for lazy initialization
+    reader.readtext(np.zeros((32, 128, 3), dtype=np.uint8))
+    ready.set()
+
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+        request_id, method, payload = message
+        try:
+            if method == 'group':
+                result = run_group(reader, payload)
+            elif method == 'readtext':
+                image, kwargs = payload
+                result = reader.readtext(image, **kwargs)
+            elif method == 'readtext_batched':
+                images, kwargs = payload
+                result = reader.readtext_batched(images, **kwargs)
+            else:
+                raise ValueError(f'Unknown OCR method {method}')
+            responses.put((request_id, True, result))
+        except Exception as e:
+            responses.put((request_id, False, repr(e)))
+
+
+class OcrService:
+    """
+    easyocr running in a separate, warm process.
+
+    The model is loaded in the background when the service starts, off the driver's critical path, and torch and
+    easyocr are never imported into the driver process. readtext and readtext_batched mirror easyocr.Reader, so the
+    service can be handed to the parsers in place of `get_ocr_singleton()`. readtext_group sends every chip of a screen
+    in one request and the service coalesces them into batched recognition calls (see `run_group`).
+    """
+    def __init__(self, languages=('en',), timeout=30, load_timeout=300):
+        """
+        :param languages: easyocr language codes
+        :param timeout: Seconds to wait for a response before raising TimeoutError
+        :param load_timeout: Seconds a request waits for the model to load (which may include downloading it) before
+                             raising TimeoutError
+        """
+        self.languages = tuple(languages)
+        self.timeout = timeout
+        self.load_timeout = load_timeout
+
+        # Spawn rather than fork, so the child doesn't inherit the driver's threads and capture handles
+        context = multiprocessing.get_context('spawn')
+        self._requests = context.Queue()
+        self._responses = context.Queue()
+        self._ready = context.Event()
+        self._process = context.Process(target=_serve, args=(self.languages, self._requests, self._responses,
+                                                             self._ready),
+                                        name='ddrcv-ocr', daemon=True)
+        self._process.start()
+        self._ids = itertools.count()
+        # One request in flight at a time, so responses can't be handed to the wrong caller
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout=None):
+        """
+        Block until the model is loaded.
+
+        :return: True if the service is ready
+        """
+        tic = time.time()
+        while not self._ready.wait(0.1):
+            if not self._process.is_alive():
+                raise RuntimeError('[OcrService] OCR process exited while loading the model')
+            if timeout is not None and time.time() - tic > timeout:
+                return False
+        return True
+
+    def _call(self, method, payload):
+        with self._lock:
+            if not self._process.is_alive():
+                raise RuntimeError('[OcrService] OCR process is not running')
+            # Model loading doesn't count against the response timeout, but a load that stalls mustn't hang the caller
+            if not self.wait_ready(timeout=self.load_timeout):
+                raise TimeoutError(f'[OcrService] Model not loaded within {self.load_timeout} s')
+            request_id = next(self._ids)
+            self._requests.put((request_id, method, payload))
+            deadline = time.time() + self.timeout
+            while True:
+                try:
+                    response_id, ok, result = self._responses.get(timeout=max(0.0, deadline - time.time()))
+                except queue.Empty:
+                    raise TimeoutError(f'[OcrService] No response to {method} within {self.timeout} s') from None
+                # Late responses to earlier requests that timed out are dropped
+                if response_id == request_id:
+                    break
+                print(f'[OcrService] Discarding late response {response_id}')
+        if not ok:
+            raise RuntimeError(f'[OcrService] {method} failed: {result}')
+        return result
+
+    def readtext(self, image, **kwargs):
+        return self._call('readtext', (np.ascontiguousarray(image), kwargs))
+
+    def readtext_batched(self, images, **kwargs):
+        return self._call('readtext_batched', (np.ascontiguousarray(images), kwargs))
+
+    def readtext_group(self, requests):
+        """
+        :param requests: List of (chip, kwargs)
+        :return: List of readtext results, one per request, in order
+        """
+        return self._call('group', [(np.ascontiguousarray(chip), kwargs) for chip, kwargs in requests])
+
+    def stop(self):
+        if self._process.is_alive():
+            self._requests.put(None)
+            self._process.join(timeout=5)
+        if self._process.is_alive():
+            self._process.terminate()
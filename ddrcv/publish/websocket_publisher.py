@@ -5,6 +5,8 @@ import time
 from multiprocessing import Process, Lock, Manager
 import websockets
 
+from ddrcv.misc.latency_histogram import LatencyHistogram
+
 
 class WebSocketPublisher:
     def __init__(self, host='0.0.0.0', port=9000, delay=0.1, only_send_new=True, logger=None):
@@ -21,6 +23,9 @@ class WebSocketPublisher:
         self.latest_message = manager.dict()
         self.latest_message['content'] = None  # Initialize with None
         self.latest_message['version'] = 0     # Version number to track updates
+        self.latest_message['capture_time'] = None  # Capture time of the frame the message was derived from
+        # Glass-to-websocket latency, summarized by the server process
+        self.latency_stats = manager.dict()
         self.lock = Lock()
         self.process = None
 
@@ -31,16 +36,28 @@ class WebSocketPublisher:
         return WebSocketPublisher(**config, logger=logger)
 
     def start(self):
-        self.process = Process(target=self._run_server, args=(self.latest_message, self.lock))
+        self.process = Process(target=self._run_server, args=(self.latest_message, self.lock, self.latency_stats))
         self.process.start()
 
-    def send_message(self, json_contents):
+    def send_message(self, json_contents, capture_time=None):
+        """
+        :param json_contents: JSON serializable message
+        :param capture_time: Optional wall clock (time.time()) capture time of the frame the message was derived from.
+                             Used to measure the latency from capture to the message going out over the websocket.
+        """
         with self.lock:
             self.latest_message['content'] = json_contents
+            self.latest_message['capture_time'] = capture_time
             if self.only_send_new:
                 self.latest_message['version'] += 1  # Increment version to indicate update
                 self.latest_message['version'] %= 32000
 
+    def stats(self):
+        """
+        :return: Dict with the count and p50/p95/p99 (ms) of the capture to websocket send latency
+        """
+        return dict(self.latency_stats)
+
     def stop(self):
         if self.process is not None and self.process.is_alive():
             self.process.terminate()
@@ -50,9 +67,11 @@ class WebSocketPublisher:
         if self is not None:
             self.stop()
 
-    def _run_server(self, latest_message, lock):
+    def _run_server(self, latest_message, lock, latency_stats):
         connected_clients = set()
         last_version = -1  # Initialize with an invalid version
+        last_capture_time = None
+        latency = LatencyHistogram()
 
         #async def handler(websocket, path):
         async def handler(websocket):
@@ -66,7 +85,7 @@ class WebSocketPublisher:
                 print(f"Client disconnected: {websocket.remote_address}")
 
         async def broadcast_latest_message():
-            nonlocal last_version
+            nonlocal last_version, last_capture_time
             while True:
                 await asyncio.sleep(self.delay)  # Small delay to prevent tight loop
                 with lock:
@@ -80,10 +99,16 @@ class WebSocketPublisher:
                             continue  # No new message, skip sending
                     else:
                         message = json.dumps(latest_message['content'])
+                    capture_time = latest_message['capture_time']
 
                 if connected_clients:
                     coroutines = [client.send(message) for client in connected_clients]
                     await asyncio.gather(*coroutines)
+                    # Only time the first send of each captured frame, re-sends would inflate the latency
+                    if capture_time is not None and capture_time != last_capture_time:
+                        last_capture_time = capture_time
+                        latency.add(1000 * (time.time() - capture_time))
+                        latency_stats.update(latency.summary())
                     print(f"Sent latest message to {len(connected_clients)} client(s): {message}")
 
         async def main():
@@ -1,7 +1,11 @@
+import hashlib
+import os
+from pathlib import Path
+
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
-from skimage.morphology import binary_erosion, binary_dilation, disk
+
+GLYPH_CACHE_DIR = Path(__file__).parent / 'fonts' / 'cache'
 
 
 def apply_contrast(input_img, contrast = 0):
@@ -17,9 +21,10 @@ def apply_contrast(input_img, contrast = 0):
 
 def preprocess_image(image):
     """
-    Preprocess the RGB image by maximizing contrast and binarizing it, considering only pure white pixels.
+    Preprocess the image by maximizing contrast and binarizing it, considering only pure white pixels.
 
-    :param image: The RGB image to be preprocessed.
+    :param image: The BGR image to be preprocessed. Only the product of the channels is used, so the channel order
+                  doesn't matter.
     :return: The preprocessed binary image.
     """
     prod = (255 * np.prod(image / 255, axis=-1)).astype(np.uint8)
@@ -60,8 +65,149 @@ class GlyphLoader:
         return glyphs
 
 
+def nms_indices(boxes, scores, overlap_thresh=0.3):
+    """
+    Greedy Non-Maximum Suppression on arrays.
+
+    :param boxes: (N, 4) array of (x1, y1, x2, y2)
+    :param scores: (N,) array of match values
+    :param overlap_thresh: Overlap threshold for suppression.
+    :return: Indices of the kept boxes, in order of decreasing score
+    """
+    x1 = boxes[:, 0]
+    y1 = boxes[:, 1]
+    x2 = boxes[:, 2]
+    y2 = boxes[:, 3]
+
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    order = scores.argsort()[::-1]
+
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+
+        xx1 = np.maximum(x1[i], x1[order[1:]])
+        yy1 = np.maximum(y1[i], y1[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
+
+        w = np.maximum(0, xx2 - xx1 + 1)
+        h = np.maximum(0, yy2 - yy1 + 1)
+
+        overlap = (w * h) / areas[order[1:]]
+
+        order = order[np.where(overlap <= overlap_thresh)[0] + 1]
+
+    return keep
+
+
+def load_font_glyphs(glyph_dir=None):
+    """
+    Load the numeral glyphs 0.png ... 9.png of a score font.
+
+    :param glyph_dir: Location of the glyph files. Will default to `score/fonts/World2`
+    :return: Dictionary of glyph class -> (glyph image, alpha mask)
+    """
+    if glyph_dir is None:
+        glyph_dir = Path(__file__).parent / 'fonts' / 'World2'
+    glyph_dir = Path(glyph_dir)
+    print('Loading glyphs from ', glyph_dir)
+    glyph_paths = {str(ii): str(glyph_dir / f'{ii}.png') for ii in range(10)}
+    return GlyphLoader(glyph_paths).glyphs
+
+
+def disk_kernel(radius):
+    """
+    Disk shaped structuring element, same footprint as skimage.morphology.disk.
+    """
+    yy, xx = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+    return (xx ** 2 + yy ** 2 <= radius ** 2).astype(np.uint8)
+
+
+def prepare_glyphs(glyphs, scale=1.0, dilation=0):
+    """
+    Scale the glyphs and dilate their alpha masks, so the match also covers a margin of background around each glyph.
+
+    :param glyphs: Dictionary of glyph class -> (glyph image, alpha mask)
+    :return: New dictionary of glyph class -> (scaled glyph, scaled and dilated alpha mask)
+    """
+    prepared = dict()
+    for glyph_class, (glyph, alpha) in glyphs.items():
+        if scale != 1.0:
+            glyph = cv2.resize(glyph, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR_EXACT)
+            alpha = cv2.resize(alpha, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR_EXACT)
+
+        if dilation > 0:
+            alpha = 255 * cv2.dilate((alpha > 0).astype(np.uint8), disk_kernel(dilation),
+                                     borderType=cv2.BORDER_CONSTANT, borderValue=0)
+
+        prepared[glyph_class] = (glyph, alpha)
+    return prepared
+
+
+def load_glyph_bank(glyph_dir=None, scale=1.0, dilation=4, cache_dir=GLYPH_CACHE_DIR):
+    """
+    Load the prepared (scaled and dilated, see `prepare_glyphs`) glyphs of a score font.
+
+    Banks are shared in memory for the lifetime of the process, and compiled once into an .npz in `cache_dir` keyed by
+    font directory, scale and dilation. The cache is rebuilt when any of the glyph PNGs changes.
+
+    :param glyph_dir: Location of the glyph files. Will default to `score/fonts/World2`
+    :param cache_dir: Directory of the .npz cache, or None to only cache in memory
+    :return: Dictionary of glyph class -> (glyph image, alpha mask). Shared, do not modify.
+    """
+    if glyph_dir is None:
+        glyph_dir = Path(__file__).parent / 'fonts' / 'World2'
+    glyph_dir = Path(glyph_dir).resolve()
+
+    key = (str(glyph_dir), float(scale), int(dilation))
+    if not hasattr(load_glyph_bank, 'banks'):
+        load_glyph_bank.banks = dict()
+    if key in load_glyph_bank.banks:
+        return load_glyph_bank.banks[key]
+
+    # Size and modification time of every glyph file, so edited fonts invalidate the cache
+    source = hashlib.sha1()
+    for ii in range(10):
+        stat = (glyph_dir / f'{ii}.png').stat()
+        source.update(f'{ii}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+    source = source.hexdigest()
+
+    glyphs = None
+    cache_file = None
+    if cache_dir is not None:
+        path_hash = hashlib.sha1(str(glyph_dir).encode()).hexdigest()[:8]
+        cache_file = Path(cache_dir) / f'{glyph_dir.name}_{path_hash}_s{scale:g}_d{dilation}.npz'
+        try:
+            with np.load(cache_file) as data:
+                if str(data['source']) == source:
+                    glyphs = {str(c): (data[f'glyph_{c}'], data[f'alpha_{c}']) for c in data['classes']}
+        except (OSError, KeyError, ValueError):
+            glyphs = None
+
+    if glyphs is None:
+        glyphs = prepare_glyphs(load_font_glyphs(glyph_dir), scale=scale, dilation=dilation)
+        if cache_file is not None:
+            try:
+                cache_file.parent.mkdir(parents=True, exist_ok=True)
+                arrays = {'source': np.array(source), 'classes': np.array(list(glyphs.keys()))}
+                for glyph_class, (glyph, alpha) in glyphs.items():
+                    arrays[f'glyph_{glyph_class}'] = glyph
+                    arrays[f'alpha_{glyph_class}'] = alpha
+                # Write then rename, so a crash mid-write never leaves a truncated cache behind
+                tmp_file = cache_file.with_suffix('.tmp.npz')
+                np.savez(tmp_file, **arrays)
+                os.replace(tmp_file, cache_file)
+            except OSError as e:
+                print(f'Unable to write glyph cache {cache_file}: {e}')
+
+    load_glyph_bank.banks[key] = glyphs
+    return glyphs
+
+
 class GlyphDetector:
-    def __init__(self, glyphs, threshold=0.8, scale=1.0, dilation=2):
+    def __init__(self, glyphs, threshold=0.8, scale=1.0, dilation=2, batched=False, prepared=False):
         """
         Initialize the GlyphDetector with glyphs, scale settings, and detection threshold.
 
@@ -69,24 +215,29 @@ class GlyphDetector:
         :param scale_range: Range of scales to apply during detection.
         :param scale_steps: Number of steps in the scale range.
         :param threshold: Matching threshold.
+        :param batched: Match every glyph in a single FFT pass and keep only the best glyph per location, instead of
+                        running a masked cv2.matchTemplate per glyph. See `detect_glyphs_batched`.
+        :param prepared: The glyphs were already scaled and dilated with the given settings (see `load_glyph_bank`)
         """
-        self.glyphs = glyphs
         self.threshold = threshold
         self.optimal_scale = scale
         self.dilation = dilation
-
-        for glyph_class, (glyph, alpha) in self.glyphs.items():
-            scaled_glyph = glyph
-            scaled_alpha = alpha
-            if scale != 1.0:
-                scaled_glyph = cv2.resize(glyph, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR_EXACT)
-                scaled_alpha = cv2.resize(alpha, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR_EXACT)
-
-            if dilation > 0:
-                scaled_alpha =(255 * binary_dilation(scaled_alpha, footprint=disk(dilation))).astype(np.uint8)
-
-            self.glyphs[glyph_class] = (scaled_glyph, scaled_alpha)
-
+        self.batched = batched
+        self.glyphs = glyphs if prepared else prepare_glyphs(glyphs, scale=scale, dilation=dilation)
+
+        # Glyph bank for the batched path: masked templates and masks, plus their constant sums
+        self.glyph_classes = list(self.glyphs.keys())
+        self.glyph_sizes = np.array([glyph.shape for glyph, _ in self.glyphs.values()], dtype=np.intp)
+        self._masked_glyphs = []
+        self._masks = []
+        for glyph, alpha in self.glyphs.values():
+            mask = (alpha > 0).astype(np.float64)
+            self._masked_glyphs.append(glyph * mask)
+            self._masks.append(mask)
+        self._glyph_energy = np.array([np.sum(t ** 2) for t in self._masked_glyphs])
+        self._glyph_sum = np.array([np.sum(t) for t in self._masked_glyphs])
+        self._mask_sum = np.array([np.sum(m) for m in self._masks])
+        self._banks = dict()
 
     # def set_optimal_scale(self, optimal_scale):
     #     """
@@ -133,6 +284,8 @@ class GlyphDetector:
         :param image: The target image where glyphs are to be found.
         :return: List of detected glyphs with their location, scale, and class.
         """
+        if self.batched:
+            return self.detect_glyphs_batched(image)
 
         image = preprocess_image(image)
 
@@ -165,6 +318,116 @@ class GlyphDetector:
 
         return final_glyphs
 
+    def _glyph_bank(self, shape):
+        """
+        Row spectra of every masked glyph and mask, laid out for a single batched matmul. Cached per image shape.
+        """
+        if shape not in self._banks:
+            height, width = shape
+            n_glyphs = len(self.glyph_classes)
+            max_h = self.glyph_sizes[:, 0].max()
+            fft_width = cv2.getOptimalDFTSize(width)
+
+            kernels = np.zeros((2 * n_glyphs, max_h, fft_width), dtype=np.float32)
+            for ii, (masked_glyph, mask) in enumerate(zip(self._masked_glyphs, self._masks)):
+                h, w = masked_glyph.shape
+                kernels[ii, :h, :w] = masked_glyph
+                kernels[n_glyphs + ii, :h, :w] = mask
+            # (frequency, kernel row, kernel)
+            bank = np.ascontiguousarray(np.conj(np.fft.rfft(kernels, axis=-1)).transpose(2, 1, 0))
+
+            # Positions where a glyph doesn't fit inside the image are never valid matches
+            out_h = height - self.glyph_sizes[:, 0].min() + 1
+            out_w = width - self.glyph_sizes[:, 1].min() + 1
+            rows = np.arange(out_h)[None, :, None]
+            cols = np.arange(out_w)[None, None, :]
+            invalid = (rows > height - self.glyph_sizes[:, 0, None, None]) | \
+                      (cols > width - self.glyph_sizes[:, 1, None, None])
+
+            self._banks[shape] = (bank, fft_width, invalid)
+        return self._banks[shape]
+
+    def match_scores(self, image):
+        """
+        Masked TM_SQDIFF_NORMED of every glyph against a preprocessed image, computed in one pass over a glyph bank.
+
+        With a binary mask M, template T and image window I, OpenCV's masked normalized square difference is
+            R = (sum((T M)^2) - 2 sum(T M I) + sum(M I^2)) / sqrt(sum((T M)^2) sum(M I^2))
+        The preprocessed image only takes the values 1 and 255, so with B = (I == 255) the two sliding sums are
+            sum(T M I) = sum(T M) + 254 corr(B, T M)    and    sum(M I^2) = sum(M) + 65024 corr(B, M)
+        i.e. a cross-correlation of a single binary image with every masked glyph and mask. The rows of B are
+        transformed once, and for each frequency the sum over kernel rows is a small matmul against the glyph bank,
+        which covers all glyphs and output rows at once. The FFT along x is circular, but wrap-around only touches
+        positions where a glyph doesn't fit, and those are masked out.
+
+        :param image: Preprocessed (binarized) HxW image
+        :return: (n_glyphs, H - min_h + 1, W - min_w + 1) array of 1 - R (higher is better, like detect_glyphs),
+                 with -inf where a glyph doesn't fit
+        """
+        bank, fft_width, invalid = self._glyph_bank(image.shape)
+        n_glyphs = len(self.glyph_classes)
+        max_h = bank.shape[1]
+        out_h, out_w = invalid.shape[1:]
+
+        # Pad the bottom so every output row has a full window of kernel rows (short glyphs have zero rows there)
+        binary = np.zeros((out_h + max_h - 1, image.shape[1]), dtype=np.float32)
+        binary[:image.shape[0]] = image == 255
+        rows = np.fft.rfft(binary, n=fft_width, axis=-1).T
+        windows = np.lib.stride_tricks.sliding_window_view(rows, max_h, axis=1)
+        spectra = np.matmul(windows, bank)
+        # The correlations are sums of integers, so rounding removes the FFT round-off entirely
+        corr = np.rint(np.fft.irfft(spectra.transpose(2, 1, 0), n=fft_width, axis=-1)[..., :out_w]).astype(np.float64)
+
+        # Numerator and denominator of R, built in place to avoid temporaries
+        glyph_energy = self._glyph_energy[:, None, None]
+        numerator = corr[:n_glyphs]
+        numerator *= -2 * 254
+        numerator += glyph_energy - 2 * self._glyph_sum[:, None, None]
+        image_energy = corr[n_glyphs:]
+        image_energy *= 65024
+        image_energy += self._mask_sum[:, None, None]
+        numerator += image_energy
+
+        image_energy *= glyph_energy
+        np.sqrt(image_energy, out=image_energy)
+        scores = np.divide(numerator, image_energy, out=numerator)
+        np.subtract(1, scores, out=scores)
+        np.copyto(scores, -np.inf, where=invalid)
+        return scores
+
+    def detect_glyphs_batched(self, image):
+        """
+        Batched version of `detect_glyphs`. Only the best glyph at each location is considered, and thresholding and
+        NMS are done on arrays, so dicts are only built for the final detections.
+
+        :param image: The target image where glyphs are to be found.
+        :return: List of detected glyphs with their location, scale, and class.
+        """
+        scores = self.match_scores(preprocess_image(image))
+
+        best = scores.argmax(axis=0)
+        best_score = np.take_along_axis(scores, best[None, ...], axis=0)[0]
+        ys, xs = np.nonzero(best_score >= self.threshold)
+        if ys.size == 0:
+            return []
+
+        classes = best[ys, xs]
+        match_values = best_score[ys, xs]
+        heights = self.glyph_sizes[classes, 0]
+        widths = self.glyph_sizes[classes, 1]
+        boxes = np.stack([xs, ys, xs + widths, ys + heights], axis=1)
+
+        detections = []
+        for i in nms_indices(boxes, match_values):
+            detections.append({
+                'glyph_class': self.glyph_classes[classes[i]],
+                'location': (int(xs[i]), int(ys[i])),
+                'scale': self.optimal_scale,
+                'match_value': float(match_values[i]),
+                'bounding_box': tuple(int(v) for v in boxes[i])
+            })
+        return detections
+
     def _match_glyph(self, image, glyph, mask=None):
         """
         Perform masked template matching.
@@ -198,29 +461,4 @@ class GlyphDetector:
         boxes = np.array([d['bounding_box'] for d in detections])
         scores = np.array([d['match_value'] for d in detections])
 
-        x1 = boxes[:, 0]
-        y1 = boxes[:, 1]
-        x2 = boxes[:, 2]
-        y2 = boxes[:, 3]
-
-        areas = (x2 - x1 + 1) * (y2 - y1 + 1)
-        order = scores.argsort()[::-1]
-
-        keep = []
-        while order.size > 0:
-            i = order[0]
-            keep.append(detections[i])
-
-            xx1 = np.maximum(x1[i], x1[order[1:]])
-            yy1 = np.maximum(y1[i], y1[order[1:]])
-            xx2 = np.minimum(x2[i], x2[order[1:]])
-            yy2 = np.minimum(y2[i], y2[order[1:]])
-
-            w = np.maximum(0, xx2 - xx1 + 1)
-            h = np.maximum(0, yy2 - yy1 + 1)
-
-            overlap = (w * h) / areas[order[1:]]
-
-            order = order[np.where(overlap <= overlap_thresh)[0] + 1]
-
-        return keep
+        return [detections[i] for i in nms_indices(boxes, scores, overlap_thresh=overlap_thresh)]
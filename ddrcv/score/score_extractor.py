@@ -5,9 +5,10 @@ from pprint import pprint
 from typing import Tuple
 
 import cv2
-from matplotlib import pyplot as plt
 
-from ddrcv.score.glyph_detector import GlyphLoader, GlyphDetector
+from ddrcv.misc.worker_pool import get_worker_pool
+from ddrcv.score.fixed_pitch_extractor import FixedPitchScoreExtractor
+from ddrcv.score.glyph_detector import GlyphDetector, load_glyph_bank
 
 
 def detections_to_num(detections):
@@ -21,33 +22,27 @@ def detections_to_num(detections):
 
 class SingleScoreExtractor:
     """
-    Given a set of numeral glyphs, a region of interest, and a full RGB image frame
+    Given a set of numeral glyphs, a region of interest, and a full BGR image frame
     this class will extract the numerical string found inside the ROI
     """
-    def __init__(self, roi_bb, glyph_dir=None):
+    def __init__(self, roi_bb, glyph_dir=None, batched=False):
         """
         :param roi_bb: 4-tuple of (top, left, height, width)
         :param glyph_dir: Location of glyph files 0.png ... 9.png. Will default to `score/fonts/World`
+        :param batched: Use the single pass FFT glyph matcher (see GlyphDetector.detect_glyphs_batched)
         """
-        # Load glyph paths (You need to provide actual file paths to your glyph images)
-        if glyph_dir is None:
-            glyph_dir = Path(__file__).parent / 'fonts' / 'World2'
-        print('Loading glyphs from ', glyph_dir)
-        glyph_paths = {str(ii): str(glyph_dir / f'{ii}.png') for ii in range(10)}
-
-        # Load the glyphs
-        glyph_loader = GlyphLoader(glyph_paths)
-        glyphs = glyph_loader.glyphs
+        # Shared with the other player's extractor, and cached on disk between runs
+        glyphs = load_glyph_bank(glyph_dir, scale=1.0, dilation=4)
 
         # Initialize the detector
-        self.detector = GlyphDetector(glyphs, threshold=0.8, scale=1.0, dilation=4)
+        self.detector = GlyphDetector(glyphs, threshold=0.8, scale=1.0, dilation=4, batched=batched, prepared=True)
         self.roi_bb = roi_bb
 
         # self.detector.set_optimal_scale(0.942)
         # self.detector.set_optimal_scale(1)
 
-    def extract(self, frame_rgb, debug=False):
-        target = frame_rgb[self.roi_bb[0]:self.roi_bb[0] + self.roi_bb[2], self.roi_bb[1]:self.roi_bb[1] + self.roi_bb[3], ...]
+    def extract(self, frame_bgr, debug=False):
+        target = frame_bgr[self.roi_bb[0]:self.roi_bb[0] + self.roi_bb[2], self.roi_bb[1]:self.roi_bb[1] + self.roi_bb[3], ...]
 
         # Detect glyphs
         # tic = time.time()
@@ -61,34 +56,79 @@ class SingleScoreExtractor:
 
 class ScoreExtractor:
     """
-    Given a set of numeral glyphs, a region of interest, and a full RGB image frame
+    Given a set of numeral glyphs, a region of interest, and a full BGR image frame
     this class will extract the numerical string found inside the ROI
     """
     p1_roi = [645 - 1, 160, 45, 240]
     p2_roi = [645 - 1, 880, 45, 240]
 
-    def __init__(self, glyph_dir=None):
+    def __init__(self, glyph_dir=None, batched=False, mode='search', max_increment=None, concurrent=False):
         """
         :param present: 2ple consisting of (p1_present, p2_present) bool values
         :param glyph_dir: Location of glyph files 0.png ... 9.png. Will default to `score/fonts/World`
+        :param batched: Use the single pass FFT glyph matcher (see GlyphDetector.detect_glyphs_batched)
+        :param mode: 'search' to template search the whole ROI, or 'fixed_pitch' to classify fixed digit cells
+                     (see FixedPitchScoreExtractor)
+        :param max_increment: If set, scores may only increase by at most this much between consecutive frames.
+                              Readings that go down or jump further (e.g. when an effect covers the digits) are replaced
+                              by the previous score until `reset` is called.
+        :param concurrent: Extract the P2 score on the shared worker pool while P1 is extracted on the calling thread
         """
         self.p1_present = True
         self.p2_present = True
-        self.p1_extractor = SingleScoreExtractor(ScoreExtractor.p1_roi, glyph_dir=glyph_dir)
-        self.p2_extractor = SingleScoreExtractor(ScoreExtractor.p2_roi, glyph_dir=glyph_dir)
+        self.max_increment = max_increment
+        self.concurrent = concurrent
+        self.last_scores = [None, None]
+        if mode == 'search':
+            self.p1_extractor = SingleScoreExtractor(ScoreExtractor.p1_roi, glyph_dir=glyph_dir, batched=batched)
+            self.p2_extractor = SingleScoreExtractor(ScoreExtractor.p2_roi, glyph_dir=glyph_dir, batched=batched)
+        elif mode == 'fixed_pitch':
+            self.p1_extractor = FixedPitchScoreExtractor(ScoreExtractor.p1_roi, glyph_dir=glyph_dir)
+            self.p2_extractor = FixedPitchScoreExtractor(ScoreExtractor.p2_roi, glyph_dir=glyph_dir)
+        else:
+            raise ValueError(f'[ScoreExtractor] Unknown mode {mode}. Valid options are one of ["search", "fixed_pitch"].')
 
     def set_presence(self, p1_present, p2_present):
         self.p1_present = p1_present
         self.p2_present = p2_present
 
-    def extract(self, frame_rgb, debug=False):
+    def reset(self):
+        """
+        Forget the previous scores, e.g. when a new song starts. The next reading is accepted as is.
+        """
+        self.last_scores = [None, None]
+
+    def _clamp(self, player, score):
+        """
+        Enforce monotonic, bounded increments on a player's score.
+        """
+        if self.max_increment is None or score is None:
+            return score
+
+        last = self.last_scores[player]
+        if last is not None and (score < last or score > last + self.max_increment):
+            print(f'Overriding P{player + 1} score')
+            score = last
+        self.last_scores[player] = score
+        return score
+
+    def extract(self, frame_bgr, debug=False):
         p1_score, p1_debug = None, None
         p2_score, p2_debug = None, None
 
-        if self.p1_present:
-            p1_score, p1_debug = self.p1_extractor.extract(frame_rgb, debug=debug)
-        if self.p2_present:
-            p2_score, p2_debug = self.p2_extractor.extract(frame_rgb, debug=debug)
+        if self.concurrent and self.p1_present and self.p2_present:
+            # The matching runs in OpenCV/NumPy calls that release the GIL, so the two sides overlap
+            p2_future = get_worker_pool().submit(self.p2_extractor.extract, frame_bgr, debug=debug)
+            p1_score, p1_debug = self.p1_extractor.extract(frame_bgr, debug=debug)
+            p2_score, p2_debug = p2_future.result()
+        else:
+            if self.p1_present:
+                p1_score, p1_debug = self.p1_extractor.extract(frame_bgr, debug=debug)
+            if self.p2_present:
+                p2_score, p2_debug = self.p2_extractor.extract(frame_bgr, debug=debug)
+
+        p1_score = self._clamp(0, p1_score)
+        p2_score = self._clamp(1, p2_score)
 
         output = {
             "data": {
@@ -108,6 +148,8 @@ class ScoreExtractor:
 
 
 if __name__ == "__main__":
+    from matplotlib import pyplot as plt
+
     video_file = Path(r"C:\code\ddr_ex_parser\videos\yukopi.mp4")
     output_file = 'yukopi_detected.mp4'
 
@@ -134,8 +176,6 @@ if __name__ == "__main__":
     # for frame_idx in range(frame_start, frame_end + 1):
     for image in frames:
         # image = extractor.get_frame_by_index(frame_idx)
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-
         # Detect glyphs
         # tic = time.time()
         # p1_result = p1_score.extract(image, debug=True)
@@ -150,7 +190,6 @@ if __name__ == "__main__":
         print(p2_detected_num)
 
 
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
         cv2.rectangle(image, (p2_roi[1], p2_roi[0]), (p2_roi[1] + p2_roi[3], p2_roi[0] + p2_roi[2]), (0, 255, 0), 2)
         cv2.rectangle(image, (p1_roi[1], p1_roi[0]), (p1_roi[1] + p1_roi[3], p1_roi[0] + p1_roi[2]), (0, 255, 0), 2)
 
@@ -0,0 +1,157 @@
+"""
+NumPy re-implementation of `imagehash.dhash` that never touches PIL.
+
+The difference hash is computed exactly the way imagehash + Pillow would compute it:
+  1. RGB -> L using Pillow's fixed-point ITU-R 601-2 luma transform
+  2. Lanczos resample to (hash_size + 1, hash_size) using Pillow's fixed-point two-pass resampler
+  3. Compare horizontally adjacent pixels
+
+Every step is integer arithmetic that mirrors Pillow's C implementation, so the hashes (and therefore the Hamming
+distances compared against the thresholds in the .pkl templates) are bit-identical to the PIL path.
+"""
+import math
+from functools import lru_cache
+
+import numpy as np
+
+# Pillow resamples 8 bit images with 22 bits of fixed point precision (see libImaging/Resample.c)
+_PRECISION_BITS = 32 - 8 - 2
+_LANCZOS_SUPPORT = 3.0
+
+# Pillow's RGB -> L weights, scaled by 2^16 (see libImaging/Convert.c)
+_L24_WEIGHTS = (19595, 38470, 7471)
+
+
+def to_luma(image, channel_order='rgb'):
+    """
+    Convert a color or grayscale image into Pillow's 'L' representation.
+
+    :param image: HxW or HxWxC uint8 array. Only the first three channels are used.
+    :param channel_order: 'rgb' or 'bgr'. The channel swap is folded into the weights, so BGR frames never need to be
+                          flipped/copied before hashing.
+    :return: HxW uint8 array
+    """
+    if image.ndim == 2:
+        return image
+    pixels = image.astype(np.uint32)
+    wr, wg, wb = _L24_WEIGHTS
+    if channel_order == 'bgr':
+        wr, wb = wb, wr
+    return ((pixels[..., 0] * wr + pixels[..., 1] * wg + pixels[..., 2] * wb + 0x8000) >> 16).astype(np.uint8)
+
+
+def _sinc(x):
+    if x == 0.0:
+        return 1.0
+    x = x * math.pi
+    return math.sin(x) / x
+
+
+def _lanczos(x):
+    if -_LANCZOS_SUPPORT <= x < _LANCZOS_SUPPORT:
+        return _sinc(x) * _sinc(x / _LANCZOS_SUPPORT)
+    return 0.0
+
+
+@lru_cache(maxsize=None)
+def lanczos_coefficients(in_size, out_size):
+    """
+    Fixed point resampling matrix for a single axis, matching Pillow's `precompute_coeffs` + `normalize_coeffs_8bpc`.
+
+    :return: (in_size, out_size) float64 matrix of integer coefficients, or None if the axis doesn't need resampling
+    """
+    if in_size == out_size:
+        return None
+
+    scale = in_size / out_size
+    filterscale = max(scale, 1.0)
+    support = _LANCZOS_SUPPORT * filterscale
+
+    coeffs = np.zeros((in_size, out_size), dtype=np.float64)
+    for xx in range(out_size):
+        center = (xx + 0.5) * scale
+        xmin = max(int(center - support + 0.5), 0)
+        xmax = min(int(center + support + 0.5), in_size)
+
+        weights = [_lanczos((x + xmin - center + 0.5) / filterscale) for x in range(xmax - xmin)]
+        total = sum(weights)
+        for x, w in enumerate(weights):
+            if total != 0.0:
+                w /= total
+            if w < 0:
+                coeffs[xmin + x, xx] = int(-0.5 + w * (1 << _PRECISION_BITS))
+            else:
+                coeffs[xmin + x, xx] = int(0.5 + w * (1 << _PRECISION_BITS))
+    coeffs.flags.writeable = False
+    return coeffs
+
+
+# The resampling sums stay well under 2^53, so they are carried out as float64 matrix products (which go through BLAS)
+# and are still exact integers.
+def _clip8(acc):
+    return np.clip((acc + (1 << (_PRECISION_BITS - 1))) // (1 << _PRECISION_BITS), 0, 255)
+
+
+def resample_lanczos(gray, width, height):
+    """
+    Pillow-exact Lanczos resize of one or more grayscale images (horizontal pass first, then vertical).
+
+    :param gray: (..., H, W) uint8 array
+    :return: (..., height, width) float64 array of integers in [0, 255]
+    """
+    pixels = gray.astype(np.float64)
+    coeffs_x = lanczos_coefficients(gray.shape[-1], width)
+    if coeffs_x is not None:
+        pixels = _clip8(pixels @ coeffs_x)
+    coeffs_y = lanczos_coefficients(gray.shape[-2], height)
+    if coeffs_y is not None:
+        pixels = _clip8(coeffs_y.T @ pixels)
+    return pixels
+
+
+def dhash_bits(gray, hash_size=8):
+    """
+    :param gray: (..., H, W) uint8 grayscale image(s)
+    :return: (..., hash_size, hash_size) bool array, identical to `imagehash.dhash(...).hash`
+    """
+    pixels = resample_lanczos(gray, hash_size + 1, hash_size)
+    return pixels[..., :, 1:] > pixels[..., :, :-1]
+
+
+def pack_hash(bits):
+    """
+    Pack (..., hash_size, hash_size) hash bits into (..., hash_size**2 // 64) uint64 words.
+    """
+    flat = bits.reshape(bits.shape[:-2] + (-1,))
+    if flat.shape[-1] % 64 != 0:
+        raise ValueError(f'[pack_hash] Hash length {flat.shape[-1]} is not a multiple of 64 bits')
+    packed = np.packbits(flat, axis=-1)
+    return np.ascontiguousarray(packed).view(np.uint64)
+
+
+def dhash(image, hash_size=8, channel_order='rgb'):
+    """
+    Packed difference hash of a single color/grayscale image.
+
+    :return: (hash_size**2 // 64,) uint64 array
+    """
+    return pack_hash(dhash_bits(to_luma(image, channel_order=channel_order), hash_size=hash_size))
+
+
+def popcount(words):
+    """Vectorized population count of a uint64 array."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    bytes_view = np.ascontiguousarray(words).view(np.uint8).reshape(words.shape + (8,))
+    return np.unpackbits(bytes_view, axis=-1).sum(axis=-1)
+
+
+def hamming_distance(a, b):
+    """
+    Hamming distance between packed hashes. Broadcasts over all leading dimensions.
+
+    :param a: (..., words) uint64
+    :param b: (..., words) uint64
+    :return: (...) int array
+    """
+    return popcount(np.bitwise_xor(a, b)).sum(axis=-1).astype(np.int64)
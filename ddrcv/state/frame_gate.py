@@ -0,0 +1,75 @@
+import cv2
+import numpy as np
+
+
+class FrameGate:
+    """
+    Cheap change detector used to skip state matching and score extraction on static frames.
+
+    Results, song select and total result screens sit still for seconds at a time. The gate compares a heavily
+    subsampled copy of each frame (optionally restricted to a set of ROIs) against the last frame that was let through,
+    and only reports a change once the mean absolute difference exceeds a threshold. Comparing against the last
+    *processed* frame means slow drifts still accumulate and eventually open the gate.
+    """
+    def __init__(self, step=8, threshold=2.0, rois=None, max_skips=30):
+        """
+        :param step: Subsampling stride in pixels (8 -> 1/8 scale in each dimension)
+        :param threshold: Mean absolute difference (in 8 bit intensity units) above which the frame is considered changed
+        :param rois: Optional list of (x, y, w, h) regions to restrict the comparison to. Defaults to the whole frame.
+        :param max_skips: Force a frame through after this many consecutive skips, as a safety net
+        """
+        self.step = step
+        self.threshold = threshold
+        self.rois = rois
+        self.max_skips = max_skips
+
+        self._reference = None
+        self._consecutive_skips = 0
+        self.last_difference = 0.0
+        self.frames = 0
+        self.skipped = 0
+
+    def _signature(self, frame):
+        if self.rois is None:
+            return [np.ascontiguousarray(frame[::self.step, ::self.step, ...])]
+        return [np.ascontiguousarray(frame[y:y + h:self.step, x:x + w:self.step, ...]) for x, y, w, h in self.rois]
+
+    def reset(self):
+        self._reference = None
+        self._consecutive_skips = 0
+
+    def changed(self, frame):
+        """
+        :param frame: Full frame (any channel order, as long as it's consistent between calls)
+        :return: True if the frame needs to be processed, False if the previous results can be reused
+        """
+        self.frames += 1
+        signature = self._signature(frame)
+
+        if self._reference is None or any(a.shape != b.shape for a, b in zip(signature, self._reference)):
+            self._reference = signature
+            self._consecutive_skips = 0
+            return True
+
+        total = sum(cv2.norm(a, b, cv2.NORM_L1) for a, b in zip(signature, self._reference))
+        self.last_difference = total / sum(a.size for a in signature)
+
+        if self.last_difference > self.threshold or self._consecutive_skips >= self.max_skips:
+            self._reference = signature
+            self._consecutive_skips = 0
+            return True
+
+        self._consecutive_skips += 1
+        self.skipped += 1
+        return False
+
+    @property
+    def skip_ratio(self):
+        return self.skipped / self.frames if self.frames > 0 else 0.0
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'skipped': self.skipped,
+            'skip_ratio': self.skip_ratio
+        }
@@ -1,25 +1,21 @@
-import imagehash
-from PIL import Image
-
-import matplotlib.pyplot as plt
+from ddrcv.state.dhash import dhash, hamming_distance
 
 
 class HashMatcher:
     def __init__(self, template_image, threshold_distance=5):
-        self.template = Image.fromarray(template_image).convert('L')
-        self.template_hash = imagehash.dhash(self.template)
+        """
+        :param template_image: BGR (or grayscale) template. Targets are expected in the same channel order.
+        :param threshold_distance:
+        """
+        # dhash is computed in NumPy, but is bit-identical to imagehash.dhash(Image.fromarray(...).convert('L'))
+        self.template_hash = dhash(template_image, channel_order='bgr')
         self.threshold = threshold_distance
 
-    def match(self, target_image):
-        target_hash = imagehash.dhash(Image.fromarray(target_image).convert('L'))
-
-        # fig, ax = plt.subplots(1, 2)
-        # ax[0].imshow(Image.fromarray(target_image).convert('L'))
-        # ax[1].imshow(self.template)
-        # plt.show()
+    def distance(self, target_image):
+        return int(hamming_distance(self.template_hash, dhash(target_image, channel_order='bgr')))
 
-        # print('diff: ', self.template_hash - target_hash)
-        return (self.template_hash - target_hash) < self.threshold
+    def match(self, target_image):
+        return self.distance(target_image) < self.threshold
 
     def match_roi(self, target_image, roi):
         """
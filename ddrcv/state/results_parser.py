@@ -2,7 +2,7 @@ import os
 from collections import OrderedDict
 import numpy as np
 
-from ddrcv.ocr import get_best_match_from_results, get_ocr_singleton
+from ddrcv.ocr import DIGITS, get_best_match_from_results, get_ocr_singleton, ocr_options, readtext_group
 
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
 
@@ -43,7 +43,10 @@ CONFIG_SCORE_BOX = {
 }
 
 
-def parse_scores(parser, image, config, box_offset, upsample=1, do_blur=False, do_invert=True, padding=0):
+def score_chips(image, config, box_offset, upsample=1, do_blur=False, do_invert=True, padding=0):
+    """
+    :return: (keys, chips) of the score column and its offshoots, all chips the same size
+    """
     # Assemble all bounding boxes between the vertical column of scores and the offshoots
     boxes = OrderedDict()
     for key, y_offset in config['column_y_offsets'].items():
@@ -60,20 +63,18 @@ def parse_scores(parser, image, config, box_offset, upsample=1, do_blur=False, d
             bb_new = [bb[0] - padding, bb[1] - padding, bb[2] + 2 * padding, bb[3] + 2 * padding]
             boxes[key] = bb_new
 
-    # Extract uniformly sized chips for every element, and perform pre-processing tasks,
-    # and stack them into a (B, height, width, channel) tensor
+    # Extract uniformly sized chips for every element, and perform pre-processing tasks
     chips = []
     for bb in boxes.values():
         chip = extract_chip(image, bb, upsample=upsample, do_blur=do_blur, do_invert=do_invert)
         chips.append(chip)
-    chips = np.stack(chips, axis=0)
+    return list(boxes.keys()), chips
 
-    # Perform batched processing -- additionally, decreasing the canvas size speeds things up
-    result = parser.readtext_batched(chips, canvas_size=128)
 
+def collate_scores(keys, results):
     # Reformat the output into a dict of element_tag: integer_numeral
     collated = OrderedDict()
-    for res, key in zip(result, boxes.keys()):
+    for res, key in zip(results, keys):
         # In the event the OCR fails to find a value, set it to -1 so that at least I know it failed
         value = -1
         if len(res) > 0:
@@ -83,6 +84,16 @@ def parse_scores(parser, image, config, box_offset, upsample=1, do_blur=False, d
     return collated
 
 
+def parse_scores(parser, image, config, box_offset, upsample=1, do_blur=False, do_invert=True, padding=0):
+    keys, chips = score_chips(image, config, box_offset, upsample=upsample, do_blur=do_blur, do_invert=do_invert,
+                              padding=padding)
+
+    # Perform batched processing on a (B, height, width, channel) tensor -- additionally, decreasing the canvas size
+    # speeds things up
+    result = parser.readtext_batched(np.stack(chips, axis=0), canvas_size=128)
+    return collate_scores(keys, result)
+
+
 def extract_chip(image, bb, upsample=1, do_blur=False, do_invert=False):
     chip = image[bb[1]:bb[1]+bb[3], bb[0]:bb[0]+bb[2], :]
 
@@ -99,9 +110,10 @@ def extract_chip(image, bb, upsample=1, do_blur=False, do_invert=False):
 
 
 class PlayerParser:
-    def __init__(self, ocr_parser, config):
+    def __init__(self, ocr_parser, config, recognize_only=False):
         self.parser = ocr_parser
         self.config = config
+        self.recognize_only = recognize_only
         self._exists = False
 
     @property
@@ -109,12 +121,52 @@ class PlayerParser:
         return self._exists
 
     def parse(self, image):
-        name = self._parse_name(image)
+        name = self.parse_name(readtext_group(self.parser, [self.name_request(image)])[0])
         if name is None:
             return
-        self._exists = True
-        difficulty = self._parse_difficulty(image)
-        scores = self._parse_scores(image)
+        keys, requests = self.field_requests(image)
+        return self.parse_fields(name, keys, readtext_group(self.parser, requests))
+
+    def name_request(self, image):
+        """
+        :return: OCR request (chip, readtext options) for the name, see `readtext_group`
+        """
+        chip = extract_chip(image, self.config['bb_name'], do_invert=True)
+        return chip, ocr_options(self.recognize_only, canvas_size=256)
+
+    def field_requests(self, image):
+        """
+        Only needed for players whose name was read.
+
+        :return: (score keys, OCR requests) where the requests are for the difficulty followed by every score
+        """
+        requests = [
+            (extract_chip(image, self.config['bb_difficulty'], do_invert=True, upsample=1),
+             ocr_options(self.recognize_only, canvas_size=128))
+        ]
+        # Decreasing the canvas size speeds things up
+        keys, chips = self._score_chips(image)
+        options = ocr_options(self.recognize_only, canvas_size=128, allowlist=DIGITS)
+        requests.extend((chip, options) for chip in chips)
+        return keys, requests
+
+    def parse_name(self, result):
+        """
+        :param result: OCR result of `name_request`
+        :return: The player name, or None if the player is absent
+        """
+        name = self._parse_name(result)
+        if name is not None:
+            self._exists = True
+        return name
+
+    def parse_fields(self, name, keys, results):
+        """
+        :param keys: Score keys from `field_requests`
+        :param results: OCR results of `field_requests`, in order
+        """
+        difficulty = self._parse_difficulty(results[0])
+        scores = collate_scores(keys, results[1:])
 
         output = {
             'name': name,
@@ -123,17 +175,13 @@ class PlayerParser:
         }
         return output
 
-    def _parse_name(self, image):
-        chip = extract_chip(image, self.config['bb_name'], do_invert=True)
-        result = self.parser.readtext(chip, canvas_size=256)
+    def _parse_name(self, result):
         print('name result: ', result)
         if result:
             return result[0][1]
         return None
 
-    def _parse_difficulty(self, image):
-        chip = extract_chip(image, self.config['bb_difficulty'], do_invert=True, upsample=1)
-        result = self.parser.readtext(chip, canvas_size=128)
+    def _parse_difficulty(self, result):
         print('difficulty result: ', result)
         possible_values = ['beginner', 'basic', 'difficult', 'expert', 'challenge']
         if result:
@@ -141,29 +189,53 @@ class PlayerParser:
             return best_match[0].upper() + best_match[1:]
         return None
 
-    def _parse_scores(self, image):
-        return parse_scores(self.parser,
-                            image,
-                            CONFIG_SCORE_BOX,
-                            self.config['score_topleft'],
-                            upsample=3,
-                            do_blur=True,
-                            do_invert=True,
-                            padding=4)
+    def _score_chips(self, image):
+        return score_chips(image,
+                           CONFIG_SCORE_BOX,
+                           self.config['score_topleft'],
+                           upsample=3,
+                           do_blur=True,
+                           do_invert=True,
+                           padding=4)
 
 
 class ResultsParser:
-    def __init__(self, ocr_parser, database):
+    def __init__(self, ocr_parser, database, recognize_only=False):
+        """
+        :param recognize_only: Skip easyocr's text detector and recognize every chip as a single line of text (digits
+                               only for the scores). The fields sit at fixed positions, so detection only adds cost.
+                               Reads below the recognizer confidence gate (see `ocr_options`) count as missing, so an
+                               absent player has no name and an unread score is -1.
+        """
         self.parser = ocr_parser
         self.database = database
-        self.p1 = PlayerParser(self.parser, CONFIG_P1)
-        self.p2 = PlayerParser(self.parser, CONFIG_P2)
+        self.recognize_only = recognize_only
+        self.p1 = PlayerParser(self.parser, CONFIG_P1, recognize_only=recognize_only)
+        self.p2 = PlayerParser(self.parser, CONFIG_P2, recognize_only=recognize_only)
 
     def parse(self, image):
         song = self._lookup_song(image)
-        stage = self._parse_stage(image)
-        p1_results = self.p1.parse(image)
-        p2_results = self.p2.parse(image)
+
+        # The stage and both names go out in one OCR request. The difficulty and scores of the players whose name was
+        # read go out in a second one, so an absent player only costs its name chip.
+        stage_result, p1_name, p2_name = readtext_group(self.parser, [self._stage_request(image),
+                                                                      self.p1.name_request(image),
+                                                                      self.p2.name_request(image)])
+        stage = self._parse_stage(stage_result)
+        players = [(player, player.parse_name(result)) for player, result in ((self.p1, p1_name), (self.p2, p2_name))]
+        players = [(player, name) for player, name in players if name is not None]
+
+        fields = [player.field_requests(image) for player, _ in players]
+        requests = [request for _, player_requests in fields for request in player_requests]
+        results = readtext_group(self.parser, requests) if requests else []
+
+        player_results = dict()
+        start = 0
+        for (player, name), (keys, player_requests) in zip(players, fields):
+            player_results[player] = player.parse_fields(name, keys, results[start:start + len(player_requests)])
+            start += len(player_requests)
+        p1_results = player_results.get(self.p1)
+        p2_results = player_results.get(self.p2)
 
         output = dict()
         output['stage'] = stage
@@ -183,12 +255,16 @@ class ResultsParser:
             return song[0]
         return None
 
-    def _parse_stage(self, image):
+    def _stage_request(self, image):
         bb = [523, 67, 759-523, 100-67]
         chip = extract_chip(image, bb, do_invert=True, upsample=1)
-        result = self.parser.readtext(chip, canvas_size=128)
+        return chip, ocr_options(self.recognize_only, canvas_size=128)
+
+    def _parse_stage(self, result):
         print('stage result: ', result)
-        return result[0][1]
+        if result:
+            return result[0][1]
+        return None
 
 
 if __name__ == "__main__":
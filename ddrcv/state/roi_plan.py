@@ -0,0 +1,89 @@
+from ddrcv.state.dhash import to_luma
+from ddrcv.state.state_matcher import collect_matchers
+
+
+def _area(box):
+    return (box[2] - box[0]) * (box[3] - box[1])
+
+
+def _union(a, b):
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+
+
+class RoiPlan:
+    """
+    Per-frame cropping plan shared by all of the StateMatchers of a StateRotation.
+
+    Many templates overlap or sit in the same header band of the screen. Rather than have every matcher slice the frame
+    and convert its ROI to grayscale on its own, the ROIs are merged into a minimal set of bounding crops when the plan
+    is built. Each frame, a crop is converted to grayscale once (the first time one of its matchers asks for it) and
+    every matcher gets a view into the converted crop.
+    """
+    def __init__(self, rois, crop_overhead=2048):
+        """
+        :param rois: Iterable of (x, y, w, h) ROIs
+        :param crop_overhead: Fixed cost of converting a separate crop, expressed in pixels. Two crops are merged
+                              whenever converting their bounding box is cheaper than converting both individually.
+        """
+        boxes = {tuple(roi): (roi[0], roi[1], roi[0] + roi[2], roi[1] + roi[3]) for roi in rois}
+        crops = sorted(set(boxes.values()))
+
+        # Greedily merge the pair of crops with the largest saving until no merge pays for itself
+        while True:
+            best = None
+            for ii in range(len(crops)):
+                for jj in range(ii + 1, len(crops)):
+                    union = _union(crops[ii], crops[jj])
+                    saving = _area(crops[ii]) + _area(crops[jj]) + crop_overhead - _area(union)
+                    if saving > 0 and (best is None or saving > best[0]):
+                        best = (saving, ii, jj, union)
+            if best is None:
+                break
+            _, ii, jj, union = best
+            crops = [c for kk, c in enumerate(crops) if kk not in (ii, jj)] + [union]
+
+        self.crops = crops
+        self.assignment = dict()
+        for roi, box in boxes.items():
+            self.assignment[roi] = next(ii for ii, c in enumerate(crops)
+                                        if c[0] <= box[0] and c[1] <= box[1] and c[2] >= box[2] and c[3] >= box[3])
+
+        self._frame = None
+        self._gray = [None] * len(self.crops)
+
+    @classmethod
+    def from_states(cls, states, **kwargs):
+        """
+        Build a plan covering every matcher of the given states, and attach it to those matchers.
+        """
+        matchers = [m for state in states for m in collect_matchers(state)]
+        plan = cls([m.roi for m in matchers], **kwargs)
+        for matcher in matchers:
+            matcher.roi_plan = plan
+        return plan
+
+    def prepare(self, bgr_image):
+        """
+        Start a new frame. Must be called for every frame, since frame buffers may be reused between frames.
+        """
+        self._frame = bgr_image
+        self._gray = [None] * len(self.crops)
+
+    def crop(self, bgr_image, roi):
+        """
+        :param bgr_image: Full BGR frame
+        :param roi: (x, y, w, h). Must be one of the ROIs the plan was built with.
+        :return: Grayscale (Pillow 'L') view of the ROI
+        """
+        if bgr_image is not self._frame:
+            self.prepare(bgr_image)
+
+        idx = self.assignment[tuple(roi)]
+        x0, y0, x1, y1 = self.crops[idx]
+        gray = self._gray[idx]
+        if gray is None:
+            gray = to_luma(bgr_image[y0:y1, x0:x1, ...], channel_order='bgr')
+            self._gray[idx] = gray
+
+        x, y, w, h = roi
+        return gray[y - y0:y - y0 + h, x - x0:x - x0 + w]
@@ -2,6 +2,7 @@ from pathlib import Path
 
 import cv2
 
+from ddrcv.state.roi_plan import RoiPlan
 from ddrcv.state.state_matcher import StateMatcher
 
 
@@ -25,8 +26,8 @@ class SimpleState(StateBase):
         super().__init__(tag, pkl_dir)
         self.matcher = StateMatcher.load(pkl_dir / pkl_file)
 
-    def match(self, rgb_image):
-        is_match = self.matcher.match(rgb_image)
+    def match(self, bgr_image):
+        is_match = self.matcher.match(bgr_image)
         return is_match, None
 
 
@@ -48,9 +49,9 @@ class SongPlaying(StateBase):
                          StateMatcher.load(self.pkl_dir / 'gameplay_finishing_2.pkl'),
                          StateMatcher.load(self.pkl_dir / 'gameplay_finishing_3.pkl')]
 
-    def match(self, rgb_image):
+    def match(self, bgr_image):
         for idx, matcher in enumerate(self.matchers):
-            if matcher.match(rgb_image):
+            if matcher.match(bgr_image):
                 if idx > 0:
                     self.matchers = _circular_shift(self.matchers, idx)
                 return True, None
@@ -73,9 +74,9 @@ class SongSelect(StateBase):
         self.matchers = [StateMatcher.load(self.pkl_dir / 'song_select_1.pkl'),
                          StateMatcher.load(self.pkl_dir / 'song_select_2.pkl')]
 
-    def match(self, rgb_image):
+    def match(self, bgr_image):
         for idx, matcher in enumerate(self.matchers):
-            if matcher.match(rgb_image):
+            if matcher.match(bgr_image):
                 if idx > 0:
                     self.matchers = _circular_shift(self.matchers, idx)
                 return True, None
@@ -120,9 +121,12 @@ class StateRotation:
         for tag in states:
             self.states.append(state_factory(tag, pkl_dir=pkl_dir))
 
-    def match(self, rgb_image):
+        # Matchers that look at the same part of the screen share a single crop + grayscale conversion per frame
+        self.roi_plan = RoiPlan.from_states(self.states)
+
+    def match(self, bgr_image):
         """
-        :param rgb_image:
+        :param bgr_image:
         :return: (tag, data). Will return ('unknown', None) if the state can not be determined.
         """
         best_idx = 0
@@ -130,8 +134,9 @@ class StateRotation:
         data = None
         state_tag = 'unknown'
 
+        self.roi_plan.prepare(bgr_image)
         for ii, matcher in enumerate(self.states):
-            is_match, data = matcher.match(rgb_image)
+            is_match, data = matcher.match(bgr_image)
             if is_match:
                 best_idx = ii
                 state_tag = matcher.tag
@@ -147,11 +152,7 @@ class StateRotation:
 
 
 if __name__ == "__main__":
-    from PIL import Image
-    import numpy as np
-
-    image = Image.open('../../state_images/sdvx/gameplay_2.png')
-    image = np.array(image)
+    image = cv2.imread('../../state_images/sdvx/gameplay_2.png')
 
     # state = SongSplash(_resolve_pkl_dir(None))
     state = StateRotation()
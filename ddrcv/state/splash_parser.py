@@ -1,9 +1,8 @@
 import os
 from collections import OrderedDict
 import numpy as np
-from PIL.FontFile import WIDTH
 
-from ddrcv.ocr import get_best_match_from_results, get_ocr_singleton
+from ddrcv.ocr import get_best_match_from_results, get_ocr_singleton, ocr_options, readtext_group
 
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
 
@@ -40,31 +39,64 @@ def extract_chip(image, bb, upsample=1, do_blur=False, do_invert=False):
     return chip
 
 
+def jitter_crops(image, bb, jitter):
+    """
+    :return: The chip at bb, followed by the chip shifted by `jitter` pixels left, right, up and down (clipped to the
+             image)
+    """
+    crops = [extract_chip(image, bb)]
+    if jitter <= 0:
+        return crops
+    height, width = image.shape[:2]
+    for dx, dy in ((-jitter, 0), (jitter, 0), (0, -jitter), (0, jitter)):
+        x = min(max(bb[0] + dx, 0), width - bb[2])
+        y = min(max(bb[1] + dy, 0), height - bb[3])
+        crops.append(extract_chip(image, [x, y, bb[2], bb[3]]))
+    return crops
+
+
 class PlayerParser:
-    def __init__(self, ocr_parser, config, do_name, do_difficulty):
+    def __init__(self, ocr_parser, config, do_name, do_difficulty, recognize_only=False):
         self.parser = ocr_parser
         self.config = config
+        self.recognize_only = recognize_only
         self.do_name = do_name
         self.do_difficulty = do_difficulty
 
     def parse(self, image):
+        return self.parse_results(readtext_group(self.parser, self.requests(image)))
+
+    def requests(self, image):
+        """
+        :return: OCR requests (chip, readtext options) for the enabled fields, see `readtext_group`
+        """
+        requests = []
+        if self.do_name:
+            chip = extract_chip(image, self.config['bb_name'], do_invert=True, upsample=1)
+            requests.append((chip, ocr_options(self.recognize_only, canvas_size=256, adjust_contrast=1)))
+        if self.do_difficulty:
+            chip = extract_chip(image, self.config['bb_difficulty'], do_invert=True, upsample=1)
+            requests.append((chip, ocr_options(self.recognize_only, canvas_size=256)))
+        return requests
+
+    def parse_results(self, results):
+        """
+        :param results: OCR results of `requests`, in order
+        """
+        results = iter(results)
         output = dict()
         if self.do_name:
-            output['name'] = self._parse_name(image)
+            output['name'] = self._parse_name(next(results))
         if self.do_difficulty:
-            output['difficulty'] = self._parse_difficulty(image)
+            output['difficulty'] = self._parse_difficulty(next(results))
         return output
 
-    def _parse_name(self, image):
-        chip = extract_chip(image, self.config['bb_name'], do_invert=True, upsample=1)
-        result = self.parser.readtext(chip, canvas_size=256, adjust_contrast=1)
+    def _parse_name(self, result):
         if result:
             return result[0][1]
         return None
 
-    def _parse_difficulty(self, image):
-        chip = extract_chip(image, self.config['bb_difficulty'], do_invert=True, upsample=1)
-        result = self.parser.readtext(chip, canvas_size=256)
+    def _parse_difficulty(self, result):
         possible_values = ['beginner', 'basic', 'difficult', 'expert', 'challenge']
         if result:
             best_match = get_best_match_from_results(result, possible_values, lower=True)
@@ -73,23 +105,43 @@ class PlayerParser:
 
 
 class SplashParser:
-    def __init__(self, ocr_parser, database, do_name=False):
+    jacket_bb = [425, 105, 854 - 425, 534 - 105]
+
+    def __init__(self, ocr_parser, database, do_name=False, jitter=0, fusion='score', recognize_only=False):
+        """
+        :param recognize_only: Skip easyocr's text detector for the fixed position name and difficulty fields
+        :param jitter: If > 0, the jacket is also looked up from crops shifted by this many pixels, and the results are
+                       fused (see `DatabaseLookup.lookup_batch`)
+        :param fusion: How the results of several jacket crops are combined, 'score' or 'vote'
+        """
         self.parser = ocr_parser
         self.database = database
-        self.p1 = PlayerParser(self.parser, CONFIG_P1, do_name=do_name, do_difficulty=True)
-        self.p2 = PlayerParser(self.parser, CONFIG_P2, do_name=do_name, do_difficulty=True)
-        self.jacket_bb = [425, 105, 854 - 425, 534 - 105]
-
-    def parse(self, image, player_presence=(True, True)):
-        confidence, song = self._lookup_song(image)
-        p1_results = self.p1.parse(image) if player_presence[0] else None
-        p2_results = self.p2.parse(image) if player_presence[1] else None
-
-        if p1_results is not None:
+        self.jitter = jitter
+        self.fusion = fusion
+        self.p1 = PlayerParser(self.parser, CONFIG_P1, do_name=do_name, do_difficulty=True,
+                               recognize_only=recognize_only)
+        self.p2 = PlayerParser(self.parser, CONFIG_P2, do_name=do_name, do_difficulty=True,
+                               recognize_only=recognize_only)
+
+    def parse(self, image, player_presence=(True, True), jacket_frames=()):
+        """
+        :param jacket_frames: Other frames of the same splash screen. Their jackets are looked up together with the
+                              jacket of `image` and the results fused.
+        """
+        confidence, song = self._lookup_song(image, jacket_frames)
+
+        # Both players' chips go out in one OCR request
+        p1_requests = self.p1.requests(image) if player_presence[0] else []
+        p2_requests = self.p2.requests(image) if player_presence[1] else []
+        results = readtext_group(self.parser, p1_requests + p2_requests)
+        p1_results = self.p1.parse_results(results[:len(p1_requests)]) if player_presence[0] else None
+        p2_results = self.p2.parse_results(results[len(p1_requests):]) if player_presence[1] else None
+
+        if p1_results is not None and p1_results['difficulty'] is not None:
             notes, freeze, _ = song.song_data['Single'][p1_results['difficulty']]
             p1_results['max_ex_score'] = 3 * (notes + freeze)
 
-        if p2_results is not None:
+        if p2_results is not None and p2_results['difficulty'] is not None:
             notes, freeze, _ = song.song_data['Single'][p2_results['difficulty']]
             p2_results['max_ex_score'] = 3 * (notes + freeze)
 
@@ -101,11 +153,18 @@ class SplashParser:
         }
         return output
 
-    def _lookup_song(self, image):
-        # Need to convert it to RGB from BGR
-        jacket = extract_chip(image, self.jacket_bb)
-        jacket - jacket[..., ::-1].copy()
-        similarity, song = self.database.lookup(jacket)
+    def _lookup_song(self, image, jacket_frames=()):
+        if self.jitter <= 0 and not jacket_frames:
+            # Need to convert it to RGB from BGR
+            jacket = extract_chip(image, self.jacket_bb)
+            jacket = jacket[..., ::-1].copy()
+            similarity, song = self.database.lookup(jacket)
+            return similarity[0], song[0]
+
+        jackets = list()
+        for frame in (image, *jacket_frames):
+            jackets.extend(crop[..., ::-1].copy() for crop in jitter_crops(frame, self.jacket_bb, self.jitter))
+        similarity, song = self.database.lookup_batch(jackets, fusion=self.fusion)
         return similarity[0], song[0]
 
 
@@ -0,0 +1,99 @@
+import numpy as np
+
+from ddrcv.state.dhash import dhash, dhash_bits, hamming_distance, pack_hash
+from ddrcv.state.state_matcher import collect_matchers
+
+
+class StateClassifier:
+    """
+    Compiled version of `StateRotation.match`.
+
+    Rather than walking each state and hashing its ROIs one at a time, every template hash of every state is packed
+    into a single uint64 array up front. Each frame, all ROIs are hashed in one NumPy pass (grayscale crops come from
+    the rotation's RoiPlan, and ROIs of the same size are stacked and resampled together), and the Hamming distances
+    to every template are computed with a vectorized popcount. The best state is the one with the smallest distance
+    relative to its matcher's threshold.
+
+    Hashes are bit-identical to the PIL/imagehash path, so the existing .pkl templates and thresholds are unchanged.
+    Works with the StateRotation of any game (states, tbd5_states, sdvx_states).
+
+    Every template is hashed on every frame, whereas StateRotation stops at the first matching state (usually the
+    previous one). With the current templates, which all have different ROI sizes and so can't be stacked, the
+    rotation is faster: check `python -m ddrcv.bench` before enabling `compiled` in a driver config.
+    """
+    def __init__(self, rotation):
+        """
+        :param rotation: StateRotation instance providing the states to classify between
+        """
+        self.states = list(rotation.states)
+        self.roi_plan = rotation.roi_plan
+
+        matchers = []
+        state_index = []
+        for idx, state in enumerate(self.states):
+            for matcher in collect_matchers(state):
+                matchers.append(matcher)
+                state_index.append(idx)
+
+        self.matchers = matchers
+        self.state_index = np.array(state_index, dtype=np.intp)
+        self.template_hashes = np.stack([m.hash_matcher.template_hash for m in matchers], axis=0)
+        self.thresholds = np.array([m.hash_matcher.threshold for m in matchers], dtype=np.float64)
+
+        # Group ROIs by shape so that each group can be cropped, converted and resampled as a single stack
+        self.groups = dict()
+        for ii, matcher in enumerate(matchers):
+            _, _, w, h = matcher.roi
+            self.groups.setdefault((h, w), []).append((ii, tuple(matcher.roi)))
+
+    def _hash_rois(self, bgr_image):
+        hashes = np.empty_like(self.template_hashes)
+        for (h, w), entries in self.groups.items():
+            crops = [self.roi_plan.crop(bgr_image, roi) for _, roi in entries]
+            if len(crops) == 1:
+                hashes[entries[0][0]] = dhash(crops[0])
+            elif all(crop.shape == (h, w) for crop in crops):
+                bits = dhash_bits(np.stack(crops, axis=0))
+                hashes[[ii for ii, _ in entries]] = pack_hash(bits)
+            else:
+                # ROI runs off the edge of the frame; hash the truncated crops individually, like the PIL path would
+                for (ii, _), crop in zip(entries, crops):
+                    hashes[ii] = dhash(crop)
+        return hashes
+
+    def distances(self, bgr_image):
+        """
+        :return: Hamming distance of every template to its ROI in the given frame
+        """
+        self.roi_plan.prepare(bgr_image)
+        return hamming_distance(self.template_hashes, self._hash_rois(bgr_image))
+
+    def match(self, bgr_image):
+        """
+        :param bgr_image:
+        :return: (tag, data). Will return ('unknown', None) if the state can not be determined.
+        """
+        distances = self.distances(bgr_image)
+        hits = distances < self.thresholds
+        if not hits.any():
+            return 'unknown', None
+
+        scores = np.where(hits, distances / self.thresholds, np.inf)
+        state_scores = np.full(len(self.states), np.inf)
+        np.minimum.at(state_scores, self.state_index, scores)
+        winner = int(np.argmin(state_scores))
+        state = self.states[winner]
+
+        # Only the winning state runs its own match, to populate any state-specific data (player presence, lanes).
+        # Its matchers are handed the distances computed above, so no ROI is hashed twice.
+        own = np.nonzero(self.state_index == winner)[0]
+        for ii in own:
+            self.matchers[ii].precomputed = (bgr_image, int(distances[ii]))
+        try:
+            is_match, data = state.match(bgr_image)
+        finally:
+            for ii in own:
+                self.matchers[ii].precomputed = None
+        if not is_match:
+            return 'unknown', None
+        return state.tag, data
@@ -16,10 +16,21 @@ class StateMatcher:
         self.roi = roi
         self.glyph = rgb_glyph.copy()
         self.threshold_distance = threshold_distance
-        self.hash_matcher = HashMatcher(self.glyph, threshold_distance=self.threshold_distance)
+        # Glyphs are stored as RGB, but frames are matched in their native BGR
+        self.hash_matcher = HashMatcher(self.glyph[..., ::-1], threshold_distance=self.threshold_distance)
 
-    def match(self, rgb_image):
-        return self.hash_matcher.match_roi(rgb_image, self.roi)
+        # Set by RoiPlan.from_states when this matcher shares its crop/grayscale conversion with other matchers
+        self.roi_plan = None
+
+        # (frame, distance) set by StateClassifier, so a state's own match doesn't hash an ROI it already scored
+        self.precomputed = None
+
+    def match(self, bgr_image):
+        if self.precomputed is not None and self.precomputed[0] is bgr_image:
+            return self.precomputed[1] < self.hash_matcher.threshold
+        if self.roi_plan is not None:
+            return self.hash_matcher.match(self.roi_plan.crop(bgr_image, self.roi))
+        return self.hash_matcher.match_roi(bgr_image, self.roi)
 
     def serialize(self):
         output = {
@@ -47,3 +58,14 @@ class StateMatcher:
             params = pickle.load(fid)
         # return StateMatcher(params['name'], params['roi'], params['glyph'], threshold_distance=params['threshold'])
         return StateMatcher(params['name'], params['roi'], params['glyph'], threshold_distance=threshold_distance)
+
+
+def collect_matchers(state):
+    """Find every StateMatcher owned by a state, whether stored as a single attribute or a list of them."""
+    matchers = []
+    for value in vars(state).values():
+        if isinstance(value, StateMatcher):
+            matchers.append(value)
+        elif isinstance(value, (list, tuple)):
+            matchers.extend(x for x in value if isinstance(x, StateMatcher))
+    return matchers
@@ -0,0 +1,100 @@
+import time
+
+
+class StateTracker:
+    """
+    Temporal debouncing on top of a state determination object (a StateRotation of any game, or a StateClassifier).
+
+    A single frame of flicker (e.g. the scrolling background under "RESULTS" nudging the hash over threshold) is enough
+    to make the raw state bounce, which leads to double screenshots and premature scene transitions. The tracker only
+    commits a new state once it has been seen for N consecutive frames. N can be set per state, so that states where
+    latency matters (song_playing) can commit on the first frame while everything else waits for confirmation.
+
+    Both the raw and the committed state are exposed, along with how much latency the debounce added to each commit.
+    """
+    def __init__(self, rotation, min_frames=3, state_frames=None, clock=time.monotonic):
+        """
+        :param rotation: Object with a match(image) -> (tag, data) method
+        :param min_frames: Default number of consecutive agreeing frames required to commit a state
+        :param state_frames: Dict of per-state overrides of min_frames. Defaults to committing song_playing immediately.
+        :param clock: Monotonic clock returning seconds
+        """
+        self.rotation = rotation
+        self.min_frames = min_frames
+        self.state_frames = {'song_playing': 1} if state_frames is None else dict(state_frames)
+        self.clock = clock
+
+        # Committed state
+        self.state = 'unknown'
+        self.data = None
+
+        # Raw state from the most recent frame
+        self.raw_state = 'unknown'
+        self.raw_data = None
+
+        self._candidate = None
+        self._candidate_count = 0
+        self._candidate_since = None
+
+        # Latency (ms) between first seeing a state and committing it
+        self.last_latency_ms = 0.0
+        self.latency_stats = dict()
+
+    def required_frames(self, tag):
+        return self.state_frames.get(tag, self.min_frames)
+
+    def reset(self):
+        self.state = 'unknown'
+        self.data = None
+        self._candidate = None
+        self._candidate_count = 0
+        self._candidate_since = None
+
+    def match(self, bgr_image):
+        """
+        :param bgr_image:
+        :return: Committed (tag, data). data is None on frames whose raw state doesn't agree with the committed state
+                 (the last agreeing data stays in `data`), so per-frame work keyed on data (score extraction, player
+                 presence) never runs on frames that don't show the state. The raw result for this frame is available
+                 via raw_state/raw_data.
+        """
+        raw_tag, raw_data = self.rotation.match(bgr_image)
+        now = self.clock()
+
+        self.raw_state = raw_tag
+        self.raw_data = raw_data
+
+        if raw_tag == self._candidate:
+            self._candidate_count += 1
+        else:
+            self._candidate = raw_tag
+            self._candidate_count = 1
+            self._candidate_since = now
+
+        if raw_tag != self.state and self._candidate_count >= self.required_frames(raw_tag):
+            self._record_latency(raw_tag, 1000 * (now - self._candidate_since))
+            self.state = raw_tag
+
+        # Data always comes from the most recent frame that agreed with the committed state
+        if raw_tag != self.state:
+            return self.state, None
+        self.data = raw_data
+        return self.state, self.data
+
+    def _record_latency(self, tag, latency_ms):
+        self.last_latency_ms = latency_ms
+        count, total, worst = self.latency_stats.get(tag, (0, 0.0, 0.0))
+        self.latency_stats[tag] = (count + 1, total + latency_ms, max(worst, latency_ms))
+
+    def stats(self):
+        """
+        :return: Dict of tag -> {'commits', 'mean_latency_ms', 'max_latency_ms'}
+        """
+        output = dict()
+        for tag, (count, total, worst) in self.latency_stats.items():
+            output[tag] = {
+                'commits': count,
+                'mean_latency_ms': total / count,
+                'max_latency_ms': worst
+            }
+        return output
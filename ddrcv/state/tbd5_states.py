@@ -2,6 +2,7 @@ from pathlib import Path
 
 import cv2
 
+from ddrcv.state.roi_plan import RoiPlan
 from ddrcv.state.state_matcher import StateMatcher
 
 
@@ -25,8 +26,8 @@ class SimpleState(StateBase):
         super().__init__(tag, pkl_dir)
         self.matcher = StateMatcher.load(pkl_dir / pkl_file)
 
-    def match(self, rgb_image):
-        is_match = self.matcher.match(rgb_image)
+    def match(self, bgr_image):
+        is_match = self.matcher.match(bgr_image)
         return is_match, None
 
 
@@ -58,19 +59,19 @@ class SongPlaying(StateBase):
         # self.black_max = 80 / 100
         self.black_max = 80 / 100
 
-    def match(self, rgb_image):
-        is_match = self.p1_matcher.match(rgb_image) or self.p2_matcher.match(rgb_image)
+    def match(self, bgr_image):
+        is_match = self.p1_matcher.match(bgr_image) or self.p2_matcher.match(bgr_image)
         data = None
         if is_match:
-            gutters_present = self._is_gutter_present(rgb_image, self.p1_col) or \
-                              self._is_gutter_present(rgb_image, self.p2_col)
+            gutters_present = self._is_gutter_present(bgr_image, self.p1_col) or \
+                              self._is_gutter_present(bgr_image, self.p2_col)
             print(f'Gutters present: {gutters_present}')
             data = {'lanes_present': gutters_present}
 
         return is_match, data
 
-    def _is_gutter_present(self, rgb_image, col):
-        hsv = cv2.cvtColor(rgb_image[self.row_range[0]:self.row_range[1], col:col+1, ...], cv2.COLOR_RGB2HSV)
+    def _is_gutter_present(self, bgr_image, col):
+        hsv = cv2.cvtColor(bgr_image[self.row_range[0]:self.row_range[1], col:col+1, ...], cv2.COLOR_BGR2HSV)
         v = hsv[..., -1] / 255  # OpenCV Val is in [0, 255]
         v_max = v.max()
         return v_max < self.black_max
@@ -85,9 +86,9 @@ class SongSelect(StateBase):
                          StateMatcher.load(self.pkl_dir / 'song_select_eng_3.pkl'),
                          StateMatcher.load(self.pkl_dir / 'song_select_eng_4.pkl')]
 
-    def match(self, rgb_image):
+    def match(self, bgr_image):
         for idx, matcher in enumerate(self.matchers):
-            if matcher.match(rgb_image):
+            if matcher.match(bgr_image):
                 if idx > 0:
                     self.matchers = _circular_shift(self.matchers, idx)
                 return True, None
@@ -100,9 +101,9 @@ class SongSplash(StateBase):
         self.matcher_p1 = StateMatcher.load(pkl_dir / 'song_splash_p1.pkl')
         self.matcher_p2 = StateMatcher.load(pkl_dir / 'song_splash_p2.pkl')
 
-    def match(self, rgb_image):
-        p1 = self.matcher_p1.match(rgb_image)
-        p2 = self.matcher_p2.match(rgb_image)
+    def match(self, bgr_image):
+        p1 = self.matcher_p1.match(bgr_image)
+        p2 = self.matcher_p2.match(bgr_image)
         is_match = p1 or p2
         if is_match:
             return True, {'p1_present': p1, 'p2_present': p2}
@@ -118,9 +119,9 @@ class Results(StateBase):
                          StateMatcher.load(self.pkl_dir / 'results_p1_slow_2.pkl'),
                          StateMatcher.load(self.pkl_dir / 'results_p2_slow_1.pkl')]
 
-    def match(self, rgb_image):
+    def match(self, bgr_image):
         for idx, matcher in enumerate(self.matchers):
-            if matcher.match(rgb_image):
+            if matcher.match(bgr_image):
                 if idx > 0:
                     self.matchers = _circular_shift(self.matchers, idx)
                 return True, None
@@ -177,9 +178,12 @@ class StateRotation:
         for tag in states:
             self.states.append(state_factory(tag, pkl_dir=pkl_dir))
 
-    def match(self, rgb_image):
+        # Matchers that look at the same part of the screen share a single crop + grayscale conversion per frame
+        self.roi_plan = RoiPlan.from_states(self.states)
+
+    def match(self, bgr_image):
         """
-        :param rgb_image:
+        :param bgr_image:
         :return: (tag, data). Will return ('unknown', None) if the state can not be determined.
         """
         best_idx = 0
@@ -187,8 +191,9 @@ class StateRotation:
         data = None
         state_tag = 'unknown'
 
+        self.roi_plan.prepare(bgr_image)
         for ii, matcher in enumerate(self.states):
-            is_match, data = matcher.match(rgb_image)
+            is_match, data = matcher.match(bgr_image)
             if is_match:
                 best_idx = ii
                 state_tag = matcher.tag
@@ -204,12 +209,8 @@ class StateRotation:
 
 
 if __name__ == "__main__":
-    from PIL import Image
-    import numpy as np
-
-    image = Image.open('../../state_images/song_splash_updated_p2.png')
-    image = Image.open('../../state_images/total_result_updated.png')
-    image = np.array(image)
+    image = cv2.imread('../../state_images/song_splash_updated_p2.png')
+    image = cv2.imread('../../state_images/total_result_updated.png')
 
     # state = SongSplash(_resolve_pkl_dir(None))
     state = StateRotation()